@@ -0,0 +1,336 @@
+"""Admin-only diagnostics endpoints."""
+
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response
+
+from app.core.auth import get_current_user, require_permission
+from app.models.user import User
+from shared.monitoring.profiler import sample_for
+from shared.monitoring.slow_calls import slow_call_recorder
+from shared.monitoring.allocations import allocation_profiler
+from shared.monitoring.decorators import (
+    INSTRUMENTATION_LEVELS,
+    get_instrumentation_level,
+    set_instrumentation_level,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+MAX_PROFILE_SECONDS = 60
+
+
+@router.get("/profile")
+async def profile(
+    seconds: float = Query(
+        10.0, gt=0, le=MAX_PROFILE_SECONDS, description="Sampling duration in seconds"
+    ),
+    interval_ms: float = Query(
+        10.0, ge=1, le=1000, description="Sampling interval in milliseconds"
+    ),
+    format: str = Query(
+        "collapsed", pattern="^(collapsed|speedscope)$", description="Output format"
+    ),
+    include_tasks: bool = Query(
+        True,
+        description="Also sample suspended asyncio tasks running traced operations",
+    ),
+    current_user: User = Depends(get_current_user),
+    _: None = Depends(require_permission("diagnostics:profile")),
+):
+    """
+    Sample every thread and asyncio task stack for ``seconds`` and return the profile.
+
+    ``collapsed`` returns flamegraph.pl-compatible text; ``speedscope`` returns a
+    JSON document for https://www.speedscope.app. Frames in square brackets are
+    the ``trace_function`` operations active when the sample was taken.
+
+    Requires: diagnostics:profile permission
+    """
+    logger.info(
+        "Profiling requested",
+        extra={
+            "custom_dimensions": {
+                "user_id": str(current_user.id),
+                "seconds": seconds,
+                "interval_ms": interval_ms,
+                "format": format,
+            }
+        },
+    )
+
+    try:
+        stack_profile = await sample_for(
+            seconds, interval=interval_ms / 1000, include_tasks=include_tasks
+        )
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"error": {"code": "PROFILE_IN_PROGRESS", "message": str(e)}},
+        )
+
+    if format == "speedscope":
+        return stack_profile.to_speedscope(name=f"user-service {seconds}s")
+    return PlainTextResponse(stack_profile.to_collapsed())
+
+
+@router.get("/slow-calls")
+async def list_slow_calls(
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of calls"),
+    operation: Optional[str] = Query(
+        None, description="Only calls of this trace_function operation"
+    ),
+    _: None = Depends(require_permission("diagnostics:read")),
+):
+    """
+    The slowest recorded calls since the last clear, slowest first.
+
+    Each call carries argument shapes, its span tree and the asyncio task
+    stack captured when it crossed its threshold.
+
+    Requires: diagnostics:read permission
+    """
+    return {
+        "default_threshold_ms": slow_call_recorder.default_threshold * 1000,
+        "thresholds_ms": {
+            name: seconds * 1000
+            for name, seconds in slow_call_recorder.thresholds.items()
+        },
+        "calls": slow_call_recorder.get_slow_calls(limit=limit, operation=operation),
+    }
+
+
+@router.put("/slow-calls/thresholds/{operation}")
+async def set_slow_call_threshold(
+    operation: str,
+    threshold_ms: float = Body(..., gt=0, embed=True),
+    current_user: User = Depends(get_current_user),
+    _: None = Depends(require_permission("diagnostics:write")),
+):
+    """
+    Set the slow-call threshold for one operation.
+
+    Requires: diagnostics:write permission
+    """
+    slow_call_recorder.set_threshold(operation, threshold_ms / 1000)
+    logger.info(
+        "Slow call threshold updated",
+        extra={
+            "custom_dimensions": {
+                "user_id": str(current_user.id),
+                "operation": operation,
+                "threshold_ms": threshold_ms,
+            }
+        },
+    )
+    return {"operation": operation, "threshold_ms": threshold_ms}
+
+
+@router.delete("/slow-calls", status_code=204)
+async def clear_slow_calls(_: None = Depends(require_permission("diagnostics:write"))):
+    """
+    Discard all recorded slow calls.
+
+    Requires: diagnostics:write permission
+    """
+    slow_call_recorder.clear()
+
+
+@router.get("/allocations")
+async def allocation_summary(_: None = Depends(require_permission("diagnostics:read"))):
+    """
+    Sampled per-operation allocation metrics and top allocation sites.
+
+    Requires: diagnostics:read permission
+    """
+    return allocation_profiler.get_summary()
+
+
+@router.put("/allocations/sample-rate")
+async def set_allocation_sample_rate(
+    sample_rate: float = Body(..., ge=0, le=1, embed=True),
+    current_user: User = Depends(get_current_user),
+    _: None = Depends(require_permission("diagnostics:write")),
+):
+    """
+    Enable allocation sampling at ``sample_rate``, or disable it with 0.
+
+    tracemalloc runs, process-wide, only while a sampled call is in progress.
+
+    Requires: diagnostics:write permission
+    """
+    if sample_rate > 0:
+        allocation_profiler.enable(sample_rate)
+    else:
+        allocation_profiler.disable()
+    logger.info(
+        "Allocation sample rate updated",
+        extra={
+            "custom_dimensions": {
+                "user_id": str(current_user.id),
+                "sample_rate": sample_rate,
+            }
+        },
+    )
+    return {"sample_rate": sample_rate, "enabled": allocation_profiler.enabled}
+
+
+@router.post("/allocations/{operation}/capture", status_code=202)
+async def capture_allocations(
+    operation: str,
+    current_user: User = Depends(get_current_user),
+    _: None = Depends(require_permission("diagnostics:write")),
+):
+    """
+    Take a tracemalloc snapshot diff around the next call of ``operation``.
+
+    Download it from ``/allocations/{operation}/diff`` once the call has run.
+
+    Requires: diagnostics:write permission
+    """
+    allocation_profiler.request_capture(operation)
+    logger.info(
+        "Allocation capture requested",
+        extra={
+            "custom_dimensions": {
+                "user_id": str(current_user.id),
+                "operation": operation,
+            }
+        },
+    )
+    return {"operation": operation, "pending": True}
+
+
+@router.get("/allocations/{operation}/diff")
+async def download_allocation_diff(
+    operation: str, _: None = Depends(require_permission("diagnostics:read"))
+):
+    """
+    Download the most recent captured tracemalloc snapshot diff for an operation.
+
+    Requires: diagnostics:read permission
+    """
+    diff = allocation_profiler.get_snapshot_diff(operation)
+    if diff is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": {
+                    "code": "ALLOCATION_DIFF_NOT_FOUND",
+                    "message": f"No allocation diff recorded for {operation}",
+                }
+            },
+        )
+    return Response(
+        content=diff,
+        media_type="text/plain",
+        headers={
+            "Content-Disposition": f'attachment; filename="{operation}-allocations.txt"'
+        },
+    )
+
+
+@router.put("/instrumentation")
+async def set_instrumentation(
+    level: str = Body(..., embed=True),
+    sampling_rate: Optional[float] = Body(None, ge=0, le=1, embed=True),
+    current_user: User = Depends(get_current_user),
+    _: None = Depends(require_permission("diagnostics:write")),
+):
+    """
+    Switch the trace_function/trace_method instrumentation level at runtime.
+
+    Functions decorated while the level was "off" stay uninstrumented until restart.
+
+    Requires: diagnostics:write permission
+    """
+    if level not in INSTRUMENTATION_LEVELS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": {
+                    "code": "INVALID_INSTRUMENTATION_LEVEL",
+                    "message": "Level must be one of: "
+                    + ", ".join(INSTRUMENTATION_LEVELS),
+                }
+            },
+        )
+    set_instrumentation_level(level, sampling_rate)
+    logger.info(
+        "Instrumentation level updated",
+        extra={
+            "custom_dimensions": {
+                "user_id": str(current_user.id),
+                "level": level,
+                "sampling_rate": sampling_rate,
+            }
+        },
+    )
+    return {"level": get_instrumentation_level()}
+
+
+def _get_quota_engine(request: Request):
+    quota_engine = getattr(request.app.state, "quotas", None)
+    if quota_engine is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": {
+                    "code": "QUOTAS_DISABLED",
+                    "message": (
+                        "Identity quotas are not enabled (ENABLE_IDENTITY_QUOTAS)"
+                    ),
+                }
+            },
+        )
+    return quota_engine
+
+
+@router.get("/rate-limits")
+async def get_rate_limits(
+    request: Request, _: None = Depends(require_permission("quota_policy:read"))
+):
+    """
+    Current quota policy and counters.
+
+    Requires: quota_policy:read permission
+    """
+    quota_engine = _get_quota_engine(request)
+    return {"policy": quota_engine.policy.config, "stats": quota_engine.get_stats()}
+
+
+@router.put("/rate-limits")
+async def set_rate_limits(
+    request: Request,
+    policy: Dict[str, Any] = Body(...),
+    current_user: User = Depends(get_current_user),
+    _: None = Depends(require_permission("quota_policy:write")),
+):
+    """
+    Replace the quota policy at runtime; counters start afresh.
+
+    Lasts until the policy file changes or the service restarts.
+
+    Requires: quota_policy:write permission
+    """
+    quota_engine = _get_quota_engine(request)
+    try:
+        quota_engine.reload(policy)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": {"code": "INVALID_QUOTA_POLICY", "message": str(e)}},
+        )
+    logger.info(
+        "Quota policy updated",
+        extra={
+            "custom_dimensions": {
+                "user_id": str(current_user.id),
+                "route_classes": sorted(quota_engine.policy.limits),
+            }
+        },
+    )
+    return {"policy": quota_engine.policy.config}
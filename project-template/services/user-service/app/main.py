@@ -3,18 +3,16 @@ User Service - Compliance Flow Platform
 Main FastAPI application entry point with comprehensive monitoring and observability
 """
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
 import logging
 import time
-import os
 from typing import Dict, Any
 
 # Application Insights and OpenTelemetry
-from opencensus.ext.azure.log_exporter import AzureLogHandler
 from opencensus.ext.azure.trace_exporter import AzureExporter
 from opencensus.trace.samplers import ProbabilitySampler
 from opencensus.trace import config_integration
@@ -23,21 +21,91 @@ from opencensus.ext.fastapi.fastapi_middleware import FastAPIMiddleware
 from app.core.config import settings
 from app.core.database import init_db, get_db
 from app.core.logging import setup_logging
-from app.api.routes import auth, users, business_units
-from app.middleware.request_id import RequestIDMiddleware
-from app.middleware.error_handler import ErrorHandlerMiddleware
-from app.middleware.metrics import MetricsMiddleware
-from app.middleware.security import SecurityMiddleware
+from app.api.routes import auth, users, business_units, admin
+from app.middleware.metrics import MetricsMiddleware, get_metrics_summary
+from app.middleware.security import SecurityMiddleware, get_security_summary
+from app.middleware.pipeline import RequestPipeline, get_pipeline_summary
+from app.middleware.rate_limit import DistributedRateLimiter, RedisRateLimitBackend
+from app.middleware.blocklist import IpBlocklist
+from app.middleware.abuse import AbuseScorer
+from app.middleware.quotas import JwtIdentityResolver, QuotaEngine
+from shared.monitoring.metering import UsageMeter, JsonLinesUsageSink
+from shared.monitoring.queries import QueryTracker
+from shared.monitoring.resilience import get_resilience_stats
+from shared.monitoring.slow_calls import slow_call_recorder
+from shared.monitoring.allocations import allocation_profiler
+from shared.monitoring.decorators import (
+    get_cardinality_report,
+    set_instrumentation_level,
+)
+from shared.monitoring.exporters import StatsDExporter
+from shared.monitoring.process_stats import ProcessStatsCollector
 
 # Setup logging and monitoring
 setup_logging()
 
 # Configure OpenCensus integrations for distributed tracing
-config_integration.trace_integrations(['sqlalchemy', 'requests', 'httpx', 'postgresql'])
+config_integration.trace_integrations(["sqlalchemy", "requests", "httpx", "postgresql"])
 
 # Application start time for metrics
 START_TIME = time.time()
 
+# Per-tenant usage metering, flushed as rollups on a background thread to
+# USAGE_METERING_PATH (absolute, so it does not depend on the working directory)
+usage_meter = UsageMeter(
+    sink=JsonLinesUsageSink(
+        getattr(settings, "USAGE_METERING_PATH", "") or "/app/usage/usage_rollups.jsonl"
+    ),
+    flush_interval=getattr(settings, "USAGE_FLUSH_INTERVAL_SECONDS", 60.0),
+    service_name="user-service",
+)
+
+# Instrumentation level for trace_function/trace_method (off, counters, sampled, full)
+set_instrumentation_level(
+    getattr(settings, "MONITORING_INSTRUMENTATION_LEVEL", "full"),
+    getattr(settings, "MONITORING_INSTRUMENTATION_SAMPLE_RATE", 1.0),
+)
+
+# Default threshold for the slow-call recorder behind /api/v1/admin/slow-calls
+slow_call_recorder.default_threshold = getattr(
+    settings, "SLOW_CALL_THRESHOLD_SECONDS", 1.0
+)
+
+# Per-request query fingerprints and N+1 detection
+query_tracker = QueryTracker(
+    n_plus_one_threshold=getattr(settings, "N_PLUS_ONE_THRESHOLD", 10)
+)
+
+# Process and GC statistics from /proc, refreshed in the background for /metrics
+process_stats = ProcessStatsCollector(
+    refresh_interval=getattr(settings, "PROCESS_STATS_INTERVAL_SECONDS", 5.0)
+)
+
+# HTTP metrics for the request pipeline; health status follows SLOs over a
+# rolling window
+metrics_collector = MetricsMiddleware(
+    None,
+    window_seconds=getattr(settings, "METRICS_WINDOW_SECONDS", 300),
+    slo={
+        "max_error_rate": getattr(settings, "SLO_MAX_ERROR_RATE", 0.05),
+        "max_p95_duration_ms": getattr(settings, "SLO_MAX_P95_DURATION_MS", 1000.0),
+    },
+    usage_meter=usage_meter,
+    query_tracker=query_tracker,
+)
+
+# Optional StatsD push for deployments that cannot be scraped (disabled when
+# STATSD_HOST is empty)
+statsd_exporter = None
+if getattr(settings, "STATSD_HOST", ""):
+    statsd_exporter = StatsDExporter(
+        host=settings.STATSD_HOST,
+        port=getattr(settings, "STATSD_PORT", 8125),
+        prefix=getattr(settings, "STATSD_PREFIX", "complianceflow"),
+        flush_interval=getattr(settings, "STATSD_FLUSH_INTERVAL_SECONDS", 10.0),
+        max_packet_size=getattr(settings, "STATSD_MAX_PACKET_SIZE", 1432),
+    )
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -47,7 +115,26 @@ async def lifespan(app: FastAPI):
     try:
         await init_db()
         logging.info("Database initialized successfully")
-        
+        usage_meter.start()
+        process_stats.start()
+        metrics_collector.start(app)
+        if statsd_exporter is not None:
+            statsd_exporter.start()
+
+        # Threat feed of addresses and CIDR ranges, loaded before serving
+        blocklist_feed = getattr(settings, "IP_BLOCKLIST_FEED", "")
+        if blocklist_feed:
+            ip_blocklist.load_feed_file(
+                blocklist_feed, getattr(settings, "IP_BLOCKLIST_FEED_TTL_SECONDS", None)
+            )
+        # Later prefix changes are compiled off the request path
+        ip_blocklist.start()
+
+        # Opt-in allocation sampling for trace_function(track_allocations=True)
+        allocation_sample_rate = getattr(settings, "ALLOCATION_SAMPLE_RATE", 0.0)
+        if allocation_sample_rate > 0:
+            allocation_profiler.enable(allocation_sample_rate)
+
         # Log service startup to Application Insights
         logger = logging.getLogger(__name__)
         logger.info(
@@ -57,18 +144,25 @@ async def lifespan(app: FastAPI):
                     "service": "user-service",
                     "version": "1.0.0",
                     "environment": settings.environment,
-                    "startup_time": time.time() - START_TIME
+                    "startup_time": time.time() - START_TIME,
                 }
-            }
+            },
         )
     except Exception as e:
         logging.error(f"Failed to start User Service: {e}")
         raise
-    
+
     yield
-    
+
     # Shutdown
     logging.info("Shutting down User Service...")
+    usage_meter.stop()
+    ip_blocklist.stop()
+    process_stats.stop()
+    metrics_collector.stop()
+    if statsd_exporter is not None:
+        statsd_exporter.stop()
+    allocation_profiler.disable()
 
 
 # Create FastAPI application with enhanced configuration
@@ -86,45 +180,106 @@ app = FastAPI(
 app.state.start_time = START_TIME
 
 # Add Application Insights middleware for distributed tracing
-if hasattr(settings, 'APPLICATIONINSIGHTS_CONNECTION_STRING') and settings.APPLICATIONINSIGHTS_CONNECTION_STRING:
+if (
+    hasattr(settings, "APPLICATIONINSIGHTS_CONNECTION_STRING")
+    and settings.APPLICATIONINSIGHTS_CONNECTION_STRING
+):
     app.add_middleware(
         FastAPIMiddleware,
         exporter=AzureExporter(
             connection_string=settings.APPLICATIONINSIGHTS_CONNECTION_STRING
         ),
-        sampler=ProbabilitySampler(rate=getattr(settings, 'MONITORING_SAMPLING_RATE', 1.0))
+        sampler=ProbabilitySampler(
+            rate=getattr(settings, "MONITORING_SAMPLING_RATE", 1.0)
+        ),
     )
 
-# Add security middleware (before CORS)
-app.add_middleware(SecurityMiddleware)
+# Blocked addresses and ranges, shared with the lifespan feed loader
+ip_blocklist = IpBlocklist(
+    rebuild_interval=getattr(settings, "IP_BLOCKLIST_REBUILD_INTERVAL_SECONDS", 1.0)
+)
 
-# Add metrics middleware
-app.add_middleware(MetricsMiddleware)
+# Tenant and user of the validated bearer token, for usage metering and quotas
+identity_resolver = JwtIdentityResolver(settings.SECRET_KEY, settings.ALGORITHM)
+
+# Quotas per tenant, user, client IP and route class from the validated bearer
+# token (per IP for anonymous requests); QUOTA_POLICY_FILE is reloaded when it changes
+quota_engine = None
+if getattr(settings, "ENABLE_IDENTITY_QUOTAS", False):
+    quota_engine = QuotaEngine(
+        identity_resolver=identity_resolver,
+        policy_path=getattr(settings, "QUOTA_POLICY_FILE", "") or None,
+        max_keys=getattr(settings, "RATE_LIMIT_MAX_TRACKED_CLIENTS", 100000),
+    )
+    # Exposed for the admin rate limit endpoints
+    app.state.quotas = quota_engine
+
+# Rate limits shared by every replica through Redis. When Redis is slow or
+# unreachable every process falls back to its own limiter at once, so each gets
+# RATE_LIMIT_LOCAL_REQUESTS, or by default its share of the global limit,
+# RATE_LIMIT_REQUESTS // RATE_LIMIT_EXPECTED_REPLICAS (pods x workers)
+shared_rate_limiter = None
+if getattr(settings, "RATE_LIMIT_BACKEND", "local") == "redis":
+    from redis import asyncio as redis_asyncio
+
+    shared_rate_limiter = DistributedRateLimiter(
+        RedisRateLimitBackend(redis_asyncio.from_url(settings.REDIS_URL)),
+        limit=getattr(settings, "RATE_LIMIT_REQUESTS", 100),
+        window=getattr(settings, "RATE_LIMIT_WINDOW", 60),
+        local_limit=getattr(settings, "RATE_LIMIT_LOCAL_REQUESTS", None) or None,
+        expected_replicas=getattr(settings, "RATE_LIMIT_EXPECTED_REPLICAS", 32),
+        max_lease=getattr(settings, "RATE_LIMIT_MAX_LEASE", 16),
+        timeout=getattr(settings, "RATE_LIMIT_BACKEND_TIMEOUT_MS", 50) / 1000,
+    )
+
+# Request id, security checks, metrics and error mapping run as one fused ASGI
+# pass; the stages are configured here and GET /health/live bypasses them
+app.add_middleware(
+    RequestPipeline,
+    security=SecurityMiddleware(
+        None,
+        max_requests_per_minute=getattr(settings, "RATE_LIMIT_REQUESTS", 100),
+        rate_limit_window=getattr(settings, "RATE_LIMIT_WINDOW", 60),
+        max_tracked_clients=getattr(settings, "RATE_LIMIT_MAX_TRACKED_CLIENTS", 100000),
+        shared_rate_limiter=shared_rate_limiter,
+        max_body_bytes=getattr(settings, "MAX_REQUEST_BODY_BYTES", 10 * 1024 * 1024),
+        blocklist=ip_blocklist,
+        abuse_scorer=AbuseScorer(
+            half_life=getattr(settings, "ABUSE_SCORE_HALF_LIFE_SECONDS", 300),
+            max_keys=getattr(settings, "ABUSE_MAX_TRACKED_CLIENTS", 100000),
+        ),
+        quota_engine=quota_engine,
+        identity_resolver=identity_resolver,
+        trusted_proxies=[
+            proxy.strip()
+            for proxy in getattr(settings, "TRUSTED_PROXIES", "").split(",")
+            if proxy.strip()
+        ]
+        or None,
+    ),
+    metrics=metrics_collector,
+)
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=getattr(settings, 'allowed_origins', ["*"]),
+    allow_origins=getattr(settings, "allowed_origins", ["*"]),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 # Trusted host middleware for production security
-if hasattr(settings, 'allowed_hosts') and settings.allowed_hosts:
-    app.add_middleware(
-        TrustedHostMiddleware,
-        allowed_hosts=settings.allowed_hosts
-    )
-
-# Request ID and error handling middleware
-app.add_middleware(RequestIDMiddleware)
-app.add_middleware(ErrorHandlerMiddleware)
+if hasattr(settings, "allowed_hosts") and settings.allowed_hosts:
+    app.add_middleware(TrustedHostMiddleware, allowed_hosts=settings.allowed_hosts)
 
 # Include API routers
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
 app.include_router(users.router, prefix="/api/v1/users", tags=["Users"])
-app.include_router(business_units.router, prefix="/api/v1/business-units", tags=["Business Units"])
+app.include_router(
+    business_units.router, prefix="/api/v1/business-units", tags=["Business Units"]
+)
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["Admin"])
 
 
 @app.get("/", include_in_schema=False)
@@ -136,7 +291,7 @@ async def root():
         "status": "healthy",
         "description": "Identity and Access Management for Compliance Flow",
         "timestamp": time.time(),
-        "environment": settings.environment
+        "environment": settings.environment,
     }
 
 
@@ -149,7 +304,7 @@ async def health_check():
         "version": "1.0.0",
         "timestamp": time.time(),
         "environment": settings.environment,
-        "uptime_seconds": time.time() - START_TIME
+        "uptime_seconds": time.time() - START_TIME,
     }
 
 
@@ -163,9 +318,9 @@ async def readiness_check():
             if not result:
                 raise Exception("Database query failed")
             break
-        
+
         # Add other dependency checks here (Redis, Kafka, etc.)
-        
+
         return {
             "status": "ready",
             "service": "user-service",
@@ -174,7 +329,7 @@ async def readiness_check():
             "dependencies": {
                 "database": "connected",
                 # Add other dependencies status
-            }
+            },
         }
     except Exception as e:
         logging.error(f"Readiness check failed: {e}")
@@ -184,8 +339,8 @@ async def readiness_check():
                 "status": "not_ready",
                 "service": "user-service",
                 "error": str(e),
-                "timestamp": time.time()
-            }
+                "timestamp": time.time(),
+            },
         )
 
 
@@ -197,7 +352,7 @@ async def liveness_check():
         "service": "user-service",
         "version": "1.0.0",
         "timestamp": time.time(),
-        "uptime_seconds": time.time() - START_TIME
+        "uptime_seconds": time.time() - START_TIME,
     }
 
 
@@ -205,47 +360,47 @@ async def liveness_check():
 async def metrics():
     """Prometheus-compatible metrics endpoint."""
     uptime = time.time() - START_TIME
-    
+
     # Basic metrics - in production this would use prometheus_client
     metrics_data = {
         "service_info": {
             "name": "user_service",
             "version": "1.0.0",
-            "environment": settings.environment
+            "environment": settings.environment,
         },
         "uptime_seconds": uptime,
         "start_time": START_TIME,
         "current_time": time.time(),
         # Add more metrics as needed
         "memory_usage": _get_memory_usage(),
-        "request_count": getattr(app.state, 'request_count', 0)
+        "process": process_stats.get_stats(),
+        "request_count": getattr(app.state, "request_count", 0),
+        "http": get_metrics_summary(app),
+        "security": get_security_summary(app),
+        "pipeline": get_pipeline_summary(app),
+        "queries": query_tracker.get_summary(),
+        "external_services": get_resilience_stats(),
+        "allocations": allocation_profiler.get_summary(),
+        "cardinality": get_cardinality_report(),
     }
-    
+    if statsd_exporter is not None:
+        metrics_data["statsd"] = statsd_exporter.get_stats()
+
     return metrics_data
 
 
 def _get_memory_usage() -> Dict[str, Any]:
-    """Get current memory usage information."""
-    try:
-        import psutil
-        process = psutil.Process()
-        memory_info = process.memory_info()
-        return {
-            "rss_bytes": memory_info.rss,
-            "vms_bytes": memory_info.vms,
-            "percent": process.memory_percent()
-        }
-    except ImportError:
-        return {"error": "psutil not available"}
-    except Exception as e:
-        return {"error": str(e)}
+    """Get current memory usage information from the cached process stats."""
+    stats = process_stats.get_stats()
+    return {
+        "rss_bytes": stats.get("rss_bytes"),
+        "vms_bytes": stats.get("vms_bytes"),
+        "rss_peak_bytes": stats.get("rss_peak_bytes"),
+        "percent": stats.get("percent"),
+    }
 
 
 if __name__ == "__main__":
-    import uvicorn
     uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=settings.environment == "dev"
+        "app.main:app", host="0.0.0.0", port=8000, reload=settings.environment == "dev"
     )
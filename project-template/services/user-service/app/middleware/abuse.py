@@ -0,0 +1,155 @@
+"""
+Adaptive abuse scoring for the security middleware.
+
+Each client key holds one ``(score, last update)`` pair. Signals add their
+weight to the score, which halves every ``half_life`` seconds in between, so
+the score of a client reflects recent behaviour only. When a signal leaves
+a score at or above a ban tier threshold the caller bans the client for
+that tier's duration; higher thresholds give longer bans, and a client that
+keeps misbehaving after a ban climbs into them. A busy NAT gateway that
+trips one signal decays back to zero instead of being locked out for good.
+
+Keys live in an LRU bounded by ``max_keys``; keys whose score has decayed to
+nothing are dropped from the cold end as new keys arrive.
+"""
+
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+
+DEFAULT_MAX_KEYS = 100_000
+
+DEFAULT_HALF_LIFE_SECONDS = 300.0
+
+# Points per signal
+DEFAULT_SIGNAL_WEIGHTS: Dict[str, float] = {
+    "malicious_user_agent": 25.0,
+    "suspicious_pattern": 10.0,
+    "body_too_large": 5.0,
+    "rate_limited": 2.0,
+    "client_error": 1.0,
+}
+
+# (score threshold, ban seconds), ascending
+DEFAULT_BAN_TIERS: Tuple[Tuple[float, float], ...] = (
+    (20.0, 60.0),
+    (50.0, 900.0),
+    (100.0, 3600.0),
+)
+
+# Scores below this carry no information and are forgotten
+SCORE_FLOOR = 0.5
+
+
+class AbuseScorer:
+    """
+    Exponentially decaying per-client abuse scores with ban tiers.
+
+    Usage:
+        scorer = AbuseScorer()
+        ban_seconds = scorer.record(client_ip, "suspicious_pattern")
+        if ban_seconds:
+            blocklist.add(client_ip, ttl=ban_seconds)
+
+    Not thread-safe; the middleware calls it from the event loop only.
+    """
+
+    def __init__(
+        self,
+        half_life: float = DEFAULT_HALF_LIFE_SECONDS,
+        weights: Optional[Mapping[str, float]] = None,
+        ban_tiers: Sequence[Tuple[float, float]] = DEFAULT_BAN_TIERS,
+        max_keys: int = DEFAULT_MAX_KEYS,
+    ):
+        self.half_life = half_life
+        self.decay_rate = math.log(2) / half_life
+        self.weights = dict(DEFAULT_SIGNAL_WEIGHTS if weights is None else weights)
+        self.ban_tiers = tuple(sorted(ban_tiers))
+        self.max_keys = max_keys
+        # key -> (score, monotonic seconds of last update)
+        self._scores: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.signals: Dict[str, int] = {signal: 0 for signal in self.weights}
+        self.bans: Dict[float, int] = {seconds: 0 for _, seconds in self.ban_tiers}
+        self.expired = 0
+        self.evicted = 0
+
+    def _decayed(self, state: Optional[Tuple[float, float]], now: float) -> float:
+        if state is None:
+            return 0.0
+        score, updated = state
+        return score * math.exp(-self.decay_rate * max(0.0, now - updated))
+
+    def score(self, key: str, now: Optional[float] = None) -> float:
+        """Current score of ``key``."""
+        if now is None:
+            now = time.monotonic()
+        return self._decayed(self._scores.get(key), now)
+
+    def record(self, key: str, signal: str, now: Optional[float] = None) -> float:
+        """
+        Add ``signal``'s weight to ``key``'s score.
+
+        Returns the ban duration of the highest tier the score has reached,
+        or 0 below the first tier. Unknown signals weigh nothing.
+        """
+        weight = self.weights.get(signal, 0.0)
+        if not weight:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        self.signals[signal] += 1
+        scores = self._scores
+        before = self._decayed(scores.get(key), now)
+        after = before + weight
+        if key in scores:
+            scores.move_to_end(key)
+            scores[key] = (after, now)
+        else:
+            scores[key] = (after, now)
+            self._evict(now)
+
+        ban_seconds = 0.0
+        for threshold, seconds in self.ban_tiers:
+            if after >= threshold:
+                ban_seconds = seconds
+        if ban_seconds:
+            self.bans[ban_seconds] += 1
+        return ban_seconds
+
+    def _evict(self, now: float):
+        """Drop decayed keys, then the least recently seen keys past the cap."""
+        scores = self._scores
+        # Bounded per call so one request never pays for a large sweep
+        for _ in range(2):
+            oldest_key = next(iter(scores))
+            if self._decayed(scores[oldest_key], now) >= SCORE_FLOOR:
+                break
+            del scores[oldest_key]
+            self.expired += 1
+        while len(scores) > self.max_keys:
+            scores.popitem(last=False)
+            self.evicted += 1
+
+    def reset(self, key: Optional[str] = None):
+        """Forget one key, or every key."""
+        if key is None:
+            self._scores.clear()
+        else:
+            self._scores.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def get_stats(self) -> dict:
+        return {
+            "tracked_keys": len(self._scores),
+            "max_keys": self.max_keys,
+            "half_life_seconds": self.half_life,
+            "signals": dict(self.signals),
+            "bans_by_tier_seconds": {
+                str(int(seconds)): count for seconds, count in self.bans.items()
+            },
+            "expired_keys": self.expired,
+            "evicted_keys": self.evicted,
+        }
@@ -0,0 +1,461 @@
+"""
+IP blocklist for the security middleware.
+
+Single addresses live in a dict keyed by their canonical string, so the
+common lookup (a client's own address, exactly as it appears in the request)
+is one dict probe with no parsing. Prefixes are compiled per address family into
+sorted, disjoint integer segments, with a table from the top 16 bits of an
+address to the segments it can fall in. A lookup is one ``inet_pton``, one
+dict probe and a bisect over a handful of segments.
+
+Every entry carries its own expiry. Expired entries stop matching at once
+and are dropped on ``purge_expired``. Lookups never build segments: after
+prefixes are added, removed or purged, lookups probe the prefix dict once per
+prefix length in use until ``rebuild`` (run by the feed loader and by the
+``start`` thread) compiles the new segments and swaps them in, so a feed of
+hundreds of thousands of prefixes is never sorted inside a request.
+
+IPv4-mapped IPv6 addresses (``::ffff:192.0.2.1``) are matched as the IPv4
+address they carry, so dual-stack listeners cannot bypass IPv4 entries.
+"""
+
+import math
+import time
+import socket
+import logging
+import threading
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FAMILY_BITS: Dict[int, int] = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+# ::ffff:0:0/96, IPv4 addresses carried in IPv6
+IPV4_MAPPED_PREFIX = 0xFFFF << 32
+
+# Exact entries beyond this trigger a sweep of expired ones on the next add
+DEFAULT_PURGE_THRESHOLD = 10_000
+
+
+def parse_network(text: str) -> Tuple[int, int, int]:
+    """
+    Parse ``"203.0.113.0/24"``, ``"2001:db8::/32"`` or a bare address.
+
+    Returns (family, first address, prefix length) with host bits cleared;
+    IPv4-mapped IPv6 entries (``::ffff:192.0.2.0/120``) come back as IPv4.
+    Raises ValueError for anything else.
+    """
+    address, _, length = text.strip().partition("/")
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    bits = FAMILY_BITS[family]
+    try:
+        start = int.from_bytes(socket.inet_pton(family, address), "big")
+    except OSError:
+        raise ValueError(f"Invalid IP address: {address!r}")
+    prefix = bits
+    if length:
+        if not length.isdigit() or int(length) > bits:
+            raise ValueError(f"Invalid prefix length: {text!r}")
+        prefix = int(length)
+    if family == socket.AF_INET6 and prefix >= 96 and start >> 32 == 0xFFFF:
+        family, start, prefix, bits = (
+            socket.AF_INET,
+            start & 0xFFFFFFFF,
+            prefix - 96,
+            32,
+        )
+    host_bits = bits - prefix
+    return family, start >> host_bits << host_bits, prefix
+
+
+def format_address(family: int, value: int) -> str:
+    return socket.inet_ntop(family, value.to_bytes(FAMILY_BITS[family] // 8, "big"))
+
+
+class RangeIndex:
+    """
+    Compiled, immutable view of one family's prefixes, for lookups.
+
+    Nested prefixes are flattened into disjoint segments, each carrying the
+    latest expiry of the prefixes covering it: an address is blocked while
+    any prefix covering it is unexpired. A table keyed by the top
+    ``BUCKET_BITS`` of the address narrows each bisect to the few segments in
+    that bucket.
+    """
+
+    BUCKET_BITS = 16
+
+    __slots__ = ("version", "shift", "starts", "ends", "expires", "buckets")
+
+    def __init__(
+        self, prefixes: Dict[Tuple[int, int], float], bits: int, version: int = 0
+    ):
+        # IpBlocklist change counter the prefixes were taken at
+        self.version = version
+        self.shift = bits - self.BUCKET_BITS
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.expires: List[float] = []
+        # Enclosing prefixes sort before the prefixes they contain
+        ordered = sorted(prefixes.items())
+        # Open prefixes as (end, latest expiry of it and its enclosing prefixes)
+        open_prefixes: List[Tuple[int, float]] = []
+        position = 0
+        for (start, prefix), expires_at in ordered:
+            while open_prefixes and open_prefixes[-1][0] < start:
+                end, covered_until = open_prefixes.pop()
+                self._segment(position, end, covered_until)
+                position = end + 1
+            if open_prefixes:
+                self._segment(position, start - 1, open_prefixes[-1][1])
+                expires_at = max(expires_at, open_prefixes[-1][1])
+            open_prefixes.append((start + (1 << (bits - prefix)) - 1, expires_at))
+            position = start
+        while open_prefixes:
+            end, covered_until = open_prefixes.pop()
+            self._segment(position, end, covered_until)
+            position = end + 1
+
+        # bucket -> (first, last + 1) segment indexes overlapping it
+        self.buckets: Dict[int, Tuple[int, int]] = {}
+        shift = self.shift
+        for index, (start, end) in enumerate(zip(self.starts, self.ends)):
+            for bucket in range(start >> shift, (end >> shift) + 1):
+                first, _ = self.buckets.get(bucket, (index, index))
+                self.buckets[bucket] = (first, index + 1)
+
+    def _segment(self, start: int, end: int, expires_at: float):
+        if start > end:
+            return
+        if self.ends and self.ends[-1] == start - 1 and self.expires[-1] == expires_at:
+            self.ends[-1] = end
+            return
+        self.starts.append(start)
+        self.ends.append(end)
+        self.expires.append(expires_at)
+
+    def find(self, value: int, now: float) -> bool:
+        """Whether ``value`` lies in a segment that has not expired."""
+        bounds = self.buckets.get(value >> self.shift)
+        if bounds is None:
+            return False
+        index = bisect_right(self.starts, value, bounds[0], bounds[1]) - 1
+        return (
+            index >= bounds[0]
+            and self.ends[index] >= value
+            and self.expires[index] > now
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+class IpBlocklist:
+    """
+    Addresses and CIDR prefixes, IPv4 and IPv6, each with an optional TTL.
+
+    Usage:
+        blocklist = IpBlocklist()
+        blocklist.add("198.51.100.7", ttl=900)
+        blocklist.add("203.0.113.0/24")
+        blocklist.load_feed(open("feed.txt"))  # one prefix per line, # comments
+        if blocklist.is_blocked(client_ip):
+            ...
+
+    Changes are made from one thread (the event loop, or before serving);
+    ``rebuild`` may run on any thread, and ``start`` runs it in the
+    background so new prefixes get compiled segments within
+    ``rebuild_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        purge_threshold: int = DEFAULT_PURGE_THRESHOLD,
+        rebuild_interval: float = 1.0,
+    ):
+        # canonical address -> expiry (monotonic seconds, inf for no TTL)
+        self._exact: Dict[str, float] = {}
+        # family -> {(first address, prefix length): expiry}
+        self._prefixes: Dict[int, Dict[Tuple[int, int], float]] = {
+            socket.AF_INET: {},
+            socket.AF_INET6: {},
+        }
+        # family -> {prefix length: prefixes of that length}, for probing while the
+        # index is stale
+        self._lengths: Dict[int, Dict[int, int]] = {
+            socket.AF_INET: {},
+            socket.AF_INET6: {},
+        }
+        # family -> change counter; an index built at an older count is stale
+        self._versions: Dict[int, int] = {socket.AF_INET: 0, socket.AF_INET6: 0}
+        self._indexes: Dict[int, Optional[RangeIndex]] = {
+            socket.AF_INET: None,
+            socket.AF_INET6: None,
+        }
+        self.rebuild_interval = rebuild_interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_purge = purge_threshold
+        self.purge_threshold = purge_threshold
+        self.lookups = 0
+        self.hits = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+        self.purged = 0
+
+    def add(
+        self, network: str, ttl: Optional[float] = None, now: Optional[float] = None
+    ):
+        """Block an address or prefix, for ``ttl`` seconds or until removed."""
+        if now is None:
+            now = time.monotonic()
+        expires_at = now + ttl if ttl is not None else math.inf
+        family, start, prefix = parse_network(network)
+        if prefix == FAMILY_BITS[family]:
+            key = format_address(family, start)
+            # A longer existing block is never shortened
+            self._exact[key] = max(expires_at, self._exact.get(key, 0.0))
+            if len(self._exact) > self._next_purge:
+                self.purge_expired(now)
+                self._next_purge = max(self.purge_threshold, len(self._exact) * 2)
+        else:
+            self._add_prefix(family, start, prefix, expires_at)
+            self._versions[family] += 1
+
+    def _add_prefix(self, family: int, start: int, prefix: int, expires_at: float):
+        prefixes = self._prefixes[family]
+        previous = prefixes.get((start, prefix))
+        if previous is None:
+            lengths = self._lengths[family]
+            lengths[prefix] = lengths.get(prefix, 0) + 1
+            prefixes[(start, prefix)] = expires_at
+        elif expires_at > previous:
+            prefixes[(start, prefix)] = expires_at
+
+    def _drop_prefix(self, family: int, key: Tuple[int, int]) -> bool:
+        if self._prefixes[family].pop(key, None) is None:
+            return False
+        lengths = self._lengths[family]
+        lengths[key[1]] -= 1
+        if not lengths[key[1]]:
+            del lengths[key[1]]
+        return True
+
+    def remove(self, network: str) -> bool:
+        """Unblock an address or prefix added earlier; True if it was present."""
+        family, start, prefix = parse_network(network)
+        if prefix == FAMILY_BITS[family]:
+            return self._exact.pop(format_address(family, start), None) is not None
+        if not self._drop_prefix(family, (start, prefix)):
+            return False
+        self._versions[family] += 1
+        return True
+
+    def load_feed(self, lines: Iterable[str], ttl: Optional[float] = None) -> int:
+        """
+        Add one address or prefix per line; blank lines and ``#`` or ``;``
+        comments are ignored, as are lines that do not parse.
+
+        The segments are rebuilt before returning; to load a feed while
+        serving, call this in a thread.
+
+        Returns the number of entries added.
+        """
+        now = time.monotonic()
+        expires_at = now + ttl if ttl is not None else math.inf
+        exact = self._exact
+        prefixes = self._prefixes
+        lengths = self._lengths
+        loaded = 0
+        invalid = 0
+        for line in lines:
+            entry = line.split("#", 1)[0].split(";", 1)[0].strip()
+            if not entry:
+                continue
+            try:
+                family, start, prefix = parse_network(entry.split()[0])
+            except ValueError:
+                invalid += 1
+                continue
+            if prefix == FAMILY_BITS[family]:
+                address = format_address(family, start)
+                exact[address] = max(expires_at, exact.get(address, 0.0))
+            else:
+                key = (start, prefix)
+                family_prefixes = prefixes[family]
+                previous = family_prefixes.get(key)
+                if previous is None:
+                    family_lengths = lengths[family]
+                    family_lengths[prefix] = family_lengths.get(prefix, 0) + 1
+                    family_prefixes[key] = expires_at
+                elif expires_at > previous:
+                    family_prefixes[key] = expires_at
+            loaded += 1
+        for family in self._versions:
+            self._versions[family] += 1
+        self.rebuild()
+        logger.info(
+            f"Loaded {loaded} blocklist entries",
+            extra={
+                "custom_dimensions": {
+                    "loaded": loaded,
+                    "invalid": invalid,
+                    "ttl_seconds": ttl,
+                }
+            },
+        )
+        return loaded
+
+    def load_feed_file(self, path: str, ttl: Optional[float] = None) -> int:
+        with open(path, encoding="utf-8", errors="replace") as feed:
+            return self.load_feed(feed, ttl)
+
+    def is_blocked(self, ip: str, now: Optional[float] = None) -> bool:
+        """Whether ``ip`` is covered by an unexpired entry; unparseable input is not."""
+        self.lookups += 1
+        if now is None:
+            now = time.monotonic()
+        expires_at = self._exact.get(ip)
+        if expires_at is not None and expires_at > now:
+            self.hits += 1
+            return True
+
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        prefixes = self._prefixes[family]
+        if not prefixes and family == socket.AF_INET:
+            return False
+        try:
+            value = int.from_bytes(socket.inet_pton(family, ip), "big")
+        except OSError:
+            return False
+        if family == socket.AF_INET6:
+            if value >> 32 == 0xFFFF:
+                # ::ffff:a.b.c.d is the IPv4 client a.b.c.d on a dual-stack listener
+                family, value = socket.AF_INET, value & 0xFFFFFFFF
+                prefixes = self._prefixes[family]
+            # IPv6 has many spellings of one address; exact entries use the canonical
+            # one
+            expires_at = self._exact.get(format_address(family, value))
+            if expires_at is not None and expires_at > now:
+                self.hits += 1
+                return True
+            if not prefixes:
+                return False
+        index = self._indexes[family]
+        if index is not None and index.version == self._versions[family]:
+            blocked = index.find(value, now)
+        else:
+            # Changed since the last rebuild; never sort on the request path
+            blocked = self._probe(family, value, now)
+        if blocked:
+            self.hits += 1
+        return blocked
+
+    def _probe(self, family: int, value: int, now: float) -> bool:
+        """Whether a live prefix covers ``value``; one probe per prefix length used."""
+        prefixes = self._prefixes[family]
+        bits = FAMILY_BITS[family]
+        for prefix in self._lengths[family]:
+            host_bits = bits - prefix
+            expires_at = prefixes.get((value >> host_bits << host_bits, prefix))
+            if expires_at is not None and expires_at > now:
+                return True
+        return False
+
+    def rebuild(self) -> int:
+        """
+        Compile fresh segments for every family changed since its last build
+        and swap them in; returns how many were rebuilt. Safe to call from a
+        thread other than the one making changes.
+        """
+        rebuilt = 0
+        for family, prefixes in self._prefixes.items():
+            version = self._versions[family]
+            index = self._indexes[family]
+            if index is not None and index.version == version:
+                continue
+            if index is None and not prefixes:
+                continue
+            start = time.perf_counter()
+            # A change made after the copy leaves the new index stale, not wrong
+            self._indexes[family] = RangeIndex(
+                prefixes.copy(), FAMILY_BITS[family], version
+            )
+            self.rebuilds += 1
+            self.last_rebuild_ms = round((time.perf_counter() - start) * 1000, 3)
+            rebuilt += 1
+        return rebuilt
+
+    def start(self):
+        """Start the thread rebuilding changed segments every ``rebuild_interval``."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="ip-blocklist-rebuild", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background rebuild thread."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.rebuild_interval)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.rebuild_interval):
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(
+                    f"Blocklist rebuild failed: {str(e)}",
+                    extra={"custom_dimensions": {"error_type": type(e).__name__}},
+                )
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Drop expired entries; returns how many were dropped."""
+        if now is None:
+            now = time.monotonic()
+        expired = [key for key, expires_at in self._exact.items() if expires_at <= now]
+        for key in expired:
+            del self._exact[key]
+        purged = len(expired)
+        for family, prefixes in self._prefixes.items():
+            expired_prefixes = [
+                key for key, expires_at in prefixes.items() if expires_at <= now
+            ]
+            for prefix_key in expired_prefixes:
+                self._drop_prefix(family, prefix_key)
+            if expired_prefixes:
+                self._versions[family] += 1
+            purged += len(expired_prefixes)
+        self.purged += purged
+        return purged
+
+    def __contains__(self, ip: str) -> bool:
+        return self.is_blocked(ip)
+
+    def __len__(self) -> int:
+        return len(self._exact) + sum(
+            len(prefixes) for prefixes in self._prefixes.values()
+        )
+
+    def get_stats(self) -> dict:
+        return {
+            "exact_entries": len(self._exact),
+            "ipv4_prefixes": len(self._prefixes[socket.AF_INET]),
+            "ipv6_prefixes": len(self._prefixes[socket.AF_INET6]),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "rebuilds": self.rebuilds,
+            "stale_families": sum(
+                1
+                for family, index in self._indexes.items()
+                if self._prefixes[family]
+                and (index is None or index.version != self._versions[family])
+            ),
+            "last_rebuild_ms": self.last_rebuild_ms,
+            "purged": self.purged,
+        }
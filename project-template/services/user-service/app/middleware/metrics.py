@@ -1,161 +1,936 @@
 """
 Metrics middleware for collecting application metrics.
+
+Implemented as raw ASGI middleware rather than ``BaseHTTPMiddleware`` so that
+requests are not moved onto a separate task and streaming responses are passed
+through chunk by chunk instead of being buffered.
 """
 
 import time
+import bisect
+import asyncio
 import logging
-from typing import Callable
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from typing import Dict, List, Optional, Tuple
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 logger = logging.getLogger(__name__)
 
+# Latency histogram bucket upper bounds in seconds (Prometheus client defaults)
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    2.5,
+    5.0,
+    7.5,
+    10.0,
+)
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    """Middleware to collect and expose application metrics."""
-    
-    def __init__(self, app, *args, **kwargs):
-        super().__init__(app, *args, **kwargs)
-        # Initialize metrics storage
-        if not hasattr(app.state, 'metrics'):
-            app.state.metrics = {
-                'request_count': 0,
-                'request_duration_total': 0.0,
-                'status_codes': {},
-                'endpoints': {},
-                'errors': 0
+# Payload size histogram bucket upper bounds in bytes
+SIZE_BUCKETS: Tuple[float, ...] = (
+    128,
+    512,
+    1024,
+    4096,
+    16384,
+    65536,
+    262144,
+    1048576,
+    4194304,
+    10485760,
+)
+
+# Route label for requests that match no route (404s, scanners probing paths)
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Route label used once the label cardinality cap has been reached
+OVERFLOW_ROUTE = "<other>"
+
+# Methods are client-controlled; anything else is labelled OTHER so that
+# made-up verbs cannot use up the route label budget
+KNOWN_METHODS = frozenset(
+    {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE", "CONNECT"}
+)
+OTHER_METHOD = "OTHER"
+
+DEFAULT_MAX_ROUTE_LABELS = 200
+DEFAULT_WINDOW_SECONDS = 300
+DEFAULT_TOP_K = 10
+SLOW_REQUEST_THRESHOLD_SECONDS = 2.0
+
+DEFAULT_LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+# Upstream proxy timestamp headers, in order of preference
+QUEUE_START_HEADERS = (b"x-request-start", b"x-queue-start")
+
+# Queue times above this are treated as clock skew or a malformed header
+MAX_QUEUE_TIME_SECONDS = 3600.0
+
+# Service level objectives evaluated over the rolling window
+DEFAULT_SLO = {
+    "max_error_rate": 0.05,
+    "max_p95_duration_ms": 1000.0,
+    # Below this many requests in the window the service is reported healthy
+    "min_requests": 20,
+}
+
+
+def _bucket_quantile(
+    bounds: Tuple[float, ...], buckets: List[int], count: int, q: float
+) -> float:
+    """Estimate a quantile from bucket counts, interpolating inside its bucket."""
+    if count == 0:
+        return 0.0
+
+    rank = q * count
+    seen = 0
+    for index, bucket_count in enumerate(buckets):
+        if seen + bucket_count >= rank and bucket_count:
+            if index == len(bounds):
+                # Observations above the last bound cannot be interpolated
+                return bounds[-1]
+            lower = bounds[index - 1] if index > 0 else 0.0
+            upper = bounds[index]
+            return lower + (upper - lower) * ((rank - seen) / bucket_count)
+        seen += bucket_count
+
+    return bounds[-1]
+
+
+class Histogram:
+    """Fixed-bucket histogram with constant memory per series."""
+
+    __slots__ = ("bounds", "buckets", "count", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bound plus a final +Inf slot
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Record a single observation."""
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        return _bucket_quantile(self.bounds, self.buckets, self.count, q)
+
+    def to_dict(self) -> dict:
+        """Export cumulative bucket counts keyed by upper bound (Prometheus style)."""
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.bounds, self.buckets):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+
+        return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+class LatencyHistogram(Histogram):
+    """Histogram of durations in seconds."""
+
+    __slots__ = ()
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(bounds)
+
+
+class SizeHistogram(Histogram):
+    """Histogram of payload sizes in bytes."""
+
+    __slots__ = ()
+
+    def __init__(self, bounds: Tuple[float, ...] = SIZE_BUCKETS):
+        super().__init__(bounds)
+
+
+class _SecondBucket:
+    """Request counts and per-route latency bucket counts for one second."""
+
+    __slots__ = ("second", "requests", "errors", "routes")
+
+    def __init__(self, second: int):
+        self.second = second
+        self.requests = 0
+        self.errors = 0
+        # route -> [bucket counts..., error count]
+        self.routes: Dict[str, List[int]] = {}
+
+
+class RollingWindow:
+    """Ring buffer of per-second buckets covering the last ``window_seconds``."""
+
+    def __init__(
+        self,
+        window_seconds: int = DEFAULT_WINDOW_SECONDS,
+        bounds: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.window_seconds = window_seconds
+        self.bounds = bounds
+        self._slots: List[Optional[_SecondBucket]] = [None] * window_seconds
+
+    def record(
+        self, route: str, duration: float, is_error: bool, now: Optional[float] = None
+    ):
+        """Record one request in the bucket for the current second."""
+        second = int(time.monotonic() if now is None else now)
+        index = second % self.window_seconds
+        bucket = self._slots[index]
+        if bucket is None or bucket.second != second:
+            # Slot holds a second that has left the window; recycle it
+            bucket = self._slots[index] = _SecondBucket(second)
+
+        counts = bucket.routes.get(route)
+        if counts is None:
+            counts = bucket.routes[route] = [0] * (len(self.bounds) + 2)
+        counts[bisect.bisect_left(self.bounds, duration)] += 1
+
+        bucket.requests += 1
+        if is_error:
+            bucket.errors += 1
+            counts[-1] += 1
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        """Aggregate the live buckets into rolling totals and per-route p95."""
+        oldest_second = (
+            int(time.monotonic() if now is None else now) - self.window_seconds
+        )
+        requests = 0
+        errors = 0
+        overall = [0] * (len(self.bounds) + 1)
+        routes: Dict[str, List[int]] = {}
+
+        for bucket in self._slots:
+            if bucket is None or bucket.second <= oldest_second:
+                continue
+            requests += bucket.requests
+            errors += bucket.errors
+            for route, counts in bucket.routes.items():
+                merged = routes.get(route)
+                if merged is None:
+                    merged = routes[route] = [0] * len(counts)
+                for index, value in enumerate(counts):
+                    merged[index] += value
+
+        route_stats = {}
+        for route, merged in routes.items():
+            latency_buckets = merged[:-1]
+            route_count = sum(latency_buckets)
+            for index, value in enumerate(latency_buckets):
+                overall[index] += value
+            route_stats[route] = {
+                "count": route_count,
+                "error_rate": merged[-1] / route_count if route_count else 0,
+                "p95_duration_ms": round(
+                    _bucket_quantile(self.bounds, latency_buckets, route_count, 0.95)
+                    * 1000,
+                    2,
+                ),
             }
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+
+        return {
+            "window_seconds": self.window_seconds,
+            "requests": requests,
+            "errors": errors,
+            "error_rate": errors / requests if requests else 0,
+            "p95_duration_ms": round(
+                _bucket_quantile(self.bounds, overall, requests, 0.95) * 1000, 2
+            ),
+            "routes": route_stats,
+        }
+
+
+class SpaceSavingCounter:
+    """Approximate top-K heavy hitters in O(k) memory (Metwally et al. Space-Saving)."""
+
+    def __init__(self, capacity: int = DEFAULT_TOP_K):
+        self.capacity = capacity
+        # item -> [estimated count, maximum overestimation]
+        self.counters: Dict[str, List[int]] = {}
+
+    def offer(self, item: str):
+        """Count one occurrence of ``item``."""
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += 1
+            return
+
+        if len(self.counters) < self.capacity:
+            self.counters[item] = [1, 0]
+            return
+
+        # Replace the smallest counter; the newcomer inherits its count as error bound
+        victim = min(self.counters, key=lambda key: self.counters[key][0])
+        victim_count = self.counters.pop(victim)[0]
+        self.counters[item] = [victim_count + 1, victim_count]
+
+    def top(self, limit: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """Return (item, estimated count, error bound) ordered by estimated count."""
+        ranked = sorted(
+            ((item, counter[0], counter[1]) for item, counter in self.counters.items()),
+            key=lambda entry: entry[1],
+            reverse=True,
+        )
+        return ranked[:limit] if limit else ranked
+
+
+class TopTotals:
+    """The ``capacity`` keys with the largest running totals, kept as totals grow."""
+
+    def __init__(self, capacity: int = DEFAULT_TOP_K):
+        self.capacity = capacity
+        self.totals: Dict[str, float] = {}
+        # Key with the smallest total; only it can be displaced
+        self._floor: Optional[str] = None
+
+    def update(self, key: str, total: float):
+        """Report the current total of ``key``; totals never decrease."""
+        totals = self.totals
+        if key in totals:
+            totals[key] = total
+            if key != self._floor:
+                return
+        elif len(totals) < self.capacity:
+            totals[key] = total
+        else:
+            floor = self._floor
+            if floor is None or total <= totals[floor]:
+                return
+            del totals[floor]
+            totals[key] = total
+        self._floor = min(totals, key=totals.__getitem__)
+
+    def top(self) -> List[Tuple[str, float]]:
+        """Return (key, total) ordered by total."""
+        return sorted(self.totals.items(), key=lambda entry: entry[1], reverse=True)
+
+
+class EventLoopLagMonitor:
+    """Samples event loop lag by measuring how late a periodic sleep wakes up."""
+
+    def __init__(self, interval: float = DEFAULT_LOOP_LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, application) -> None:
+        """Start sampling on the running loop if not already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(application))
+
+    def stop(self) -> None:
+        """Stop sampling."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, application) -> None:
+        while True:
+            expected_ns = time.perf_counter_ns() + int(self.interval * 1e9)
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter_ns() - expected_ns, 0) / 1e9
+            # Look the store up each time so reset_metrics() takes effect
+            application.state.metrics["event_loop_lag"].observe(lag)
+
+
+def parse_queue_start(value: str, now: Optional[float] = None) -> Optional[float]:
+    """
+    Convert an upstream X-Request-Start / X-Queue-Start value to seconds queued.
+
+    Accepts ``t=<timestamp>`` or a bare timestamp in seconds, milliseconds,
+    microseconds or nanoseconds since the epoch (nginx, HAProxy and Heroku
+    each use a different unit). Returns None for unparseable or implausible values.
+    """
+    value = value.strip()
+    if value.startswith("t="):
+        value = value[2:]
+    try:
+        timestamp = float(value)
+    except ValueError:
+        return None
+
+    # Normalise the unit by magnitude
+    if timestamp > 1e17:
+        timestamp /= 1e9
+    elif timestamp > 1e14:
+        timestamp /= 1e6
+    elif timestamp > 1e11:
+        timestamp /= 1e3
+
+    queue_time = (time.time() if now is None else now) - timestamp
+    if queue_time > MAX_QUEUE_TIME_SECONDS or queue_time < -MAX_QUEUE_TIME_SECONDS:
+        return None
+    # Small negative values are clock skew between proxy and pod
+    return max(queue_time, 0.0)
+
+
+def _new_metrics_store(
+    window_seconds: int = DEFAULT_WINDOW_SECONDS,
+    top_k: int = DEFAULT_TOP_K,
+    slo: Optional[dict] = None,
+) -> dict:
+    """Create an empty metrics store."""
+    return {
+        "request_count": 0,
+        "request_duration_total": 0.0,
+        "status_codes": {},
+        "endpoints": {},
+        "errors": 0,
+        "window": RollingWindow(window_seconds),
+        "top_endpoints": SpaceSavingCounter(top_k),
+        "slo": slo if slo is not None else dict(DEFAULT_SLO),
+        # Saturation signals: requests in progress, proxy queueing, loop lag.
+        # Requests in progress are labelled when the summary is read, since
+        # their route is only known once the router has matched them
+        "in_flight": set(),
+        "in_flight_peak_total": 0,
+        "in_flight_max_at_read": {},
+        "queue_time": LatencyHistogram(),
+        "event_loop_lag": LatencyHistogram(),
+        # endpoint -> (request body sizes, response body sizes)
+        "payload_sizes": {},
+        # Endpoints moving the most bytes, kept up to date per request
+        "payload_top": TopTotals(top_k),
+        # Requests folded into the overflow route label
+        "route_overflow": 0,
+    }
+
+
+class RequestMetrics:
+    """Measurements for one request, carried from MetricsMiddleware.begin to record."""
+
+    __slots__ = (
+        "start_ns",
+        "metrics",
+        "scope",
+        "endpoint",
+        "histogram",
+        "queue_time",
+        "status_code",
+        "request_bytes",
+        "response_bytes",
+        "usage_token",
+        "usage",
+        "query_token",
+        "query_profile",
+    )
+
+    def __init__(
+        self, start_ns: int, metrics: dict, scope: Scope, queue_time: Optional[float]
+    ):
+        self.start_ns = start_ns
+        self.metrics = metrics
+        self.scope = scope
+        # Route label and its histogram, resolved once the application has run
+        self.endpoint: Optional[str] = None
+        self.histogram: Optional[LatencyHistogram] = None
+        self.queue_time = queue_time
+        # Until the application starts a response, the request counts as failed
+        self.status_code = 500
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.usage_token = None
+        self.usage = None
+        self.query_token = None
+        self.query_profile = None
+
+
+class MetricsMiddleware:
+    """Middleware to collect and expose application metrics."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_route_labels: int = DEFAULT_MAX_ROUTE_LABELS,
+        window_seconds: int = DEFAULT_WINDOW_SECONDS,
+        top_k: int = DEFAULT_TOP_K,
+        slo: Optional[dict] = None,
+        loop_lag_interval: float = DEFAULT_LOOP_LAG_INTERVAL_SECONDS,
+        usage_meter=None,
+        query_tracker=None,
+    ):
+        self.app = app
+        self.max_route_labels = max_route_labels
+        self.window_seconds = window_seconds
+        self.top_k = top_k
+        self.slo = {**DEFAULT_SLO, **(slo or {})}
+        self.loop_lag_monitor = EventLoopLagMonitor(loop_lag_interval)
+        # Optional shared.monitoring.metering.UsageMeter for per-tenant usage
+        self.usage_meter = usage_meter
+        # Optional shared.monitoring.queries.QueryTracker for N+1 detection
+        self.query_tracker = query_tracker
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process request and collect metrics."""
-        start_time = time.time()
-        
-        # Increment request counter
-        request.app.state.metrics['request_count'] += 1
-        
-        # Extract endpoint info
-        endpoint = f"{request.method} {request.url.path}"
-        
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_metrics = self.begin(scope)
+
+        # Count body bytes as they stream through; bodies are never buffered
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                request_metrics.request_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.body":
+                request_metrics.response_bytes += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                request_metrics.status_code = message["status"]
+                # Add metrics headers to response
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    *self.response_headers(request_metrics),
+                ]
+            await send(message)
+
         try:
-            # Process request
-            response = await call_next(request)
-            
-            # Calculate request duration
-            duration = time.time() - start_time
-            request.app.state.metrics['request_duration_total'] += duration
-            
-            # Track status codes
-            status_code = response.status_code
-            if status_code not in request.app.state.metrics['status_codes']:
-                request.app.state.metrics['status_codes'][status_code] = 0
-            request.app.state.metrics['status_codes'][status_code] += 1
-            
-            # Track endpoints
-            if endpoint not in request.app.state.metrics['endpoints']:
-                request.app.state.metrics['endpoints'][endpoint] = {
-                    'count': 0,
-                    'total_duration': 0.0,
-                    'avg_duration': 0.0
-                }
-            
-            endpoint_metrics = request.app.state.metrics['endpoints'][endpoint]
-            endpoint_metrics['count'] += 1
-            endpoint_metrics['total_duration'] += duration
-            endpoint_metrics['avg_duration'] = endpoint_metrics['total_duration'] / endpoint_metrics['count']
-            
-            # Add metrics headers to response
-            response.headers["X-Request-Duration"] = str(round(duration * 1000, 2))  # in milliseconds
-            response.headers["X-Request-Count"] = str(request.app.state.metrics['request_count'])
-            
-            # Log metrics for Application Insights
-            if duration > 2.0:  # Log slow requests
-                logger.warning(
-                    f"Slow request detected: {endpoint}",
-                    extra={
-                        "custom_dimensions": {
-                            "endpoint": endpoint,
-                            "duration": duration,
-                            "status_code": status_code,
-                            "user_agent": request.headers.get("user-agent", "unknown"),
-                            "ip_address": request.client.host if request.client else "unknown"
-                        }
-                    }
-                )
-            
-            return response
-            
+            await self.app(scope, receive_wrapper, send_wrapper)
         except Exception as e:
-            # Track errors
-            request.app.state.metrics['errors'] += 1
-            
-            # Log error metrics
-            duration = time.time() - start_time
-            logger.error(
-                f"Request error: {endpoint}",
+            self.record_error(request_metrics, scope, e)
+            raise
+        finally:
+            self.end(request_metrics, scope)
+
+        self.record(request_metrics, scope)
+
+    def begin(self, scope: Scope) -> RequestMetrics:
+        """
+        Start measuring an HTTP request.
+
+        Every ``begin`` must be paired with ``end``, followed by ``record``
+        once the application has returned or ``record_error`` if it raised.
+        The stages are public so RequestPipeline can run them in its own pass.
+        """
+        start_ns = time.perf_counter_ns()
+        metrics = self._store(scope["app"])
+
+        # Increment request counter
+        metrics["request_count"] += 1
+
+        # Time spent queued between the upstream proxy and this process
+        queue_time = self._queue_time(scope)
+        if queue_time is not None:
+            metrics["queue_time"].observe(queue_time)
+
+        request_metrics = RequestMetrics(start_ns, metrics, scope, queue_time)
+
+        if self.usage_meter is not None:
+            (
+                request_metrics.usage_token,
+                request_metrics.usage,
+            ) = self.usage_meter.begin()
+        if self.query_tracker is not None:
+            (
+                request_metrics.query_token,
+                request_metrics.query_profile,
+            ) = self.query_tracker.begin()
+
+        in_flight = metrics["in_flight"]
+        in_flight.add(request_metrics)
+        if len(in_flight) > metrics["in_flight_peak_total"]:
+            metrics["in_flight_peak_total"] = len(in_flight)
+        return request_metrics
+
+    def _resolve_endpoint(self, request_metrics: RequestMetrics) -> str:
+        """Label the request by route template so path parameters add no series."""
+        if request_metrics.endpoint is not None:
+            return request_metrics.endpoint
+        scope = request_metrics.scope
+        metrics = request_metrics.metrics
+        method = scope["method"] if scope["method"] in KNOWN_METHODS else OTHER_METHOD
+        # The router leaves the matched route in the scope; only requests it
+        # never saw (rejected earlier, or 404) are matched here
+        route = scope.get("route")
+        template = route.path if route is not None else self._route_template(scope)
+        endpoint, histogram = self._endpoint_histogram(
+            metrics["endpoints"], f"{method} {template}"
+        )
+        if endpoint is OVERFLOW_ROUTE:
+            metrics["route_overflow"] += 1
+        request_metrics.endpoint = endpoint
+        request_metrics.histogram = histogram
+        return endpoint
+
+    def response_headers(
+        self, request_metrics: RequestMetrics
+    ) -> List[Tuple[bytes, bytes]]:
+        """Raw metrics headers for the response start."""
+        duration_ms = (time.perf_counter_ns() - request_metrics.start_ns) / 1e6
+        return [
+            (b"x-request-duration", str(round(duration_ms, 2)).encode("latin-1")),
+            (
+                b"x-request-count",
+                str(request_metrics.metrics["request_count"]).encode("latin-1"),
+            ),
+        ]
+
+    def record_error(
+        self, request_metrics: RequestMetrics, scope: Scope, error: Exception
+    ) -> None:
+        """Count a request whose application raised without a response being sent."""
+        metrics = request_metrics.metrics
+        endpoint = self._resolve_endpoint(request_metrics)
+        duration = (time.perf_counter_ns() - request_metrics.start_ns) / 1e9
+        metrics["window"].record(endpoint, duration, True)
+        metrics["top_endpoints"].offer(endpoint)
+        self._count_error(request_metrics, scope, error, endpoint, duration)
+
+    def _count_error(
+        self,
+        request_metrics: RequestMetrics,
+        scope: Scope,
+        error: Exception,
+        endpoint: str,
+        duration: float,
+    ) -> None:
+        # Track errors
+        request_metrics.metrics["errors"] += 1
+        logger.error(
+            f"Request error: {endpoint}",
+            extra={
+                "custom_dimensions": {
+                    "endpoint": endpoint,
+                    "duration": duration,
+                    "error": str(error),
+                    "error_type": type(error).__name__,
+                    "user_agent": _header(scope, b"user-agent") or "unknown",
+                    "ip_address": scope["client"][0]
+                    if scope.get("client")
+                    else "unknown",
+                }
+            },
+        )
+
+    def end(self, request_metrics: RequestMetrics, scope: Scope) -> None:
+        """
+        Release in-flight tracking and record payload sizes, usage and queries.
+
+        Runs on every outcome.
+        """
+        metrics = request_metrics.metrics
+        endpoint = self._resolve_endpoint(request_metrics)
+        metrics["in_flight"].discard(request_metrics)
+        payload_sizes = metrics["payload_sizes"].get(endpoint)
+        if payload_sizes is None:
+            payload_sizes = metrics["payload_sizes"][endpoint] = (
+                SizeHistogram(),
+                SizeHistogram(),
+            )
+        payload_sizes[0].observe(request_metrics.request_bytes)
+        payload_sizes[1].observe(request_metrics.response_bytes)
+        metrics["payload_top"].update(
+            endpoint, payload_sizes[0].sum + payload_sizes[1].sum
+        )
+
+        if self.usage_meter is not None:
+            # Auth dependencies record the tenant on request.state
+            self.usage_meter.end(
+                request_metrics.usage_token,
+                request_metrics.usage,
+                (time.perf_counter_ns() - request_metrics.start_ns) / 1e9,
+                tenant_id=scope.get("state", {}).get("tenant_id"),
+            )
+        if self.query_tracker is not None:
+            self.query_tracker.end(
+                request_metrics.query_token,
+                request_metrics.query_profile,
+                route=endpoint,
+            )
+
+    def record(
+        self,
+        request_metrics: RequestMetrics,
+        scope: Scope,
+        error: Optional[Exception] = None,
+    ) -> None:
+        """
+        Record the duration and status of a request that was answered.
+
+        ``error`` is the exception a response was synthesized for (such as
+        RequestPipeline's mapped 500); it is also counted as an error.
+        """
+        metrics = request_metrics.metrics
+        endpoint = self._resolve_endpoint(request_metrics)
+        status_code = request_metrics.status_code
+
+        # Calculate request duration
+        duration = (time.perf_counter_ns() - request_metrics.start_ns) / 1e9
+        metrics["request_duration_total"] += duration
+
+        # Track status codes
+        status_codes = metrics["status_codes"]
+        status_codes[status_code] = status_codes.get(status_code, 0) + 1
+
+        # Track endpoints
+        histogram = request_metrics.histogram
+        if histogram is not None:
+            histogram.observe(duration)
+        metrics["window"].record(endpoint, duration, status_code >= 500)
+        metrics["top_endpoints"].offer(endpoint)
+        if error is not None:
+            self._count_error(request_metrics, scope, error, endpoint, duration)
+
+        # Log metrics for Application Insights
+        if duration > SLOW_REQUEST_THRESHOLD_SECONDS:
+            logger.warning(
+                f"Slow request detected: {endpoint}",
                 extra={
                     "custom_dimensions": {
                         "endpoint": endpoint,
                         "duration": duration,
-                        "error": str(e),
-                        "error_type": type(e).__name__,
-                        "user_agent": request.headers.get("user-agent", "unknown"),
-                        "ip_address": request.client.host if request.client else "unknown"
+                        "queue_time": request_metrics.queue_time,
+                        "status_code": status_code,
+                        "user_agent": _header(scope, b"user-agent") or "unknown",
+                        "ip_address": scope["client"][0]
+                        if scope.get("client")
+                        else "unknown",
                     }
-                }
+                },
             )
-            
-            raise
+
+    def start(self, application) -> None:
+        """Start event loop lag sampling; called from the lifespan startup."""
+        self._store(application)
+        self.loop_lag_monitor.start(application)
+
+    def stop(self) -> None:
+        """Stop event loop lag sampling; called from the lifespan shutdown."""
+        self.loop_lag_monitor.stop()
+
+    def _store(self, application) -> dict:
+        """The application's metrics store, created on first use."""
+        metrics = getattr(application.state, "metrics", None)
+        if metrics is None:
+            metrics = application.state.metrics = _new_metrics_store(
+                self.window_seconds, self.top_k, self.slo
+            )
+        return metrics
+
+    def _queue_time(self, scope: Scope) -> Optional[float]:
+        """Read the proxy queueing time from upstream timestamp headers."""
+        for name in QUEUE_START_HEADERS:
+            value = _header(scope, name)
+            if value:
+                return parse_queue_start(value)
+        return None
+
+    def _route_template(self, scope: Scope) -> str:
+        """
+        Match the route template (e.g. /api/v1/users/{user_id}) for a request the
+        router did not handle.
+        """
+        router = getattr(scope["app"], "router", None)
+        partial_match: Optional[str] = None
+
+        for route in getattr(router, "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial_match is None:
+                # Path matched but method did not (405)
+                partial_match = route.path
+
+        return partial_match or UNMATCHED_ROUTE
+
+    def _endpoint_histogram(
+        self, endpoints: Dict[str, LatencyHistogram], endpoint: str
+    ) -> Tuple[str, LatencyHistogram]:
+        """
+        Get the label and histogram for an endpoint.
+
+        Past the cap, new labels are folded into the overflow label.
+        """
+        histogram = endpoints.get(endpoint)
+        if histogram is None:
+            if len(endpoints) >= self.max_route_labels:
+                endpoint = OVERFLOW_ROUTE
+                histogram = endpoints.get(endpoint)
+            if histogram is None:
+                histogram = endpoints[endpoint] = LatencyHistogram()
+        return endpoint, histogram
+
+
+def _header(scope: Scope, name: bytes) -> Optional[str]:
+    """Get a raw request header value from the ASGI scope."""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
 
 
 def get_metrics_summary(app) -> dict:
-    """Get a summary of collected metrics."""
-    if not hasattr(app.state, 'metrics'):
+    """Get a summary of collected metrics.
+
+    Lifetime totals are kept for reference, but ``health_status`` follows the
+    configured SLOs over the rolling window so a recent burst of failures is
+    not diluted by weeks of healthy traffic.
+    """
+    if not hasattr(app.state, "metrics"):
         return {"error": "Metrics not initialized"}
-    
+
     metrics = app.state.metrics
-    total_requests = metrics['request_count']
-    
+    total_requests = metrics["request_count"]
+
     if total_requests == 0:
         avg_duration = 0
     else:
-        avg_duration = metrics['request_duration_total'] / total_requests
-    
+        avg_duration = metrics["request_duration_total"] / total_requests
+
+    window = metrics["window"].snapshot()
+    slo_breaches = _evaluate_slo(window, metrics["slo"])
+
     return {
         "total_requests": total_requests,
-        "total_errors": metrics['errors'],
-        "error_rate": metrics['errors'] / total_requests if total_requests > 0 else 0,
+        "total_errors": metrics["errors"],
+        "error_rate": metrics["errors"] / total_requests if total_requests > 0 else 0,
         "average_response_time": round(avg_duration * 1000, 2),  # in milliseconds
-        "status_code_distribution": metrics['status_codes'],
-        "top_endpoints": _get_top_endpoints(metrics['endpoints']),
-        "health_status": "healthy" if metrics['errors'] / max(total_requests, 1) < 0.05 else "degraded"
+        "status_code_distribution": metrics["status_codes"],
+        "top_endpoints": _get_top_endpoints(
+            metrics["top_endpoints"], metrics["endpoints"]
+        ),
+        "latency_histograms": {
+            endpoint: histogram.to_dict()
+            for endpoint, histogram in metrics["endpoints"].items()
+        },
+        "rolling_window": window,
+        "saturation": _get_saturation(metrics),
+        "payload_sizes": _get_payload_sizes(
+            metrics["payload_sizes"], metrics["payload_top"]
+        ),
+        "cardinality": {
+            "route_labels": len(metrics["endpoints"]),
+            "overflow_requests": metrics["route_overflow"],
+        },
+        "slo": metrics["slo"],
+        "slo_breaches": slo_breaches,
+        "health_status": "degraded" if slo_breaches else "healthy",
     }
 
 
-def _get_top_endpoints(endpoints: dict, limit: int = 10) -> list:
-    """Get top endpoints by request count."""
-    sorted_endpoints = sorted(
-        endpoints.items(),
-        key=lambda x: x[1]['count'],
-        reverse=True
-    )
-    
+def _in_flight_label(request_metrics: RequestMetrics) -> str:
+    """Route label of a request in progress; unrouted requests count as unmatched."""
+    if request_metrics.endpoint is not None:
+        return request_metrics.endpoint
+    scope = request_metrics.scope
+    method = scope["method"] if scope["method"] in KNOWN_METHODS else OTHER_METHOD
+    route = scope.get("route")
+    return f"{method} {route.path if route is not None else UNMATCHED_ROUTE}"
+
+
+def _get_saturation(metrics: dict) -> dict:
+    """Summarise signals that separate saturation from slow handler code."""
+    queue_time = metrics["queue_time"]
+    loop_lag = metrics["event_loop_lag"]
+    in_flight: Dict[str, int] = {}
+    for request_metrics in list(metrics["in_flight"]):
+        endpoint = _in_flight_label(request_metrics)
+        in_flight[endpoint] = in_flight.get(endpoint, 0) + 1
+    # Routes are only known once the router has run, so per-route counts are
+    # sampled when the summary is read and their maximum is not a true peak;
+    # in_flight_peak_total is updated on every request and is exact
+    max_at_read = metrics["in_flight_max_at_read"]
+    for endpoint, count in in_flight.items():
+        if count > max_at_read.get(endpoint, 0):
+            max_at_read[endpoint] = count
+    return {
+        "in_flight_total": len(metrics["in_flight"]),
+        "in_flight": in_flight,
+        "in_flight_peak_total": metrics["in_flight_peak_total"],
+        "in_flight_max_at_read": max_at_read,
+        "queue_time_p50_ms": round(queue_time.quantile(0.50) * 1000, 2),
+        "queue_time_p95_ms": round(queue_time.quantile(0.95) * 1000, 2),
+        "queue_time": queue_time.to_dict(),
+        "event_loop_lag_p95_ms": round(loop_lag.quantile(0.95) * 1000, 2),
+        "event_loop_lag": loop_lag.to_dict(),
+    }
+
+
+def _get_payload_sizes(
+    payload_sizes: Dict[str, Tuple[SizeHistogram, SizeHistogram]],
+    payload_top: TopTotals,
+) -> list:
+    """Get the endpoints moving the most bytes, with size percentiles."""
+    ranked = [(endpoint, payload_sizes[endpoint]) for endpoint, _ in payload_top.top()]
+
     return [
         {
             "endpoint": endpoint,
-            "count": data['count'],
-            "avg_duration_ms": round(data['avg_duration'] * 1000, 2)
+            "request_bytes_total": int(request_sizes.sum),
+            "response_bytes_total": int(response_sizes.sum),
+            "request_p95_bytes": round(request_sizes.quantile(0.95)),
+            "response_p95_bytes": round(response_sizes.quantile(0.95)),
+            "request_sizes": request_sizes.to_dict(),
+            "response_sizes": response_sizes.to_dict(),
         }
-        for endpoint, data in sorted_endpoints[:limit]
+        for endpoint, (request_sizes, response_sizes) in ranked
     ]
 
 
+def _evaluate_slo(window: dict, slo: dict) -> List[str]:
+    """Return the SLOs breached over the rolling window."""
+    if window["requests"] < slo["min_requests"]:
+        return []
+
+    breaches = []
+    if window["error_rate"] > slo["max_error_rate"]:
+        breaches.append(
+            f"error_rate {window['error_rate']:.3f} > {slo['max_error_rate']}"
+        )
+    if window["p95_duration_ms"] > slo["max_p95_duration_ms"]:
+        breaches.append(
+            f"p95_duration_ms {window['p95_duration_ms']} > "
+            f"{slo['max_p95_duration_ms']}"
+        )
+    return breaches
+
+
+def _get_top_endpoints(
+    top_endpoints: SpaceSavingCounter,
+    endpoints: Dict[str, LatencyHistogram],
+    limit: int = 10,
+) -> list:
+    """Get top endpoints by request count from the streaming top-K counter."""
+    results = []
+    for endpoint, _, _ in top_endpoints.top(limit):
+        histogram = endpoints.get(endpoint)
+        if histogram is None or not histogram.count:
+            continue
+        results.append(
+            {
+                "endpoint": endpoint,
+                "count": histogram.count,
+                "avg_duration_ms": round(histogram.sum / histogram.count * 1000, 2),
+                "p50_duration_ms": round(histogram.quantile(0.50) * 1000, 2),
+                "p95_duration_ms": round(histogram.quantile(0.95) * 1000, 2),
+                "p99_duration_ms": round(histogram.quantile(0.99) * 1000, 2),
+            }
+        )
+    return results
+
+
 def reset_metrics(app):
-    """Reset all metrics counters."""
-    if hasattr(app.state, 'metrics'):
-        app.state.metrics = {
-            'request_count': 0,
-            'request_duration_total': 0.0,
-            'status_codes': {},
-            'endpoints': {},
-            'errors': 0
-        }
+    """Reset all metrics counters, keeping the configured window size and SLOs."""
+    if hasattr(app.state, "metrics"):
+        metrics = app.state.metrics
+        app.state.metrics = _new_metrics_store(
+            metrics["window"].window_seconds,
+            metrics["top_endpoints"].capacity,
+            metrics["slo"],
+        )
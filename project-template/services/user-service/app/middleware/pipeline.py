@@ -0,0 +1,274 @@
+"""
+Fused request pipeline for the user service.
+
+One raw ASGI component runs request-id assignment, security checks, metrics
+and error mapping in a single pass. Stacking them as separate middleware
+costs a receive/send wrapper (and, for ``BaseHTTPMiddleware``, a task, a
+Request object and a ``call_next`` hop) per layer; here each request gets
+one ``RequestContext``, one receive wrapper and one send wrapper, and the
+request headers are parsed once for every stage.
+
+Security and metrics logic stays in SecurityMiddleware and
+MetricsMiddleware; the pipeline calls their stage methods in order.
+Liveness probes on ``fast_paths`` go straight to the application.
+"""
+
+import json
+import re
+import uuid
+import logging
+from typing import Iterable, Optional
+
+from fastapi import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.middleware.metrics import MetricsMiddleware, RequestMetrics
+from app.middleware.security import (
+    RawHeaders,
+    RequestBodyRejected,
+    SecurityMiddleware,
+    append_raw_headers,
+)
+from app.middleware.waf import StreamingBodyInspector
+
+logger = logging.getLogger(__name__)
+
+# Probes answered without security checks, metrics or request ids (GET/HEAD only)
+DEFAULT_FAST_PATHS = ("/health/live",)
+
+FAST_PATH_METHODS = frozenset({"GET", "HEAD"})
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+# Upstream request ids are reused only when they are short and header-safe
+VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+
+
+class RequestContext:
+    """State shared by every stage of one request."""
+
+    __slots__ = (
+        "request",
+        "request_id",
+        "client_ip",
+        "user_agent",
+        "metrics",
+        "inspector",
+        "status_code",
+        "violation",
+    )
+
+    def __init__(self, request: Request, request_id: str):
+        self.request = request
+        self.request_id = request_id
+        self.client_ip = "unknown"
+        self.user_agent = ""
+        self.metrics: Optional[RequestMetrics] = None
+        self.inspector: Optional[StreamingBodyInspector] = None
+        # Status sent downstream, None until a response starts
+        self.status_code: Optional[int] = None
+        self.violation: Optional[str] = None
+
+
+class RequestPipeline:
+    """
+    Request id, security, metrics and error mapping as one ASGI component.
+
+    Usage:
+        app.add_middleware(
+            RequestPipeline,
+            security=SecurityMiddleware(None, ...),
+            metrics=MetricsMiddleware(None, ...)
+        )
+
+    Either stage may be None to leave it out. Unhandled application errors
+    are answered with a JSON 500 carrying the request id, unless a response
+    had already started, in which case the error is re-raised.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        security: Optional[SecurityMiddleware] = None,
+        metrics: Optional[MetricsMiddleware] = None,
+        fast_paths: Iterable[str] = DEFAULT_FAST_PATHS,
+    ):
+        self.app = app
+        self.security = security
+        self.metrics = metrics
+        self.fast_paths = frozenset(fast_paths)
+        self.fast_path_requests = 0
+        self.mapped_errors = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Process request through every stage in one pass."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] in self.fast_paths and scope["method"] in FAST_PATH_METHODS:
+            self.fast_path_requests += 1
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        context = RequestContext(request, self._request_id(request))
+        # Handlers read it as request.state.request_id
+        request.state.request_id = context.request_id
+        request_id_header = (REQUEST_ID_HEADER, context.request_id.encode("latin-1"))
+        security = self.security
+        metrics = self.metrics
+        response_headers: RawHeaders = []
+        security_header_names: frozenset = frozenset()
+
+        application = scope.get("app")
+        if application is not None and not hasattr(application.state, "pipeline"):
+            # Exposed for get_pipeline_summary (/metrics)
+            application.state.pipeline = self
+        if security is not None:
+            security.register(scope)
+            context.client_ip, context.user_agent = security.identify(request)
+        if metrics is not None:
+            context.metrics = metrics.begin(scope)
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                if context.metrics is not None:
+                    context.metrics.request_bytes += len(body)
+                if context.inspector is not None and context.violation is None:
+                    context.violation = context.inspector.feed(body)
+                    if context.violation is not None:
+                        raise RequestBodyRejected(context.violation)
+            return message
+
+        # Responses the pipeline renders itself already carry the security headers
+        async def send_response(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status_code = context.status_code = message["status"]
+                headers = message["headers"]
+                headers.append(request_id_header)
+                if metrics is not None and context.metrics is not None:
+                    context.metrics.status_code = status_code
+                    headers.extend(metrics.response_headers(context.metrics))
+            elif (
+                message["type"] == "http.response.body" and context.metrics is not None
+            ):
+                context.metrics.response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        async def send_wrapper(message: Message) -> None:
+            if context.violation is not None and context.status_code is None:
+                # The body was rejected; the application's response is replaced
+                return
+            if message["type"] == "http.response.start":
+                # Ours replace any the application set itself; always a fresh list
+                message["headers"] = append_raw_headers(
+                    message.get("headers") or (),
+                    response_headers,
+                    security_header_names,
+                )
+            await send_response(message)
+
+        error = None
+        try:
+            rejection = None
+            if security is not None:
+                rejection, limit_headers = await security.screen(
+                    request, context.client_ip, context.user_agent
+                )
+                response_headers = security.response_headers(limit_headers)
+                security_header_names = security.security_header_names
+                context.inspector = security.body_inspector(request)
+
+            if security is not None and rejection is not None:
+                await security.reject(send_response, context.client_ip, rejection)
+            else:
+                try:
+                    await self.app(scope, receive_wrapper, send_wrapper)
+                except Exception:
+                    if context.violation is None:
+                        raise
+
+                if security is not None:
+                    await security.complete(
+                        send_response,
+                        request,
+                        context.client_ip,
+                        context.user_agent,
+                        context.status_code,
+                        context.violation,
+                    )
+        except Exception as e:
+            if (
+                metrics is not None
+                and context.metrics is not None
+                and context.status_code is not None
+            ):
+                # Too late to answer with a 500; the error propagates to the server
+                metrics.record_error(context.metrics, scope, e)
+            await self._map_error(send_response, context, e)
+            # Answered with a 500, recorded below like any other response
+            error = e
+        finally:
+            if metrics is not None and context.metrics is not None:
+                metrics.end(context.metrics, scope)
+
+        if metrics is not None and context.metrics is not None:
+            metrics.record(context.metrics, scope, error)
+
+    def _request_id(self, request: Request) -> str:
+        """The caller's X-Request-ID when well formed, otherwise a new UUID."""
+        request_id = request.headers.get("x-request-id")
+        if request_id and VALID_REQUEST_ID.fullmatch(request_id):
+            return request_id
+        return str(uuid.uuid4())
+
+    async def _map_error(
+        self, send: Send, context: RequestContext, error: Exception
+    ) -> None:
+        """Answer an unhandled error with a JSON 500, or re-raise mid-response."""
+        logger.error(
+            f"Unhandled error processing request {context.request_id}: {error}",
+            extra={
+                "custom_dimensions": {
+                    "request_id": context.request_id,
+                    "ip": context.client_ip,
+                    "endpoint": f"{context.request.method} {context.request.url.path}",
+                    "error": str(error),
+                    "error_type": type(error).__name__,
+                }
+            },
+        )
+        if context.status_code is not None:
+            raise error
+        self.mapped_errors += 1
+        body = json.dumps(
+            {"error": "Internal server error", "request_id": context.request_id},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        headers = [
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"content-type", b"application/json"),
+        ]
+        if self.security is not None:
+            headers.extend(self.security.raw_security_headers)
+        await send({"type": "http.response.start", "status": 500, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    def get_stats(self) -> dict:
+        return {
+            "fast_paths": sorted(self.fast_paths),
+            "fast_path_requests": self.fast_path_requests,
+            "mapped_errors": self.mapped_errors,
+        }
+
+
+def get_pipeline_summary(app) -> dict:
+    """Statistics of the app's RequestPipeline, once it has served a request."""
+    pipeline = getattr(app.state, "pipeline", None)
+    if pipeline is None:
+        return {}
+    return pipeline.get_stats()
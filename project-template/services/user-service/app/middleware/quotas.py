@@ -0,0 +1,455 @@
+"""
+Identity-aware hierarchical quotas for the security middleware.
+
+A request is classified into a route class (``auth``, ``write``, ...), and
+then checked against up to three GCRA limits in a single pass: its tenant's
+ceiling, its user's limit and its client IP's limit when the bearer token is
+valid, or its client IP's limit alone otherwise. Nothing is counted unless
+every level admits the request, so a request refused by the tenant ceiling
+does not use up the user's or the IP's quota.
+
+Each counter is one float, the theoretical arrival time, keyed by a small
+tuple such as ``("user", tenant_id, user_id, route_class)``, in one LRU
+bounded by ``max_keys``.
+
+The policy is plain JSON, so it can be edited and reloaded while running
+(``reload``, or automatically when its file changes):
+
+    {
+        "route_classes": [
+            {"name": "auth", "path_prefix": "/api/v1/auth"},
+            {"name": "write", "methods": ["POST", "PUT", "PATCH", "DELETE"]}
+        ],
+        "default_route_class": "read",
+        "limits": {
+            "read": {"tenant": [6000, 60], "user": [600, 60], "ip": [100, 60]},
+            "write": {"tenant": [1200, 60], "user": [120, 60], "ip": [30, 60]},
+            "auth": {"ip": [10, 60]}
+        },
+        "tenants": {
+            "acme": {"read": {"tenant": [20000, 60]}}
+        }
+    }
+
+Levels missing from a route class are not limited.
+"""
+
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.middleware.rate_limit import (
+    DEFAULT_MAX_KEYS,
+    RateLimitDecision,
+    remaining_requests,
+)
+
+logger = logging.getLogger(__name__)
+
+QUOTA_LEVELS = ("tenant", "user", "ip")
+
+DEFAULT_QUOTA_POLICY: Dict[str, Any] = {
+    "route_classes": [
+        {"name": "auth", "path_prefix": "/api/v1/auth"},
+        {"name": "admin", "path_prefix": "/api/v1/admin"},
+        {"name": "write", "methods": ["POST", "PUT", "PATCH", "DELETE"]},
+    ],
+    "default_route_class": "read",
+    "limits": {
+        "read": {"tenant": [6000, 60], "user": [600, 60], "ip": [100, 60]},
+        "write": {"tenant": [1200, 60], "user": [120, 60], "ip": [30, 60]},
+        "admin": {"tenant": [600, 60], "user": [60, 60], "ip": [10, 60]},
+        "auth": {"tenant": [600, 60], "user": [30, 60], "ip": [10, 60]},
+    },
+    "tenants": {},
+}
+
+DEFAULT_TOKEN_CACHE_SIZE = 10_000
+
+# (tenant_id, user_id) from a validated token
+Identity = Tuple[str, str]
+
+
+class QuotaDecision(RateLimitDecision):
+    """RateLimitDecision of the most constrained level, with its policy."""
+
+    __slots__ = ("level", "window", "route_class")
+
+    def __init__(
+        self,
+        allowed: bool,
+        limit: int,
+        remaining: int,
+        retry_after: float,
+        reset_after: float,
+        level: str,
+        window: float,
+        route_class: str,
+    ):
+        super().__init__(allowed, limit, remaining, retry_after, reset_after)
+        self.level = level
+        self.window = window
+        self.route_class = route_class
+
+
+class QuotaPolicy:
+    """Compiled quota policy: route classification and per-level limits."""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.default_route_class = config.get("default_route_class", "default")
+        # (name, methods or None, path prefix or None), first match wins
+        self.route_classes: List[Tuple[str, Optional[frozenset], Optional[str]]] = []
+        for route_class in config.get("route_classes", ()):
+            methods = route_class.get("methods")
+            self.route_classes.append(
+                (
+                    route_class["name"],
+                    frozenset(method.upper() for method in methods)
+                    if methods
+                    else None,
+                    route_class.get("path_prefix"),
+                )
+            )
+        self.limits = {
+            name: self._parse_limits(levels)
+            for name, levels in config.get("limits", {}).items()
+        }
+        self.tenant_limits = {
+            tenant: {
+                name: self._parse_limits(levels) for name, levels in classes.items()
+            }
+            for tenant, classes in config.get("tenants", {}).items()
+        }
+        self._classified: Dict[Tuple[str, str], str] = {}
+
+    @staticmethod
+    def _parse_limits(
+        levels: Dict[str, Sequence[float]]
+    ) -> Dict[str, Tuple[int, float]]:
+        parsed = {}
+        for level, (limit, window) in levels.items():
+            if level not in QUOTA_LEVELS:
+                raise ValueError(
+                    f"Unknown quota level {level!r}, expected one of "
+                    f"{', '.join(QUOTA_LEVELS)}"
+                )
+            if limit <= 0 or window <= 0:
+                raise ValueError(
+                    f"Quota limit and window must be positive: {level} {limit}/{window}"
+                )
+            parsed[level] = (int(limit), float(window))
+        return parsed
+
+    def classify(self, method: str, path: str) -> str:
+        key = (method, path)
+        route_class = self._classified.get(key)
+        if route_class is None:
+            route_class = self.default_route_class
+            for name, methods, path_prefix in self.route_classes:
+                if methods is not None and method not in methods:
+                    continue
+                if path_prefix is not None and not path.startswith(path_prefix):
+                    continue
+                route_class = name
+                break
+            # Paths carry ids, so the memo is bounded by clearing
+            if len(self._classified) >= 4096:
+                self._classified.clear()
+            self._classified[key] = route_class
+        return route_class
+
+    def limits_for(
+        self, route_class: str, level: str, tenant_id: Optional[str] = None
+    ) -> Optional[Tuple[int, float]]:
+        if tenant_id is not None:
+            override = (
+                self.tenant_limits.get(tenant_id, {}).get(route_class, {}).get(level)
+            )
+            if override is not None:
+                return override
+        return self.limits.get(route_class, {}).get(level)
+
+
+class JwtIdentityResolver:
+    """
+    (tenant_id, user_id) from a bearer token, validated with python-jose.
+
+    Validated tokens are cached until they expire, so the signature of a
+    client's token is checked once rather than on every request.
+    """
+
+    def __init__(
+        self,
+        secret_key: str,
+        algorithm: str = "HS256",
+        cache_size: int = DEFAULT_TOKEN_CACHE_SIZE,
+    ):
+        from jose import JWTError, jwt
+
+        self._jwt = jwt
+        self._error = JWTError
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.cache_size = cache_size
+        # token -> (identity or None, expiry as epoch seconds)
+        self._cache: "OrderedDict[str, Tuple[Optional[Identity], float]]" = (
+            OrderedDict()
+        )
+        self.invalid_tokens = 0
+
+    def __call__(self, authorization: str) -> Optional[Identity]:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        cached = self._cache.get(token)
+        if cached is not None:
+            identity, expires_at = cached
+            if time.time() < expires_at:
+                self._cache.move_to_end(token)
+                return identity
+            del self._cache[token]
+            return None
+
+        try:
+            claims = self._jwt.decode(
+                token, self.secret_key, algorithms=[self.algorithm]
+            )
+        except self._error:
+            self.invalid_tokens += 1
+            return None
+        tenant_id = claims.get("tenant_id")
+        user_id = claims.get("user_id") or claims.get("sub")
+        identity = (str(tenant_id), str(user_id)) if tenant_id and user_id else None
+        self._cache[token] = (identity, float(claims.get("exp", time.time() + 300)))
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return identity
+
+
+class QuotaEngine:
+    """
+    Hierarchical GCRA quotas per (tenant, user, IP, route class), or per IP for
+    anonymous requests.
+
+    Usage:
+        engine = QuotaEngine(DEFAULT_QUOTA_POLICY, JwtIdentityResolver(secret, "HS256"))
+        decision = engine.check_request(client_ip, authorization_header, method, path)
+        if not decision.allowed:
+            ...  # 429, and decision.level says which quota ran out
+
+    ``policy_path`` is re-read when its modification time changes, checked at
+    most every ``reload_interval`` seconds.
+
+    Not thread-safe; the middleware calls it from the event loop only.
+    """
+
+    def __init__(
+        self,
+        policy: Optional[Dict[str, Any]] = None,
+        identity_resolver=None,
+        policy_path: Optional[str] = None,
+        reload_interval: float = 30.0,
+        max_keys: int = DEFAULT_MAX_KEYS,
+    ):
+        self.identity_resolver = identity_resolver
+        self.policy_path = policy_path
+        self.reload_interval = reload_interval
+        self.max_keys = max_keys
+        self._policy_mtime = 0.0
+        self._next_reload_check = 0.0
+        if policy_path:
+            policy = self._read_policy_file()
+        self.policy = QuotaPolicy(
+            policy if policy is not None else DEFAULT_QUOTA_POLICY
+        )
+        # (level, *ids, route class) -> theoretical arrival time (monotonic seconds)
+        self._tat: "OrderedDict[tuple, float]" = OrderedDict()
+        self.allowed = 0
+        self.rejected_by_level = {level: 0 for level in QUOTA_LEVELS}
+        self.reloads = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def reload(self, policy: Dict[str, Any]):
+        """
+        Replace the policy. Counters start afresh: an arrival time only means
+        something under the limits that produced it.
+        """
+        self.policy = QuotaPolicy(policy)
+        self._tat.clear()
+        self.reloads += 1
+        logger.info(
+            "Quota policy reloaded",
+            extra={
+                "custom_dimensions": {
+                    "route_classes": sorted(self.policy.limits),
+                    "path": self.policy_path,
+                }
+            },
+        )
+
+    def reload_from_file(self):
+        self.reload(self._read_policy_file())
+
+    def _read_policy_file(self) -> Dict[str, Any]:
+        if self.policy_path is None:
+            raise ValueError("QuotaEngine has no policy_path to read")
+        self._policy_mtime = os.stat(self.policy_path).st_mtime
+        with open(self.policy_path, encoding="utf-8") as policy_file:
+            return json.load(policy_file)
+
+    def _maybe_reload(self, now: float, policy_path: str):
+        self._next_reload_check = now + self.reload_interval
+        try:
+            if os.stat(policy_path).st_mtime != self._policy_mtime:
+                self.reload_from_file()
+        except (OSError, ValueError) as e:
+            # Keep enforcing the last good policy
+            logger.error(
+                f"Quota policy reload failed: {str(e)}",
+                extra={
+                    "custom_dimensions": {
+                        "path": self.policy_path,
+                        "error_type": type(e).__name__,
+                    }
+                },
+            )
+
+    def check_request(
+        self,
+        client_ip: str,
+        authorization: str,
+        method: str,
+        path: str,
+        now: Optional[float] = None,
+    ) -> QuotaDecision:
+        """Resolve the caller's identity from ``authorization`` and check its quotas."""
+        return self.check(
+            client_ip, self.resolve_identity(authorization), method, path, now
+        )
+
+    def resolve_identity(self, authorization: str) -> Optional[Identity]:
+        """(tenant_id, user_id) of a validated bearer token, None when anonymous."""
+        if authorization and self.identity_resolver is not None:
+            return self.identity_resolver(authorization)
+        return None
+
+    def check(
+        self,
+        client_ip: str,
+        identity: Optional[Identity],
+        method: str,
+        path: str,
+        now: Optional[float] = None,
+    ) -> QuotaDecision:
+        if now is None:
+            now = time.monotonic()
+        if self.policy_path and now >= self._next_reload_check:
+            self._maybe_reload(now, self.policy_path)
+        policy = self.policy
+        route_class = policy.classify(method, path)
+
+        # (level, counter key, tenant whose overrides apply)
+        levels: Tuple[Tuple[str, tuple, Optional[str]], ...]
+        if identity is not None:
+            tenant_id, user_id = identity
+            levels = (
+                ("tenant", ("tenant", tenant_id, route_class), tenant_id),
+                ("user", ("user", tenant_id, user_id, route_class), tenant_id),
+                ("ip", ("ip", client_ip, route_class), tenant_id),
+            )
+        else:
+            levels = (("ip", ("ip", client_ip, route_class), None),)
+
+        # One pass: compute every level's new TAT, commit only if all admit the request
+        tat_by_key = self._tat
+        updates = []
+        constrained = None
+        for level, key, override_tenant in levels:
+            limits = policy.limits_for(route_class, level, override_tenant)
+            if limits is None:
+                continue
+            limit, window = limits
+            emission_interval = window / limit
+            tat = tat_by_key.get(key)
+            if tat is None or tat < now:
+                tat = now
+            new_tat = tat + emission_interval
+            allow_at = new_tat - window
+            if allow_at > now:
+                self.rejected_by_level[level] += 1
+                remaining = remaining_requests(
+                    window, tat - now, emission_interval, now
+                )
+                return QuotaDecision(
+                    False,
+                    limit,
+                    remaining,
+                    allow_at - now,
+                    tat - now,
+                    level,
+                    window,
+                    route_class,
+                )
+            remaining = remaining_requests(
+                window, new_tat - now, emission_interval, now
+            )
+            updates.append((key, new_tat))
+            if constrained is None or remaining < constrained.remaining:
+                constrained = QuotaDecision(
+                    True,
+                    limit,
+                    remaining,
+                    0.0,
+                    new_tat - now,
+                    level,
+                    window,
+                    route_class,
+                )
+
+        self.allowed += 1
+        for key, new_tat in updates:
+            if key in tat_by_key:
+                tat_by_key.move_to_end(key)
+                tat_by_key[key] = new_tat
+            else:
+                tat_by_key[key] = new_tat
+                self._evict(now)
+        if constrained is None:
+            # No quota applies to this route class
+            return QuotaDecision(True, 0, 0, 0.0, 0.0, "none", 0.0, route_class)
+        return constrained
+
+    def _evict(self, now: float):
+        """Drop expired keys, then the least recently seen keys past the cap."""
+        tat_by_key = self._tat
+        # Bounded per call so one request never pays for a large sweep
+        for _ in range(2):
+            oldest_key = next(iter(tat_by_key))
+            if tat_by_key[oldest_key] > now:
+                break
+            del tat_by_key[oldest_key]
+            self.expired += 1
+        while len(tat_by_key) > self.max_keys:
+            tat_by_key.popitem(last=False)
+            self.evicted += 1
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def get_stats(self) -> dict:
+        return {
+            "tracked_keys": len(self._tat),
+            "max_keys": self.max_keys,
+            "allowed": self.allowed,
+            "rejected_by_level": dict(self.rejected_by_level),
+            "route_classes": sorted(self.policy.limits),
+            "tenant_overrides": len(self.policy.tenant_limits),
+            "policy_reloads": self.reloads,
+            "expired_keys": self.expired,
+            "evicted_keys": self.evicted,
+        }
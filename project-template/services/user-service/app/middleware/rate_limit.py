@@ -0,0 +1,411 @@
+"""
+Rate limiting for the security middleware.
+
+``GcraRateLimiter`` implements the generic cell rate algorithm: each key holds
+a single float, its theoretical arrival time (TAT). A check is O(1) whatever
+the request rate. Keys live in an LRU ordered by last request; a key whose
+TAT has passed carries no state worth keeping, so expired keys are dropped
+from the cold end as new requests arrive, and ``max_keys`` caps memory when
+more clients are active than that.
+
+``DistributedRateLimiter`` shares one limit across replicas through a
+backend such as ``RedisRateLimitBackend``, leasing tokens in batches so that
+most checks stay local.
+"""
+
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_KEYS = 100_000
+
+# TATs are absolute monotonic times, so ``tat - now`` carries a few ulps of
+# ``now`` of rounding error; this many ulps are forgiven when counting requests
+REMAINING_TOLERANCE_ULPS = 16
+
+
+class RateLimitDecision:
+    """Outcome of one rate limit check."""
+
+    __slots__ = ("allowed", "limit", "remaining", "retry_after", "reset_after")
+
+    def __init__(
+        self,
+        allowed: bool,
+        limit: int,
+        remaining: int,
+        retry_after: float,
+        reset_after: float,
+    ):
+        self.allowed = allowed
+        self.limit = limit
+        # Requests that could still be made right now
+        self.remaining = remaining
+        # Seconds until the next request would be allowed (0 when allowed)
+        self.retry_after = retry_after
+        # Seconds until the key's full quota is available again
+        self.reset_after = reset_after
+
+
+def remaining_requests(
+    window: float, reset_after: float, emission_interval: float, now: float
+) -> int:
+    """Whole requests that still fit in ``window`` once ``reset_after`` is used up."""
+    tolerance = REMAINING_TOLERANCE_ULPS * math.ulp(abs(now) + window)
+    return max(0, int((window - reset_after + tolerance) / emission_interval))
+
+
+def rate_limit_headers(decision: RateLimitDecision, window: float) -> Dict[str, str]:
+    """RateLimit-* headers (IETF httpapi-ratelimit-headers draft) for a decision."""
+    return {
+        "RateLimit-Limit": str(decision.limit),
+        "RateLimit-Remaining": str(decision.remaining),
+        "RateLimit-Reset": str(math.ceil(decision.reset_after)),
+        "RateLimit-Policy": f"{decision.limit};w={math.ceil(window)}",
+    }
+
+
+class GcraRateLimiter:
+    """
+    ``limit`` requests per ``window`` seconds per key, with bursts of up to ``limit``.
+
+    Usage:
+        limiter = GcraRateLimiter(limit=100, window=60)
+        decision = limiter.check(client_ip)
+        if not decision.allowed:
+            ...  # 429 with Retry-After: decision.retry_after
+
+    Not thread-safe; the middleware calls it from the event loop only.
+    """
+
+    def __init__(
+        self, limit: int, window: float = 60.0, max_keys: int = DEFAULT_MAX_KEYS
+    ):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.emission_interval = window / limit
+        # key -> theoretical arrival time (monotonic seconds)
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def check(
+        self, key: str, cost: int = 1, now: Optional[float] = None
+    ) -> RateLimitDecision:
+        """Count a request of ``cost`` units against ``key`` if it fits."""
+        if now is None:
+            now = time.monotonic()
+        tat_by_key = self._tat
+
+        tat = tat_by_key.get(key)
+        if tat is None or tat < now:
+            tat = now
+        new_tat = tat + self.emission_interval * cost
+        allow_at = new_tat - self.window
+
+        if allow_at > now:
+            self.rejected += 1
+            if key in tat_by_key:
+                tat_by_key.move_to_end(key)
+            remaining = remaining_requests(
+                self.window, tat - now, self.emission_interval, now
+            )
+            return RateLimitDecision(
+                False, self.limit, remaining, allow_at - now, tat - now
+            )
+
+        self.allowed += 1
+        if key in tat_by_key:
+            tat_by_key[key] = new_tat
+            tat_by_key.move_to_end(key)
+        else:
+            tat_by_key[key] = new_tat
+            self._evict(now)
+        remaining = remaining_requests(
+            self.window, new_tat - now, self.emission_interval, now
+        )
+        return RateLimitDecision(True, self.limit, remaining, 0.0, new_tat - now)
+
+    def _evict(self, now: float):
+        """Drop expired keys, then the least recently seen keys past the cap."""
+        tat_by_key = self._tat
+        # Bounded per call so one request never pays for a large sweep
+        for _ in range(2):
+            oldest_key = next(iter(tat_by_key))
+            if tat_by_key[oldest_key] > now:
+                break
+            del tat_by_key[oldest_key]
+            self.expired += 1
+        while len(tat_by_key) > self.max_keys:
+            tat_by_key.popitem(last=False)
+            self.evicted += 1
+
+    def reset(self, key: Optional[str] = None):
+        """Forget one key, or every key."""
+        if key is None:
+            self._tat.clear()
+        else:
+            self._tat.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def get_stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "window_seconds": self.window,
+            "tracked_keys": len(self._tat),
+            "max_keys": self.max_keys,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "expired_keys": self.expired,
+            "evicted_keys": self.evicted,
+        }
+
+
+# Token bucket shared by every replica. Server time (TIME) keeps replicas with
+# skewed clocks consistent; the key expires once the bucket would be full anyway.
+# KEYS[1] bucket key; ARGV: capacity, window in ms, tokens requested.
+# Returns {granted, tokens left, ms until the next token when nothing was granted}.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local refill_per_ms = capacity / window_ms
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now_ms
+tokens = math.min(capacity, tokens + math.max(0, now_ms - ts) * refill_per_ms)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now_ms)
+redis.call('PEXPIRE', KEYS[1], window_ms)
+local retry_ms = 0
+if granted == 0 then
+    retry_ms = math.ceil((1 - tokens) / refill_per_ms)
+end
+return {granted, math.floor(tokens), retry_ms}
+"""
+
+
+class RedisRateLimitBackend:
+    """
+    Shared token buckets in Redis (or any server that runs Redis Lua scripts).
+
+    ``client`` is a ``redis.asyncio.Redis``; the script is loaded once and run
+    with EVALSHA, and reloaded if the server has flushed its script cache.
+    """
+
+    def __init__(self, client, key_prefix: str = "ratelimit:"):
+        self.client = client
+        self.key_prefix = key_prefix
+        self._sha: Optional[str] = None
+
+    async def acquire(
+        self, key: str, requested: int, limit: int, window: float
+    ) -> Tuple[int, int, float]:
+        """
+        Take up to ``requested`` tokens.
+
+        Returns (granted, remaining, retry_after seconds).
+        """
+        args = (1, f"{self.key_prefix}{key}", limit, int(window * 1000), requested)
+        if self._sha is None:
+            self._sha = await self.client.script_load(TOKEN_BUCKET_SCRIPT)
+        try:
+            result = await self.client.evalsha(self._sha, *args)
+        except Exception as e:
+            if "NOSCRIPT" not in str(e):
+                raise
+            self._sha = await self.client.script_load(TOKEN_BUCKET_SCRIPT)
+            result = await self.client.evalsha(self._sha, *args)
+        granted, remaining, retry_ms = (int(value) for value in result)
+        return granted, remaining, retry_ms / 1000
+
+
+class TokenLease:
+    """Tokens this process has taken from the shared bucket for one key."""
+
+    __slots__ = ("tokens", "size", "expires_at", "blocked_until", "remaining")
+
+    def __init__(self):
+        self.tokens = 0
+        self.size = 1
+        self.expires_at = 0.0
+        self.blocked_until = 0.0
+        self.remaining = 0
+
+
+class DistributedRateLimiter:
+    """
+    One limit shared by every replica, without a backend round trip per request.
+
+    Each process leases tokens from the shared bucket and spends them locally.
+    A key's lease doubles (up to ``max_lease``) while it keeps running out
+    before ``lease_ttl``, so busy clients cost one round trip per many
+    requests and quiet ones never hold more than one token. Unspent tokens
+    expire with the lease; they were already taken from the shared bucket,
+    so leasing can under-admit slightly but never over-admit. Rejections are
+    cached until the backend's retry time.
+
+    When the backend errors or takes longer than ``timeout``, checks fall back
+    to a per-process GcraRateLimiter at ``local_limit`` for
+    ``degraded_backoff`` seconds before the backend is tried again. Every
+    replica falls back at once when the backend is down, so ``local_limit``
+    defaults to this process's share, ``limit // expected_replicas``; one of
+    the two is required, so a degraded backend never admits ``limit`` per
+    replica.
+
+    Usage:
+        limiter = DistributedRateLimiter(
+            RedisRateLimitBackend(redis_client), limit=100, window=60
+        )
+        decision = await limiter.check(client_ip)
+    """
+
+    def __init__(
+        self,
+        backend,
+        limit: int,
+        window: float = 60.0,
+        local_limit: Optional[int] = None,
+        expected_replicas: Optional[int] = None,
+        max_lease: int = 16,
+        lease_ttl: float = 1.0,
+        timeout: float = 0.05,
+        degraded_backoff: float = 5.0,
+        max_keys: int = DEFAULT_MAX_KEYS,
+    ):
+        self.backend = backend
+        self.limit = limit
+        self.window = window
+        self.max_lease = max(1, min(max_lease, limit))
+        self.lease_ttl = lease_ttl
+        self.timeout = timeout
+        self.degraded_backoff = degraded_backoff
+        self.max_keys = max_keys
+        if local_limit is None:
+            if not expected_replicas or expected_replicas < 1:
+                raise ValueError(
+                    "DistributedRateLimiter needs local_limit or expected_replicas "
+                    "for its fallback"
+                )
+            local_limit = max(1, limit // expected_replicas)
+        self.fallback = GcraRateLimiter(local_limit, window, max_keys)
+        self._leases: "OrderedDict[str, TokenLease]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._degraded_until = 0.0
+        self.round_trips = 0
+        self.lease_hits = 0
+        self.cached_rejections = 0
+        self.fallback_checks = 0
+        self.backend_failures = 0
+
+    async def check(self, key: str) -> RateLimitDecision:
+        while True:
+            now = time.monotonic()
+            lease = self._leases.get(key)
+            if lease is not None:
+                if lease.tokens > 0 and now < lease.expires_at:
+                    lease.tokens -= 1
+                    self.lease_hits += 1
+                    return RateLimitDecision(
+                        True, self.limit, lease.tokens + lease.remaining, 0.0, 0.0
+                    )
+                if now < lease.blocked_until:
+                    self.cached_rejections += 1
+                    retry_after = lease.blocked_until - now
+                    return RateLimitDecision(
+                        False, self.limit, 0, retry_after, retry_after
+                    )
+            # Concurrent requests for one key share a single round trip
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            await asyncio.shield(pending)
+
+        if now < self._degraded_until:
+            self.fallback_checks += 1
+            return self.fallback.check(key)
+        return await self._refill(key, lease, now)
+
+    async def _refill(
+        self, key: str, lease: Optional[TokenLease], now: float
+    ) -> RateLimitDecision:
+        if lease is None:
+            lease = self._leases[key] = TokenLease()
+            while len(self._leases) > self.max_keys:
+                self._leases.popitem(last=False)
+        else:
+            self._leases.move_to_end(key)
+            # Grow the lease while it runs out before expiring; shrink it back otherwise
+            lease.size = (
+                min(self.max_lease, lease.size * 2) if now < lease.expires_at else 1
+            )
+
+        done = asyncio.get_running_loop().create_future()
+        self._inflight[key] = done
+        try:
+            granted, remaining, retry_after = await asyncio.wait_for(
+                self.backend.acquire(key, lease.size, self.limit, self.window),
+                self.timeout,
+            )
+        except Exception as e:
+            self.backend_failures += 1
+            self.fallback_checks += 1
+            self._degraded_until = now + self.degraded_backoff
+            logger.warning(
+                "Shared rate limit backend unavailable, using local limits",
+                extra={
+                    "custom_dimensions": {
+                        "error": str(e),
+                        "error_type": type(e).__name__,
+                        "timeout_ms": self.timeout * 1000,
+                        "degraded_seconds": self.degraded_backoff,
+                    }
+                },
+            )
+            return self.fallback.check(key)
+        finally:
+            del self._inflight[key]
+            done.set_result(None)
+
+        self.round_trips += 1
+        now = time.monotonic()
+        lease.remaining = remaining
+        if granted == 0:
+            lease.tokens = 0
+            lease.blocked_until = now + retry_after
+            return RateLimitDecision(False, self.limit, 0, retry_after, retry_after)
+        lease.tokens = granted - 1
+        lease.expires_at = now + self.lease_ttl
+        lease.blocked_until = 0.0
+        return RateLimitDecision(True, self.limit, lease.tokens + remaining, 0.0, 0.0)
+
+    @property
+    def degraded(self) -> bool:
+        return time.monotonic() < self._degraded_until
+
+    def get_stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "window_seconds": self.window,
+            "degraded": self.degraded,
+            "leased_keys": len(self._leases),
+            "round_trips": self.round_trips,
+            "lease_hits": self.lease_hits,
+            "cached_rejections": self.cached_rejections,
+            "fallback_checks": self.fallback_checks,
+            "backend_failures": self.backend_failures,
+            "fallback": self.fallback.get_stats(),
+        }
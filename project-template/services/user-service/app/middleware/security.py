@@ -2,151 +2,227 @@
 Security middleware for compliance and protection.
 """
 
-import time
+import json
+import math
 import logging
-import re
-from typing import Callable, Set
-from fastapi import Request, Response, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+import ipaddress
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote_plus
+from fastapi import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.middleware.abuse import AbuseScorer
+from app.middleware.blocklist import IpBlocklist
+from app.middleware.quotas import Identity, QuotaEngine
+from app.middleware.rate_limit import (
+    DEFAULT_MAX_KEYS,
+    DistributedRateLimiter,
+    GcraRateLimiter,
+    RateLimitDecision,
+    rate_limit_headers,
+)
+from app.middleware.waf import (
+    BODY_TOO_LARGE,
+    DEFAULT_BODY_OVERLAP_BYTES,
+    DEFAULT_BODY_PATTERNS,
+    DEFAULT_DECISION_CACHE_SIZE,
+    DEFAULT_MAX_BODY_BYTES,
+    DEFAULT_UNSCANNED_HEADERS,
+    INSPECTED_CONTENT_TYPES,
+    ScanDecisionCache,
+    StreamingBodyInspector,
+    SuspiciousPatternMatcher,
+)
 
 logger = logging.getLogger(__name__)
 
+# Bodies of the responses the middleware serves itself, by status code
+REJECTION_ERRORS = {
+    400: "Bad request",
+    403: "Access forbidden",
+    413: "Request entity too large",
+    429: "Rate limit exceeded",
+}
+
+RawHeaders = List[Tuple[bytes, bytes]]
+
+# (status code, extra response headers, abuse signal) for a request refused
+# before the application runs
+Rejection = Tuple[int, Optional[Dict[str, str]], Optional[str]]
+
+
+def encode_headers(headers: Dict[str, str]) -> RawHeaders:
+    """ASGI raw header pairs: lowercased latin-1 names and latin-1 values."""
+    return [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in headers.items()
+    ]
+
+
+def append_raw_headers(
+    headers: Iterable[Tuple[bytes, bytes]], raw_headers: RawHeaders, names: frozenset
+) -> RawHeaders:
+    """``headers`` plus ``raw_headers``, minus any of ``headers`` named in ``names``."""
+    if any(name in names for name, _ in headers):
+        headers = [header for header in headers if header[0] not in names]
+    return [*headers, *raw_headers]
+
+
+class RequestBodyRejected(Exception):
+    """Raised through the application's receive channel to refuse the body."""
+
+    def __init__(self, violation: str):
+        super().__init__(violation)
+        self.violation = violation
+
+
+class SecurityMiddleware:
+    """
+    Security middleware for request filtering and monitoring.
+
+    Raw ASGI. Security headers are encoded once and appended to each
+    ``http.response.start`` as raw pairs, and the middleware's own
+    400/403/413/429 responses are pre-rendered bytes.
+
+    Request bodies are inspected as the application reads them: each chunk
+    is counted against ``max_body_bytes`` (whether or not a content-length
+    was sent) and text bodies are scanned for suspicious patterns, with
+    ``body_overlap_bytes`` carried between chunks. The first violation is
+    raised into the application's receive call, and the application's
+    response is replaced by a 413 or 400. Chunks are passed through
+    unchanged and never buffered.
+
+    The steps are public (``screen``, ``reject``, ``body_inspector``,
+    ``response_headers``, ``complete``) so RequestPipeline can run them in
+    its own single pass; constructed with ``app=None`` for that use.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_requests_per_minute: int = 100,
+        rate_limit_window: float = 60.0,
+        max_tracked_clients: int = DEFAULT_MAX_KEYS,
+        shared_rate_limiter: Optional[DistributedRateLimiter] = None,
+        unscanned_headers: Iterable[str] = DEFAULT_UNSCANNED_HEADERS,
+        decision_cache_size: int = DEFAULT_DECISION_CACHE_SIZE,
+        max_body_bytes: int = DEFAULT_MAX_BODY_BYTES,
+        body_overlap_bytes: int = DEFAULT_BODY_OVERLAP_BYTES,
+        blocklist: Optional[IpBlocklist] = None,
+        abuse_scorer: Optional[AbuseScorer] = None,
+        quota_engine: Optional[QuotaEngine] = None,
+        trusted_proxies: Optional[Iterable[str]] = None,
+        identity_resolver: Optional[Callable[[str], Optional[Identity]]] = None,
+    ):
+        self.app = app
 
-class SecurityMiddleware(BaseHTTPMiddleware):
-    """Security middleware for request filtering and monitoring."""
-    
-    def __init__(self, app, *args, **kwargs):
-        super().__init__(app, *args, **kwargs)
-        
         # Security configurations
         self.blocked_user_agents = {
-            'sqlmap', 'nikto', 'nmap', 'masscan', 'nessus',
-            'openvas', 'w3af', 'burp', 'webscarab', 'paros'
+            "sqlmap",
+            "nikto",
+            "nmap",
+            "masscan",
+            "nessus",
+            "openvas",
+            "w3af",
+            "burp",
+            "webscarab",
+            "paros",
         }
-        
-        self.suspicious_patterns = [
-            r'(?i)(union|select|insert|update|delete|drop|create|alter)\s+',
-            r'(?i)(script|javascript|vbscript|onload|onerror)',
-            r'(?i)(<|%3c)(script|iframe|object|embed)',
-            r'(?i)(\.\.\/|\.\.\\|%2e%2e%2f|%2e%2e%5c)',
-            r'(?i)(etc\/passwd|boot\.ini|windows\/system32)',
-            r'(?i)(eval\s*\(|exec\s*\(|system\s*\()'
-        ]
-        
-        self.rate_limits = {}  # IP -> [timestamps]
-        self.max_requests_per_minute = 100
-        self.blocked_ips: Set[str] = set()
-        
+
+        # Keyword-prefiltered matcher: one scan over all request inputs
+        self.pattern_matcher = SuspiciousPatternMatcher()
+        # Bodies hold free text; only injection syntax is flagged there
+        self.body_pattern_matcher = SuspiciousPatternMatcher(DEFAULT_BODY_PATTERNS)
+        # Header lines repeat across requests; clean ones are not scanned again
+        self.decision_cache = ScanDecisionCache(decision_cache_size)
+        self.unscanned_headers = frozenset(
+            header.lower() for header in unscanned_headers
+        )
+        self._unscanned_raw_headers = frozenset(
+            header.encode("latin-1") for header in self.unscanned_headers
+        )
+        self.max_body_bytes = max_body_bytes
+        self.body_overlap_bytes = body_overlap_bytes
+        self.rejected_bodies = {"too_large": 0, "suspicious": 0}
+
+        # O(1) per check, bounded to max_tracked_clients IPs
+        self.max_requests_per_minute = max_requests_per_minute
+        self.rate_limit_window = rate_limit_window
+        self.rate_limiter = GcraRateLimiter(
+            max_requests_per_minute, rate_limit_window, max_tracked_clients
+        )
+        # When set, the limit is shared by every replica and rate_limiter is unused
+        self.shared_rate_limiter = shared_rate_limiter
+        # When set, tenant/user quotas from the bearer token (IP for anonymous)
+        # replace both
+        self.quota_engine = quota_engine
+        # (tenant_id, user_id) from the Authorization header, recorded for usage
+        # metering whether or not quotas are enabled; defaults to the quota engine's
+        self.identity_resolver = identity_resolver
+        # Forwarding headers are honoured only from these networks; None trusts
+        # every peer
+        self.trusted_proxies = (
+            None
+            if trusted_proxies is None
+            else [
+                ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies
+            ]
+        )
+        # Addresses and CIDR ranges, each with its own expiry; may be preloaded from
+        # a threat feed
+        self.blocklist = blocklist if blocklist is not None else IpBlocklist()
+        # Abuse signals add to a decaying per-client score; bans are temporary, by tier
+        self.abuse_scorer = abuse_scorer if abuse_scorer is not None else AbuseScorer()
+
         # Security headers to add to all responses
         self.security_headers = {
-            'X-Content-Type-Options': 'nosniff',
-            'X-Frame-Options': 'DENY',
-            'X-XSS-Protection': '1; mode=block',
-            'Strict-Transport-Security': 'max-age=31536000; includeSubDomains',
-            'Content-Security-Policy': "default-src 'self'; script-src 'self' 'unsafe-inline'; style-src 'self' 'unsafe-inline'",
-            'Referrer-Policy': 'strict-origin-when-cross-origin',
-            'Permissions-Policy': 'geolocation=(), microphone=(), camera=()'
+            "X-Content-Type-Options": "nosniff",
+            "X-Frame-Options": "DENY",
+            "X-XSS-Protection": "1; mode=block",
+            "Strict-Transport-Security": "max-age=31536000; includeSubDomains",
+            "Content-Security-Policy": (
+                "default-src 'self'; script-src 'self' 'unsafe-inline'; "
+                "style-src 'self' 'unsafe-inline'"
+            ),
+            "Referrer-Policy": "strict-origin-when-cross-origin",
+            "Permissions-Policy": "geolocation=(), microphone=(), camera=()",
+        }
+        # Encoded once and appended to every response start as raw pairs
+        self.raw_security_headers = encode_headers(self.security_headers)
+        self.security_header_names = frozenset(
+            name for name, _ in self.raw_security_headers
+        )
+        # Rejections are served from pre-rendered bodies and header blocks
+        self._rejections: Dict[int, Tuple[bytes, RawHeaders]] = {
+            status: self._render_rejection(error)
+            for status, error in REJECTION_ERRORS.items()
         }
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process request with security checks."""
-        client_ip = self._get_client_ip(request)
-        user_agent = request.headers.get('user-agent', '').lower()
-        
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.register(scope)
+        request = Request(scope)
+        client_ip, user_agent = self.identify(request)
+
         try:
-            # Check if IP is blocked
-            if client_ip in self.blocked_ips:
-                logger.warning(
-                    f"Blocked IP attempted access: {client_ip}",
-                    extra={"custom_dimensions": {"ip": client_ip, "user_agent": user_agent}}
-                )
-                return JSONResponse(
-                    status_code=403,
-                    content={"error": "Access forbidden"},
-                    headers=self.security_headers
-                )
-            
-            # Rate limiting check
-            if not self._check_rate_limit(client_ip):
-                logger.warning(
-                    f"Rate limit exceeded for IP: {client_ip}",
-                    extra={"custom_dimensions": {"ip": client_ip, "user_agent": user_agent}}
-                )
-                return JSONResponse(
-                    status_code=429,
-                    content={"error": "Rate limit exceeded"},
-                    headers={**self.security_headers, "Retry-After": "60"}
-                )
-            
-            # Check for malicious user agents
-            if self._is_malicious_user_agent(user_agent):
-                logger.warning(
-                    f"Malicious user agent detected: {user_agent}",
-                    extra={"custom_dimensions": {"ip": client_ip, "user_agent": user_agent}}
-                )
-                self.blocked_ips.add(client_ip)
-                return JSONResponse(
-                    status_code=403,
-                    content={"error": "Access forbidden"},
-                    headers=self.security_headers
-                )
-            
-            # Check for suspicious patterns in request
-            if await self._has_suspicious_content(request):
-                logger.warning(
-                    f"Suspicious request patterns detected from {client_ip}",
-                    extra={
-                        "custom_dimensions": {
-                            "ip": client_ip,
-                            "user_agent": user_agent,
-                            "path": str(request.url.path),
-                            "method": request.method
-                        }
-                    }
-                )
-                return JSONResponse(
-                    status_code=400,
-                    content={"error": "Bad request"},
-                    headers=self.security_headers
-                )
-            
-            # Validate content length
-            content_length = request.headers.get('content-length')
-            if content_length and int(content_length) > 10 * 1024 * 1024:  # 10MB limit
-                logger.warning(
-                    f"Large request body from {client_ip}: {content_length} bytes",
-                    extra={"custom_dimensions": {"ip": client_ip, "content_length": content_length}}
-                )
-                return JSONResponse(
-                    status_code=413,
-                    content={"error": "Request entity too large"},
-                    headers=self.security_headers
-                )
-            
-            # Process the request
-            response = await call_next(request)
-            
-            # Add security headers to response
-            for header, value in self.security_headers.items():
-                response.headers[header] = value
-            
-            # Log successful requests for monitoring
-            if hasattr(request.state, 'user_id'):
-                logger.info(
-                    "Authenticated request processed",
-                    extra={
-                        "custom_dimensions": {
-                            "user_id": request.state.user_id,
-                            "ip": client_ip,
-                            "endpoint": f"{request.method} {request.url.path}",
-                            "status_code": response.status_code
-                        }
-                    }
-                )
-            
-            return response
-            
+            rejection, limit_headers = await self.screen(request, client_ip, user_agent)
+            if rejection is not None:
+                await self.reject(send, client_ip, rejection)
+                return
+
+            # Process the request, inspecting the body as the application reads it
+            status_code, violation = await self._call_app(
+                scope, receive, send, request, limit_headers
+            )
+            await self.complete(
+                send, request, client_ip, user_agent, status_code, violation
+            )
+
         except Exception as e:
             logger.error(
                 f"Security middleware error: {str(e)}",
@@ -154,132 +230,455 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                     "custom_dimensions": {
                         "ip": client_ip,
                         "error": str(e),
-                        "error_type": type(e).__name__
+                        "error_type": type(e).__name__,
                     }
-                }
+                },
             )
             raise
-    
+
+    def register(self, scope: Scope) -> None:
+        """Expose this middleware to get_security_summary (/metrics) via the app."""
+        application = scope.get("app")
+        if application is not None and not hasattr(application.state, "security"):
+            application.state.security = self
+
+    def identify(self, request: Request) -> Tuple[str, str]:
+        """Client IP and lowercased user agent of a request."""
+        return (
+            self._get_client_ip(request),
+            request.headers.get("user-agent", "").lower(),
+        )
+
+    def resolve_identity(self, request: Request) -> Optional[Identity]:
+        """(tenant_id, user_id) of the validated bearer token, None when anonymous."""
+        authorization = request.headers.get("authorization", "")
+        if not authorization:
+            return None
+        if self.identity_resolver is not None:
+            return self.identity_resolver(authorization)
+        if self.quota_engine is not None:
+            return self.quota_engine.resolve_identity(authorization)
+        return None
+
+    async def screen(
+        self, request: Request, client_ip: str, user_agent: str
+    ) -> Tuple[Optional[Rejection], Optional[Dict[str, str]]]:
+        """
+        Run the checks made before the application is called.
+
+        Returns ``(rejection, limit_headers)``. ``rejection`` is None when the
+        request may proceed; otherwise it is passed to ``reject``.
+        ``limit_headers`` are the RateLimit-* headers for the response.
+        """
+        # Check if IP is blocked
+        if self.blocklist.is_blocked(client_ip):
+            logger.warning(
+                f"Blocked IP attempted access: {client_ip}",
+                extra={
+                    "custom_dimensions": {"ip": client_ip, "user_agent": user_agent}
+                },
+            )
+            return (403, None, None), None
+
+        identity = self.resolve_identity(request)
+        if identity is not None:
+            # Usage metering attributes the request to this tenant
+            request.state.tenant_id = identity[0]
+
+        # Rate limiting check
+        rate_limit: RateLimitDecision
+        if self.quota_engine is not None:
+            rate_limit = self.quota_engine.check(
+                client_ip, identity, request.method, request.url.path
+            )
+            window = rate_limit.window
+            quota_level = rate_limit.level
+        else:
+            if self.shared_rate_limiter is not None:
+                rate_limit = await self.shared_rate_limiter.check(client_ip)
+            else:
+                rate_limit = self.rate_limiter.check(client_ip)
+            window = self.rate_limit_window
+            quota_level = "ip"
+        limit_headers = (
+            rate_limit_headers(rate_limit, window) if rate_limit.limit else None
+        )
+        if not rate_limit.allowed:
+            logger.warning(
+                f"Rate limit exceeded for IP: {client_ip}",
+                extra={
+                    "custom_dimensions": {
+                        "ip": client_ip,
+                        "user_agent": user_agent,
+                        "quota_level": quota_level,
+                    }
+                },
+            )
+            retry_headers = {
+                "Retry-After": str(math.ceil(rate_limit.retry_after)),
+                **(limit_headers or {}),
+            }
+            return (429, retry_headers, "rate_limited"), limit_headers
+
+        # Check for malicious user agents
+        if self._is_malicious_user_agent(user_agent):
+            logger.warning(
+                f"Malicious user agent detected: {user_agent}",
+                extra={
+                    "custom_dimensions": {"ip": client_ip, "user_agent": user_agent}
+                },
+            )
+            return (403, None, "malicious_user_agent"), limit_headers
+
+        # Check for suspicious patterns in request
+        if await self._has_suspicious_content(request):
+            logger.warning(
+                f"Suspicious request patterns detected from {client_ip}",
+                extra={
+                    "custom_dimensions": {
+                        "ip": client_ip,
+                        "user_agent": user_agent,
+                        "path": str(request.url.path),
+                        "method": request.method,
+                    }
+                },
+            )
+            return (400, None, "suspicious_pattern"), limit_headers
+
+        # Validate content length up front when the client declares it
+        content_length = request.headers.get("content-length")
+        if content_length and int(content_length) > self.max_body_bytes:
+            logger.warning(
+                f"Large request body from {client_ip}: {content_length} bytes",
+                extra={
+                    "custom_dimensions": {
+                        "ip": client_ip,
+                        "content_length": content_length,
+                    }
+                },
+            )
+            return (413, None, "body_too_large"), limit_headers
+
+        return None, limit_headers
+
+    async def reject(self, send: Send, client_ip: str, rejection: Rejection) -> None:
+        """Send the response for a ``screen`` rejection and score its abuse signal."""
+        status_code, extra_headers, signal = rejection
+        await self._reject(send, status_code, extra_headers)
+        if signal is not None:
+            self._record_abuse(client_ip, signal)
+
+    def body_inspector(self, request: Request) -> StreamingBodyInspector:
+        """Request body inspector: size limit always, pattern scan for text bodies."""
+        content_type = request.headers.get("content-type", "").lower()
+        scan_body = request.method in ("POST", "PUT", "PATCH") and any(
+            inspected in content_type for inspected in INSPECTED_CONTENT_TYPES
+        )
+        return StreamingBodyInspector(
+            self.body_pattern_matcher if scan_body else None,
+            self.max_body_bytes,
+            self.body_overlap_bytes,
+        )
+
+    def response_headers(
+        self, limit_headers: Optional[Dict[str, str]] = None
+    ) -> RawHeaders:
+        """
+        Raw headers appended to the application's response start.
+
+        They replace any header of the same name.
+        """
+        if limit_headers:
+            return [*self.raw_security_headers, *encode_headers(limit_headers)]
+        return self.raw_security_headers
+
+    async def complete(
+        self,
+        send: Send,
+        request: Request,
+        client_ip: str,
+        user_agent: str,
+        status_code: Optional[int],
+        violation: Optional[str],
+    ) -> None:
+        """
+        Finish a request the application was called for.
+
+        ``status_code`` is the status the application sent (None if nothing
+        was sent) and ``violation`` the body violation, if any. A rejected
+        body is answered with a 413 or 400 unless a response had already started.
+        """
+        if violation is not None:
+            too_large = violation == BODY_TOO_LARGE
+            self.rejected_bodies["too_large" if too_large else "suspicious"] += 1
+            logger.warning(
+                f"Request body rejected from {client_ip}: {violation}",
+                extra={
+                    "custom_dimensions": {
+                        "ip": client_ip,
+                        "user_agent": user_agent,
+                        "path": str(request.url.path),
+                        "method": request.method,
+                        "violation": violation,
+                        "max_body_bytes": self.max_body_bytes,
+                    }
+                },
+            )
+            if status_code is None:
+                if too_large:
+                    await self._reject(send, 413)
+                else:
+                    await self._reject(send, 400)
+            self._record_abuse(
+                client_ip, "body_too_large" if too_large else "suspicious_pattern"
+            )
+            return
+
+        # Bursts of 4xx responses (probing, credential stuffing) add up
+        if status_code is not None and 400 <= status_code < 500:
+            self._record_abuse(client_ip, "client_error")
+
+        # Log successful requests for monitoring
+        if hasattr(request.state, "user_id"):
+            logger.info(
+                "Authenticated request processed",
+                extra={
+                    "custom_dimensions": {
+                        "user_id": request.state.user_id,
+                        "ip": client_ip,
+                        "endpoint": f"{request.method} {request.url.path}",
+                        "status_code": status_code,
+                    }
+                },
+            )
+
+    async def _call_app(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        request: Request,
+        limit_headers: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Run the application with body inspection and security headers.
+
+        Returns (status code sent, or None if nothing was sent; body violation or None).
+        Once the body is rejected, the application's own response (usually
+        an error about the failed read) is discarded.
+        """
+        response_headers = self.response_headers(limit_headers)
+        security_header_names = self.security_header_names
+        inspector = self.body_inspector(request)
+        status_code = None
+        violation = None
+
+        async def inspecting_receive() -> Message:
+            nonlocal violation
+            message = await receive()
+            if message["type"] == "http.request" and violation is None:
+                violation = inspector.feed(message.get("body", b""))
+                if violation is not None:
+                    raise RequestBodyRejected(violation)
+            return message
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status_code
+            if violation is not None and status_code is None:
+                return
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Ours replace any the application set itself
+                message["headers"] = append_raw_headers(
+                    message.get("headers") or (),
+                    response_headers,
+                    security_header_names,
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, inspecting_receive, send_with_headers)
+        except RequestBodyRejected:
+            pass
+        except Exception:
+            if violation is None:
+                raise
+        return status_code, violation
+
+    def _record_abuse(self, client_ip: str, signal: str):
+        """Score an abuse signal and ban the client for the tier its score reached."""
+        ban_seconds = self.abuse_scorer.record(client_ip, signal)
+        if ban_seconds:
+            self.block_ip(
+                client_ip, f"Abuse score threshold reached ({signal})", ttl=ban_seconds
+            )
+
+    def _render_rejection(self, error: str) -> Tuple[bytes, RawHeaders]:
+        # Same bytes JSONResponse would render
+        body = json.dumps(
+            {"error": error}, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        headers = [
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"content-type", b"application/json"),
+            *self.raw_security_headers,
+        ]
+        return body, headers
+
+    async def _reject(
+        self,
+        send: Send,
+        status_code: int,
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Send a pre-rendered rejection; ``status_code`` is one of REJECTION_ERRORS."""
+        body, headers = self._rejections[status_code]
+        # A fresh list: outer middleware may append to the headers it is given
+        headers = (
+            [*headers, *encode_headers(extra_headers)]
+            if extra_headers
+            else list(headers)
+        )
+        await send(
+            {"type": "http.response.start", "status": status_code, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
     def _get_client_ip(self, request: Request) -> str:
         """Extract client IP address from request."""
+        peer_ip = request.client.host if request.client else "unknown"
+        if self.trusted_proxies is not None:
+            return self._get_forwarded_client_ip(request, peer_ip)
+
         # Check for forwarded headers (when behind a proxy/load balancer)
-        forwarded_for = request.headers.get('x-forwarded-for')
+        forwarded_for = request.headers.get("x-forwarded-for")
         if forwarded_for:
-            return forwarded_for.split(',')[0].strip()
-        
-        real_ip = request.headers.get('x-real-ip')
+            return forwarded_for.split(",")[0].strip()
+
+        real_ip = request.headers.get("x-real-ip")
         if real_ip:
             return real_ip
-        
+
         # Fallback to direct client IP
-        return request.client.host if request.client else 'unknown'
-    
-    def _check_rate_limit(self, ip: str) -> bool:
-        """Check if IP is within rate limits."""
-        current_time = time.time()
-        minute_ago = current_time - 60
-        
-        # Initialize or clean old entries
-        if ip not in self.rate_limits:
-            self.rate_limits[ip] = []
-        
-        # Remove old entries
-        self.rate_limits[ip] = [
-            timestamp for timestamp in self.rate_limits[ip]
-            if timestamp > minute_ago
-        ]
-        
-        # Check if within limits
-        if len(self.rate_limits[ip]) >= self.max_requests_per_minute:
+        return peer_ip
+
+    def _get_forwarded_client_ip(self, request: Request, peer_ip: str) -> str:
+        """
+        The nearest address not in trusted_proxies, walking x-forwarded-for from the
+        right.
+
+        Clients can prepend anything to x-forwarded-for; only the hops added
+        by trusted proxies are believed.
+        """
+        if not self._is_trusted_proxy(peer_ip):
+            return peer_ip
+        client_ip = peer_ip
+        for hop in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+            hop = hop.strip()
+            if not hop:
+                continue
+            client_ip = hop
+            if not self._is_trusted_proxy(hop):
+                break
+        return client_ip
+
+    def _is_trusted_proxy(self, ip: str) -> bool:
+        if self.trusted_proxies is None:
+            return True
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
             return False
-        
-        # Add current request
-        self.rate_limits[ip].append(current_time)
-        return True
-    
+        return any(address in network for network in self.trusted_proxies)
+
     def _is_malicious_user_agent(self, user_agent: str) -> bool:
         """Check if user agent appears to be malicious."""
         if not user_agent:
             return True  # Block empty user agents
-        
+
         return any(
-            blocked_agent in user_agent
-            for blocked_agent in self.blocked_user_agents
+            blocked_agent in user_agent for blocked_agent in self.blocked_user_agents
         )
-    
+
     async def _has_suspicious_content(self, request: Request) -> bool:
         """Check request for suspicious patterns."""
-        # Check URL path
-        if self._contains_suspicious_patterns(str(request.url)):
+        # Path, query and headers not already known to be clean are matched in a
+        # single pass
+        scope = request.scope
+        query_string = scope.get("query_string", b"")
+        texts = [scope["path"]]
+        if query_string:
+            query = query_string.decode("latin-1")
+            texts.append(query)
+            if "%" in query or "+" in query:
+                # Decoded as the application will see it; a full parse into params is
+                # not needed
+                texts.append(unquote_plus(query))
+        # Raw scope headers: a cache hit costs a dict lookup, no decoding
+        decision_cache = self.decision_cache
+        unscanned = self._unscanned_raw_headers
+        uncached = []
+        for raw_header in scope["headers"]:
+            if type(raw_header) is not tuple:
+                # ASGI allows [name, value] lists; keys must be hashable
+                raw_header = tuple(raw_header)
+            if raw_header[0] in unscanned:
+                decision_cache.skipped += 1
+                continue
+            if not decision_cache.is_clean(raw_header):
+                name, value = raw_header
+                texts.append(f"{name.decode('latin-1')}: {value.decode('latin-1')}")
+                uncached.append(raw_header)
+        if self.pattern_matcher.match(texts) is not None:
             return True
-        
-        # Check query parameters
-        for param, value in request.query_params.items():
-            if self._contains_suspicious_patterns(f"{param}={value}"):
-                return True
-        
-        # Check headers
-        for header, value in request.headers.items():
-            if self._contains_suspicious_patterns(f"{header}: {value}"):
-                return True
-        
-        # For POST/PUT requests, check body (if available)
-        if request.method in ['POST', 'PUT', 'PATCH']:
-            try:
-                # Only check if content-type suggests text data
-                content_type = request.headers.get('content-type', '')
-                if any(ct in content_type.lower() for ct in ['json', 'form', 'text']):
-                    # Note: This is a simplified check. In production, you'd want
-                    # to be more careful about reading the body
-                    pass
-            except Exception:
-                # If we can't read the body, assume it's safe
-                pass
-        
+        decision_cache.add_clean(uncached)
+
+        # Bodies are inspected as they stream through, see _call_app
         return False
-    
+
     def _contains_suspicious_patterns(self, text: str) -> bool:
         """Check if text contains suspicious patterns."""
-        text_lower = text.lower()
-        
-        for pattern in self.suspicious_patterns:
-            if re.search(pattern, text_lower):
-                return True
-        
-        return False
-    
+        return self.pattern_matcher.match_text(text.lower()) is not None
+
     def get_security_stats(self) -> dict:
         """Get security statistics."""
-        current_time = time.time()
-        minute_ago = current_time - 60
-        
-        # Count recent requests per IP
-        recent_requests = {}
-        for ip, timestamps in self.rate_limits.items():
-            recent_count = len([t for t in timestamps if t > minute_ago])
-            if recent_count > 0:
-                recent_requests[ip] = recent_count
-        
         return {
-            "blocked_ips_count": len(self.blocked_ips),
-            "recent_requests_by_ip": recent_requests,
+            "blocked_ips_count": len(self.blocklist),
+            "blocklist": self.blocklist.get_stats(),
+            "abuse_scores": self.abuse_scorer.get_stats(),
             "rate_limit_threshold": self.max_requests_per_minute,
-            "security_headers": list(self.security_headers.keys())
+            "rate_limiter": (
+                self.quota_engine or self.shared_rate_limiter or self.rate_limiter
+            ).get_stats(),
+            "header_decision_cache": self.decision_cache.get_stats(),
+            "max_body_bytes": self.max_body_bytes,
+            "rejected_bodies": dict(self.rejected_bodies),
+            "security_headers": list(self.security_headers.keys()),
         }
-    
-    def block_ip(self, ip: str, reason: str = "Manual block"):
-        """Manually block an IP address."""
-        self.blocked_ips.add(ip)
+
+    def block_ip(
+        self, ip: str, reason: str = "Manual block", ttl: Optional[float] = None
+    ):
+        """Block an IP address or CIDR range, for ``ttl`` seconds or until unblocked."""
+        self.blocklist.add(ip, ttl)
         logger.warning(
             f"IP {ip} has been blocked: {reason}",
-            extra={"custom_dimensions": {"ip": ip, "reason": reason}}
+            extra={
+                "custom_dimensions": {"ip": ip, "reason": reason, "ttl_seconds": ttl}
+            },
         )
-    
+
     def unblock_ip(self, ip: str):
-        """Unblock an IP address."""
-        if ip in self.blocked_ips:
-            self.blocked_ips.remove(ip)
+        """Unblock an IP address or CIDR range."""
+        if self.blocklist.remove(ip):
             logger.info(
-                f"IP {ip} has been unblocked",
-                extra={"custom_dimensions": {"ip": ip}}
+                f"IP {ip} has been unblocked", extra={"custom_dimensions": {"ip": ip}}
             )
+
+
+def get_security_summary(app) -> dict:
+    """Security statistics of the app's SecurityMiddleware, once it served a request."""
+    security = getattr(app.state, "security", None)
+    if security is None:
+        return {}
+    return security.get_security_stats()
@@ -0,0 +1,348 @@
+"""
+Suspicious request pattern matching for the security middleware.
+
+Every pattern is paired with the literal keywords that any of its matches
+must contain. A single compiled alternation of all keywords, factored into a
+trie, is the prefilter: the inputs of a request are joined with ``\\x00`` (which no
+pattern can match across), lowercased once and scanned once. The full
+regexes run only for patterns whose keywords were found, at most once each.
+Benign traffic, which rarely contains any keyword, costs one scan.
+"""
+
+import re
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+RawHeader = Tuple[bytes, bytes]
+
+# (name, regex, literals every match contains); applied to lowercased text
+DEFAULT_SUSPICIOUS_PATTERNS: Tuple[Tuple[str, str, Tuple[str, ...]], ...] = (
+    (
+        "sql_keyword",
+        r"(?i)(union|select|insert|update|delete|drop|create|alter)\s+",
+        ("union", "select", "insert", "update", "delete", "drop", "create", "alter"),
+    ),
+    (
+        "script_keyword",
+        r"(?i)(script|javascript|vbscript|onload|onerror)",
+        ("script", "onload", "onerror"),
+    ),
+    (
+        "html_tag",
+        r"(?i)(<|%3c)(script|iframe|object|embed)",
+        ("script", "iframe", "object", "embed"),
+    ),
+    (
+        "path_traversal",
+        r"(?i)(\.\.\/|\.\.\\|%2e%2e%2f|%2e%2e%5c)",
+        ("../", "..\\", "%2e%2e%2f", "%2e%2e%5c"),
+    ),
+    (
+        "sensitive_file",
+        r"(?i)(etc\/passwd|boot\.ini|windows\/system32)",
+        ("etc/passwd", "boot.ini", "windows/system32"),
+    ),
+    (
+        "code_execution",
+        r"(?i)(eval\s*\(|exec\s*\(|system\s*\()",
+        ("eval", "exec", "system"),
+    ),
+)
+
+# Request bodies carry free text, where the bare keywords above are ordinary
+# words ("description", "create new", "please update"). Body patterns only
+# match injection syntax: statement shapes, markup and calls at token boundaries.
+DEFAULT_BODY_PATTERNS: Tuple[Tuple[str, str, Tuple[str, ...]], ...] = (
+    (
+        "sql_keyword",
+        r"\bunion\s+(?:all\s+)?select\b"
+        r"|\bdrop\s+(?:table|database|schema)\b"
+        r"|\btruncate\s+table\b"
+        r"|\b(?:alter|create)\s+(?:table|database)\b"
+        r"|\binsert\s+into\s+\S+\s*(?:\(|values\b)"
+        r"|\bdelete\s+from\s+\S+\s+where\b"
+        r"|\bupdate\s+\S+\s+set\s+\S+\s*="
+        r"|;\s*shutdown\b"
+        r"|'\s*(?:or|and)\s+'?\w+'?\s*=",
+        (
+            "union",
+            "drop",
+            "truncate",
+            "alter",
+            "create",
+            "insert",
+            "delete",
+            "update",
+            "shutdown",
+            "'",
+        ),
+    ),
+    (
+        "script_keyword",
+        r"(?:<|\\u003c|%3c)\s*/?\s*script\b"
+        r"|\b(?:java|vb)script\s*:"
+        r"|\bon(?:load|error|mouseover|focus)\s*=",
+        ("script", "onload", "onerror", "onmouseover", "onfocus"),
+    ),
+    (
+        "html_tag",
+        r"(?:<|\\u003c|%3c)\s*(?:iframe|object|embed)\b",
+        ("iframe", "object", "embed"),
+    ),
+    (
+        "path_traversal",
+        r"(?:\.\.(?:/|\\{1,2})){2,}|(?:%2e%2e(?:%2f|%5c)){2,}",
+        ("../", "..\\", "%2e%2e%2f", "%2e%2e%5c"),
+    ),
+    (
+        "sensitive_file",
+        r"\betc/passwd\b|\bboot\.ini\b|\bwindows[/\\]+system32\b",
+        ("etc/passwd", "boot.ini", "system32"),
+    ),
+    (
+        "code_execution",
+        r"\b(?:eval|exec|system|passthru|popen)\(",
+        ("eval(", "exec(", "system(", "passthru(", "popen("),
+    ),
+)
+
+# Separates joined inputs; no pattern matches it, so no match spans two inputs
+INPUT_SEPARATOR = "\x00"
+
+# Headers never scanned: protocol plumbing with no free text, plus authorization,
+# whose bearer tokens are verified by signature and whose base64 payloads can
+# spell keywords such as "script" by chance
+DEFAULT_UNSCANNED_HEADERS: FrozenSet[str] = frozenset(
+    {
+        "authorization",
+        "accept-encoding",
+        "cache-control",
+        "connection",
+        "content-length",
+        "dnt",
+        "pragma",
+        "sec-fetch-dest",
+        "sec-fetch-mode",
+        "sec-fetch-site",
+        "sec-fetch-user",
+        "upgrade-insecure-requests",
+    }
+)
+
+DEFAULT_DECISION_CACHE_SIZE = 10_000
+
+# Longer header values are scanned on every request rather than cached, which
+# bounds the cache at about max_entries * this many bytes
+DEFAULT_MAX_CACHED_HEADER_BYTES = 2048
+
+
+def literal_trie_regex(literals: Iterable[str]) -> str:
+    """
+    Regex matching any of ``literals``, factored into a trie.
+
+    ``select|script|system`` becomes ``s(?:cript|elect|ystem)``, so the regex
+    engine rejects most positions on the first character instead of trying
+    every alternative; at each position the longest literal wins.
+    """
+    trie: dict = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class SuspiciousPatternMatcher:
+    """
+    Keyword-prefiltered multi-pattern matcher.
+
+    Usage:
+        matcher = SuspiciousPatternMatcher()
+        matcher.match([url, "q=1", "user-agent: curl/8.0"])  # -> "sql_keyword" or None
+    """
+
+    def __init__(
+        self,
+        patterns: Sequence[
+            Tuple[str, str, Sequence[str]]
+        ] = DEFAULT_SUSPICIOUS_PATTERNS,
+    ):
+        self.names: List[str] = []
+        self.regexes: List[re.Pattern] = []
+        self._patterns_by_literal: Dict[str, List[int]] = {}
+        for index, (name, regex, literals) in enumerate(patterns):
+            self.names.append(name)
+            self.regexes.append(re.compile(regex))
+            for literal in literals:
+                self._patterns_by_literal.setdefault(literal.lower(), []).append(index)
+        # A hit on a literal also stands for every literal it contains
+        for literal in list(self._patterns_by_literal):
+            for other, indexes in self._patterns_by_literal.items():
+                if other != literal and other in literal:
+                    self._patterns_by_literal[literal] = sorted(
+                        set(self._patterns_by_literal[literal]) | set(indexes)
+                    )
+        literals_regex = literal_trie_regex(self._patterns_by_literal)
+        self._prefilter = re.compile(literals_regex)
+        # Zero-width lookahead reports overlapping literals too ("unionload" -> union,
+        # onload)
+        self._candidates = re.compile(f"(?=({literals_regex}))")
+
+    def match(self, texts: Iterable[str]) -> Optional[str]:
+        """Name of the first pattern matching any of ``texts``, or None."""
+        return self.match_text(INPUT_SEPARATOR.join(texts).lower())
+
+    def match_text(self, text: str) -> Optional[str]:
+        """Like ``match`` for a single, already lowercased string."""
+        prefilter_hit = self._prefilter.search(text)
+        if prefilter_hit is None:
+            return None
+
+        confirmed = set()
+        patterns_by_literal = self._patterns_by_literal
+        regexes = self.regexes
+        for hit in self._candidates.finditer(text, prefilter_hit.start()):
+            for index in patterns_by_literal[hit.group(1)]:
+                if index in confirmed:
+                    continue
+                confirmed.add(index)
+                if regexes[index].search(text):
+                    return self.names[index]
+            if len(confirmed) == len(regexes):
+                break
+        return None
+
+
+class ScanDecisionCache:
+    """
+    Bounded LRU of raw header pairs already scanned and found clean.
+
+    Keys are the ``(name, value)`` byte pairs exactly as they arrived in the
+    ASGI scope. A lookup compares the bytes themselves, not just their hash,
+    so a value that merely collides with a cached clean one is still scanned.
+    A hit costs one dict lookup, with no decoding or formatting. Values longer
+    than ``max_value_bytes`` are never cached. Only clean decisions are cached:
+    flagged requests are rare and are always scanned again in full.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_DECISION_CACHE_SIZE,
+        max_value_bytes: int = DEFAULT_MAX_CACHED_HEADER_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_value_bytes = max_value_bytes
+        self._clean: "OrderedDict[RawHeader, None]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+
+    def is_clean(self, key: RawHeader) -> bool:
+        if key in self._clean:
+            self._clean.move_to_end(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add_clean(self, keys: Iterable[RawHeader]):
+        clean = self._clean
+        max_value_bytes = self.max_value_bytes
+        for key in keys:
+            if len(key[1]) <= max_value_bytes:
+                clean[key] = None
+        while len(clean) > self.max_entries:
+            clean.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._clean.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._clean),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "skipped_headers": self.skipped,
+            "evictions": self.evictions,
+        }
+
+
+DEFAULT_MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Bytes of the previous chunk re-scanned with the next one, so matches that
+# straddle a chunk boundary are found
+DEFAULT_BODY_OVERLAP_BYTES = 1024
+
+# Content types whose bodies are inspected for suspicious patterns
+INSPECTED_CONTENT_TYPES = ("json", "form", "text")
+
+# StreamingBodyInspector.feed result when the byte cap is crossed
+BODY_TOO_LARGE = "body_too_large"
+
+
+class StreamingBodyInspector:
+    """
+    Inspects a request body chunk by chunk as the application reads it.
+
+    Only the last ``overlap`` bytes of the previous chunk are kept. Bytes are
+    decoded as latin-1, one character per byte, so a multi-byte UTF-8
+    sequence split across chunks cannot break decoding, and the ASCII
+    keywords match either way.
+
+    Use a matcher built from ``DEFAULT_BODY_PATTERNS``: the URL and header
+    patterns flag ordinary words in free text.
+
+    Usage:
+        inspector = StreamingBodyInspector(
+            SuspiciousPatternMatcher(DEFAULT_BODY_PATTERNS), max_bytes=10 * 1024 * 1024
+        )
+        # BODY_TOO_LARGE, a pattern name or None
+        violation = inspector.feed(message["body"])
+    """
+
+    __slots__ = ("matcher", "max_bytes", "overlap", "scan", "received", "_tail")
+
+    def __init__(
+        self,
+        matcher: Optional[SuspiciousPatternMatcher],
+        max_bytes: int = DEFAULT_MAX_BODY_BYTES,
+        overlap: int = DEFAULT_BODY_OVERLAP_BYTES,
+    ):
+        self.matcher = matcher
+        self.max_bytes = max_bytes
+        self.overlap = overlap
+        # Byte counting applies to every body; pattern scanning only when a matcher
+        # is given
+        self.scan = matcher is not None
+        self.received = 0
+        self._tail = ""
+
+    def feed(self, chunk: bytes) -> Optional[str]:
+        if not chunk:
+            return None
+        self.received += len(chunk)
+        if self.received > self.max_bytes:
+            return BODY_TOO_LARGE
+        if not self.scan:
+            return None
+        text = self._tail + chunk.decode("latin-1").lower()
+        self._tail = text[-self.overlap :]
+        return self.matcher.match_text(text)
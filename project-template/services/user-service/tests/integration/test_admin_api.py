@@ -0,0 +1,79 @@
+# Integration tests for admin diagnostics endpoints
+
+import pytest
+from httpx import AsyncClient
+
+from app.main import app
+from app.middleware.quotas import QuotaEngine
+from shared.monitoring.allocations import allocation_profiler
+from shared.monitoring.decorators import get_instrumentation_level, set_instrumentation_level
+
+ADMIN_ROUTES = [
+    ("GET", "/api/v1/admin/profile?seconds=0.05", None, 200),
+    ("GET", "/api/v1/admin/slow-calls", None, 200),
+    ("PUT", "/api/v1/admin/slow-calls/thresholds/user_service.get_user", {"threshold_ms": 250}, 200),
+    ("DELETE", "/api/v1/admin/slow-calls", None, 204),
+    ("GET", "/api/v1/admin/allocations", None, 200),
+    ("PUT", "/api/v1/admin/allocations/sample-rate", {"sample_rate": 0}, 200),
+    ("POST", "/api/v1/admin/allocations/user_service.get_user/capture", None, 202),
+    ("GET", "/api/v1/admin/allocations/user_service.unknown/diff", None, 404),
+    ("PUT", "/api/v1/admin/instrumentation", {"level": "sampled"}, 200),
+    ("GET", "/api/v1/admin/rate-limits", None, 200),
+    ("PUT", "/api/v1/admin/rate-limits", {"limits": {"default": {"ip": [100, 60]}}}, 200),
+]
+
+
+@pytest.fixture
+def quota_engine(monkeypatch):
+    """Enable identity quotas for the rate limit endpoints."""
+    engine = QuotaEngine({"limits": {"default": {"ip": [100, 60]}}})
+    monkeypatch.setattr(app.state, "quotas", engine, raising=False)
+    return engine
+
+
+@pytest.fixture(autouse=True)
+def restore_diagnostics():
+    level = get_instrumentation_level()
+    yield
+    set_instrumentation_level(level)
+    allocation_profiler.disable()
+
+
+class TestAdminAPI:
+    """Integration tests for admin diagnostics endpoints."""
+
+    @pytest.mark.integration
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("method,path,body,_status", ADMIN_ROUTES)
+    async def test_admin_routes_forbidden_without_permission(
+        self, client: AsyncClient, auth_headers, quota_engine, method, path, body, _status
+    ):
+        """Test that a regular user gets 403 from every admin route."""
+        # Act
+        response = await client.request(method, path, json=body, headers=auth_headers)
+
+        # Assert
+        assert response.status_code == 403
+
+    @pytest.mark.integration
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("method,path,body,status", ADMIN_ROUTES)
+    async def test_admin_routes_allowed_with_permission(
+        self, client: AsyncClient, admin_auth_headers, quota_engine, method, path, body, status
+    ):
+        """Test that an admin reaches every admin route."""
+        # Act
+        response = await client.request(method, path, json=body, headers=admin_auth_headers)
+
+        # Assert
+        assert response.status_code == status
+
+    @pytest.mark.integration
+    @pytest.mark.asyncio
+    async def test_admin_routes_require_authentication(self, client: AsyncClient):
+        """Test that anonymous callers cannot reach admin routes."""
+        # Act
+        response = await client.get("/api/v1/admin/slow-calls")
+
+        # Assert
+        assert response.status_code in (401, 403)
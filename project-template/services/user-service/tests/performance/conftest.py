@@ -0,0 +1,73 @@
+# Shared fixtures for performance benchmarks
+
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pytest
+
+
+def make_http_scope(
+    path: str,
+    method: str = "GET",
+    headers: Optional[List[Tuple[bytes, bytes]]] = None,
+    client: Tuple[str, int] = ("127.0.0.1", 50000)
+) -> Dict:
+    """Build a minimal ASGI HTTP scope."""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers if headers is not None else [
+            (b"host", b"test"),
+            (b"user-agent", b"ComplianceFlow-Benchmark/1.0"),
+            (b"accept", b"application/json"),
+        ],
+        "client": client,
+        "server": ("test", 80),
+    }
+
+
+@pytest.fixture
+def call_asgi() -> Callable[..., Awaitable[Dict]]:
+    """Call an ASGI app directly, without an HTTP client in the measurement."""
+    async def _call(asgi_app, path: str, method: str = "GET", body: bytes = b"", **scope_kwargs) -> Dict:
+        scope = make_http_scope(path, method, **scope_kwargs)
+        response = {"status": None, "headers": [], "body": b""}
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+
+        await asgi_app(scope, receive, send)
+        return response
+
+    return _call
+
+
+@pytest.fixture
+def measure_async() -> Callable[..., Awaitable[float]]:
+    """Return the mean seconds per call of an async callable."""
+    async def _measure(func: Callable[[int], Awaitable], iterations: int, warmup: int = 200) -> float:
+        for index in range(warmup):
+            await func(index)
+        start = time.perf_counter()
+        for index in range(iterations):
+            await func(index)
+        return (time.perf_counter() - start) / iterations
+
+    return _measure
@@ -0,0 +1,103 @@
+# Performance benchmarks for the metrics middleware
+
+import time
+import tracemalloc
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware.metrics import MetricsMiddleware
+
+
+class LegacyMetricsMiddleware(BaseHTTPMiddleware):
+    """The previous BaseHTTPMiddleware implementation, keyed on raw paths."""
+
+    async def dispatch(self, request, call_next):
+        metrics = request.app.state.metrics
+        start_time = time.time()
+        metrics['request_count'] += 1
+        endpoint = f"{request.method} {request.url.path}"
+
+        response = await call_next(request)
+
+        duration = time.time() - start_time
+        endpoint_metrics = metrics['endpoints'].setdefault(
+            endpoint, {'count': 0, 'total_duration': 0.0, 'avg_duration': 0.0}
+        )
+        endpoint_metrics['count'] += 1
+        endpoint_metrics['total_duration'] += duration
+        endpoint_metrics['avg_duration'] = endpoint_metrics['total_duration'] / endpoint_metrics['count']
+        response.headers["X-Request-Duration"] = str(round(duration * 1000, 2))
+        return response
+
+
+def create_benchmark_app(middleware_class) -> FastAPI:
+    """Create an app with a parametrised route behind the given middleware."""
+    bench_app = FastAPI()
+    if middleware_class is LegacyMetricsMiddleware:
+        # MetricsMiddleware creates its own store on the first request
+        bench_app.state.metrics = {
+            'request_count': 0,
+            'request_duration_total': 0.0,
+            'status_codes': {},
+            'endpoints': {},
+            'errors': 0
+        }
+    bench_app.add_middleware(middleware_class)
+
+    @bench_app.get("/api/v1/users/{user_id}")
+    async def get_user(user_id: str):
+        return {"id": user_id}
+
+    return bench_app
+
+
+class TestMetricsMiddlewarePerformance:
+    """Benchmarks comparing the ASGI metrics middleware to the BaseHTTPMiddleware version."""
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_request_overhead_performance(self, call_asgi, measure_async):
+        """Test per-request latency of the ASGI middleware against the legacy middleware."""
+        # Arrange
+        legacy_app = create_benchmark_app(LegacyMetricsMiddleware)
+        asgi_app = create_benchmark_app(MetricsMiddleware)
+
+        # Act
+        legacy_seconds = await measure_async(lambda i: call_asgi(legacy_app, "/api/v1/users/1"), 3000)
+        asgi_seconds = await measure_async(lambda i: call_asgi(asgi_app, "/api/v1/users/1"), 3000)
+
+        # Assert
+        print(
+            f"\nlegacy: {legacy_seconds * 1e6:.1f}us/request, "
+            f"asgi: {asgi_seconds * 1e6:.1f}us/request"
+        )
+        assert asgi_seconds < legacy_seconds
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_memory_with_unique_paths_performance(self, call_asgi):
+        """Test that memory stays flat when every request hits a distinct user id."""
+        # Arrange
+        legacy_app = create_benchmark_app(LegacyMetricsMiddleware)
+        asgi_app = create_benchmark_app(MetricsMiddleware)
+        paths = [f"/api/v1/users/{uuid.uuid4()}" for _ in range(2000)]
+
+        # Act
+        growth = {}
+        for name, bench_app in (("legacy", legacy_app), ("asgi", asgi_app)):
+            tracemalloc.start()
+            baseline, _ = tracemalloc.get_traced_memory()
+            for path in paths:
+                await call_asgi(bench_app, path)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            growth[name] = current - baseline
+
+        # Assert
+        print(f"\nmemory growth: legacy {growth['legacy']} bytes, asgi {growth['asgi']} bytes")
+        assert len(legacy_app.state.metrics['endpoints']) == len(paths)
+        assert len(asgi_app.state.metrics['endpoints']) == 1
+        assert growth['asgi'] < growth['legacy'] / 10
@@ -0,0 +1,111 @@
+# Performance benchmarks for the fused request pipeline
+
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.pipeline import RequestPipeline
+from app.middleware.security import SecurityMiddleware
+
+
+class LegacyRequestIDMiddleware(BaseHTTPMiddleware):
+    """The previous BaseHTTPMiddleware request id layer."""
+
+    async def dispatch(self, request, call_next):
+        request_id = request.headers.get("x-request-id") or str(uuid.uuid4())
+        request.state.request_id = request_id
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+
+
+class LegacyErrorHandlerMiddleware(BaseHTTPMiddleware):
+    """The previous BaseHTTPMiddleware error mapping layer."""
+
+    async def dispatch(self, request, call_next):
+        try:
+            return await call_next(request)
+        except Exception:
+            return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+def create_benchmark_app(stack: str) -> FastAPI:
+    """Create an app behind the layered stack, the fused pipeline or no middleware."""
+    bench_app = FastAPI()
+    # Generous limits so the benchmark client is never throttled
+    security_kwargs = {"max_requests_per_minute": 10_000_000}
+    if stack == "layered":
+        bench_app.add_middleware(SecurityMiddleware, **security_kwargs)
+        bench_app.add_middleware(MetricsMiddleware)
+        bench_app.add_middleware(LegacyRequestIDMiddleware)
+        bench_app.add_middleware(LegacyErrorHandlerMiddleware)
+    elif stack == "fused":
+        bench_app.add_middleware(
+            RequestPipeline,
+            security=SecurityMiddleware(None, **security_kwargs),
+            metrics=MetricsMiddleware(None)
+        )
+
+    @bench_app.get("/api/v1/users/{user_id}")
+    async def get_user(user_id: str):
+        return {"id": user_id}
+
+    @bench_app.get("/health/live")
+    async def liveness():
+        return {"status": "alive"}
+
+    return bench_app
+
+
+class TestRequestPipelinePerformance:
+    """Benchmarks comparing the fused pipeline to the layered middleware stack."""
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_stack_overhead_performance(self, call_asgi, measure_async):
+        """Test per-request middleware overhead of the fused pipeline against the layered stack."""
+        # Arrange
+        apps = {stack: create_benchmark_app(stack) for stack in ("bare", "layered", "fused")}
+
+        # Act
+        seconds = {
+            stack: await measure_async(lambda i, app=app: call_asgi(app, "/api/v1/users/1"), 2000)
+            for stack, app in apps.items()
+        }
+        layered_overhead = seconds["layered"] - seconds["bare"]
+        fused_overhead = seconds["fused"] - seconds["bare"]
+
+        # Assert
+        print(
+            f"\nbare app: {seconds['bare'] * 1e6:.1f}us/request, "
+            f"layered overhead: {layered_overhead * 1e6:.1f}us, "
+            f"fused overhead: {fused_overhead * 1e6:.1f}us"
+        )
+        assert fused_overhead < layered_overhead / 2
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_liveness_fast_path_performance(self, call_asgi, measure_async):
+        """Test that liveness probes through the fast path cost about as much as the bare app."""
+        # Arrange
+        bare_app = create_benchmark_app("bare")
+        layered_app = create_benchmark_app("layered")
+        fused_app = create_benchmark_app("fused")
+
+        # Act
+        bare_seconds = await measure_async(lambda i: call_asgi(bare_app, "/health/live"), 2000)
+        layered_seconds = await measure_async(lambda i: call_asgi(layered_app, "/health/live"), 2000)
+        fused_seconds = await measure_async(lambda i: call_asgi(fused_app, "/health/live"), 2000)
+
+        # Assert
+        print(
+            f"\n/health/live bare: {bare_seconds * 1e6:.1f}us, "
+            f"layered: {layered_seconds * 1e6:.1f}us, "
+            f"fast path: {fused_seconds * 1e6:.1f}us"
+        )
+        assert fused_seconds < layered_seconds
+        assert fused_seconds - bare_seconds < (layered_seconds - bare_seconds) / 4
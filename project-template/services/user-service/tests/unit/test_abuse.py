@@ -0,0 +1,158 @@
+# Unit tests for adaptive abuse scoring
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from httpx import AsyncClient
+
+from app.middleware.abuse import AbuseScorer
+from app.middleware.security import SecurityMiddleware, get_security_summary
+
+BROWSER = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+
+
+class TestAbuseScorer:
+    """Test cases for AbuseScorer."""
+
+    @pytest.mark.unit
+    def test_score_halves_every_half_life(self):
+        """Test that a score decays exponentially between signals."""
+        # Arrange
+        scorer = AbuseScorer(half_life=60)
+        scorer.record("10.0.0.1", "suspicious_pattern", now=0)
+
+        # Act
+        scores = [scorer.score("10.0.0.1", now=now) for now in (0, 60, 120)]
+
+        # Assert
+        assert scores == pytest.approx([10.0, 5.0, 2.5])
+
+    @pytest.mark.unit
+    def test_ban_tiers_escalate(self):
+        """Test that a client that keeps misbehaving reaches longer bans."""
+        # Arrange
+        scorer = AbuseScorer(half_life=300, ban_tiers=((20, 60), (50, 900)))
+
+        # Act
+        bans = [scorer.record("10.0.0.1", "suspicious_pattern", now=0) for _ in range(5)]
+
+        # Assert
+        assert bans == [0.0, 60.0, 60.0, 60.0, 900.0]
+        assert scorer.get_stats()["bans_by_tier_seconds"] == {"60": 3, "900": 1}
+
+    @pytest.mark.unit
+    def test_single_signal_decays_without_ban(self):
+        """Test that one scanner hit from a shared address bans briefly and is forgotten later."""
+        # Arrange
+        scorer = AbuseScorer(half_life=300)
+
+        # Act
+        first = scorer.record("198.51.100.1", "malicious_user_agent", now=0)
+        later = scorer.record("198.51.100.1", "client_error", now=3600)
+
+        # Assert
+        assert first == 60.0
+        assert later == 0.0
+        assert scorer.score("198.51.100.1", now=3600) < 2
+
+    @pytest.mark.unit
+    def test_memory_bounded(self):
+        """Test that tracked keys never exceed max_keys and decayed keys are dropped first."""
+        # Arrange
+        scorer = AbuseScorer(half_life=1, max_keys=1000)
+
+        # Act
+        for index in range(5000):
+            scorer.record(f"10.0.{index >> 8}.{index & 255}", "client_error", now=index * 0.001)
+        bounded = len(scorer)
+        for index in range(100):
+            scorer.record(f"10.1.0.{index}", "client_error", now=1000 + index)
+
+        # Assert
+        assert bounded == 1000
+        assert len(scorer) < 1000
+        assert scorer.get_stats()["expired_keys"] > 0
+
+    @pytest.mark.unit
+    def test_unknown_signal_ignored(self):
+        """Test that signals without a weight leave no state."""
+        # Arrange
+        scorer = AbuseScorer(weights={"client_error": 1.0})
+
+        # Act
+        ban = scorer.record("10.0.0.1", "suspicious_pattern")
+
+        # Assert
+        assert ban == 0.0
+        assert len(scorer) == 0
+
+
+class TestSecurityMiddlewareAbuseScoring:
+    """Test cases for abuse scoring in SecurityMiddleware."""
+
+    @staticmethod
+    def create_test_app(**middleware_kwargs) -> FastAPI:
+        test_app = FastAPI()
+        test_app.add_middleware(SecurityMiddleware, **middleware_kwargs)
+
+        @test_app.get("/ping")
+        async def ping():
+            return {"ok": True}
+
+        @test_app.get("/secret")
+        async def secret():
+            raise HTTPException(status_code=401, detail="Not authenticated")
+
+        return test_app
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_single_pattern_hit_does_not_ban(self):
+        """Test that one suspicious request is refused but the client may continue."""
+        # Arrange
+        test_app = self.create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            attack = await client.get("/ping?q=1 union select 1", headers=BROWSER)
+            follow_up = await client.get("/ping", headers=BROWSER)
+
+        # Assert
+        assert attack.status_code == 400
+        assert follow_up.status_code == 200
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_repeated_pattern_hits_ban_temporarily(self):
+        """Test that repeated attacks reach a ban tier and the ban blocks clean requests too."""
+        # Arrange
+        test_app = self.create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            # Two hits come to just under the first tier once decay is applied; the third crosses it
+            for _ in range(3):
+                await client.get("/ping?q=1 union select 1", headers=BROWSER)
+            banned = await client.get("/ping", headers=BROWSER)
+        stats = get_security_summary(test_app)
+
+        # Assert
+        assert banned.status_code == 403
+        assert stats["abuse_scores"]["bans_by_tier_seconds"]["60"] == 1
+        assert stats["blocklist"]["exact_entries"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_client_error_burst_bans(self):
+        """Test that a burst of 4xx responses from the application bans the client."""
+        # Arrange
+        test_app = self.create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            responses = [await client.get("/secret", headers=BROWSER) for _ in range(22)]
+        status_codes = [response.status_code for response in responses]
+
+        # Assert
+        assert status_codes[:20] == [401] * 20
+        assert status_codes[-1] == 403
+        assert get_security_summary(test_app)["abuse_scores"]["signals"]["client_error"] == status_codes.count(401)
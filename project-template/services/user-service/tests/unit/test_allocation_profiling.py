@@ -0,0 +1,145 @@
+# Unit tests for sampled allocation profiling
+
+import tracemalloc
+
+import pytest
+
+from shared.monitoring.allocations import AllocationProfiler, allocation_profiler
+from shared.monitoring.decorators import trace_function, trace_method
+
+
+@pytest.fixture
+def profiling():
+    allocation_profiler.reset()
+    allocation_profiler.enable(sample_rate=1.0)
+    yield allocation_profiler
+    allocation_profiler.disable()
+    allocation_profiler.reset()
+
+
+retained = []
+
+
+@trace_function("test_service.build_cache", track_allocations=True)
+def build_cache(entries: int):
+    retained.append([str(i) * 10 for i in range(entries)])
+
+
+class Importer:
+    service_name = "test_service"
+
+    @trace_method("test_service.import_rows", track_allocations=True)
+    async def import_rows(self, rows: int):
+        retained.append(bytearray(rows * 1024))
+
+
+class TestAllocationProfiler:
+    """Test cases for allocation profiling through the monitoring decorators."""
+
+    @pytest.mark.unit
+    def test_records_net_bytes_and_top_sites(self, profiling):
+        """Test that a captured call records its retained bytes and the allocating line."""
+        # Arrange
+        profiling.request_capture("test_service.build_cache")
+
+        # Act
+        build_cache(20000)
+        summary = profiling.get_summary()
+
+        # Assert
+        stats = summary["operations"]["test_service.build_cache"]
+        assert stats["samples"] == 1
+        assert stats["net_bytes_max"] > 500_000
+        assert "test_allocation_profiling.py" in stats["top_sites"][0]["site"]
+        retained.clear()
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_trace_method_and_snapshot_diff(self, profiling):
+        """Test that trace_method supports allocation tracking and exposes a downloadable diff."""
+        # Arrange
+        profiling.request_capture("test_service.import_rows")
+
+        # Act
+        await Importer().import_rows(512)
+        diff = profiling.get_snapshot_diff("test_service.import_rows")
+
+        # Assert
+        assert diff.startswith("# test_service.import_rows allocation diff at ")
+        assert "test_allocation_profiling.py" in diff
+        assert profiling.get_snapshot_diff("test_service.unknown") is None
+        retained.clear()
+
+    @pytest.mark.unit
+    def test_sampling_rate_and_disabled_mode(self):
+        """Test that unsampled and disabled calls return no baseline."""
+        # Arrange
+        profiler = AllocationProfiler(sample_rate=0.0)
+
+        # Act / Assert
+        assert profiler.begin("test_service.op") is None
+        profiler.enable(sample_rate=1e-12)
+        try:
+            assert all(profiler.begin("test_service.op") is None for _ in range(1000))
+        finally:
+            profiler.disable()
+        assert profiler.enabled is False
+
+    @pytest.mark.unit
+    def test_untracked_operations_not_profiled(self, profiling):
+        """Test that functions without track_allocations are never sampled."""
+        # Arrange
+        @trace_function("test_service.untracked")
+        def untracked():
+            return [0] * 1000
+
+        # Act
+        untracked()
+
+        # Assert
+        assert "test_service.untracked" not in profiling.get_summary()["operations"]
+
+    @pytest.mark.unit
+    def test_sampled_calls_take_no_snapshots(self, profiling, monkeypatch):
+        """Test that sampled calls only read traced memory counters and snapshots wait for a capture."""
+        # Arrange
+        snapshots = []
+        take_snapshot = tracemalloc.take_snapshot
+        monkeypatch.setattr(tracemalloc, "take_snapshot", lambda: snapshots.append(1) or take_snapshot())
+
+        # Act
+        for _ in range(5):
+            build_cache(100)
+        sampled_snapshots = len(snapshots)
+        profiling.request_capture("test_service.build_cache")
+        build_cache(100)
+        build_cache(100)
+
+        # Assert
+        stats = profiling.get_summary()["operations"]["test_service.build_cache"]
+        assert stats["samples"] == 7
+        assert sampled_snapshots == 0
+        assert len(snapshots) == 2
+        assert profiling.get_summary()["pending_captures"] == []
+        assert profiling.get_snapshot_diff("test_service.build_cache") is not None
+        retained.clear()
+
+    @pytest.mark.unit
+    def test_tracing_runs_only_during_sampled_calls(self, profiling):
+        """Test that tracemalloc is off between sampled calls and is not started by a capture request."""
+        # Arrange
+        assert not tracemalloc.is_tracing()
+        profiling.request_capture("test_service.build_cache")
+        assert not tracemalloc.is_tracing()
+
+        # Act
+        sample = profiling.begin("test_service.build_cache")
+        tracing_during_call = tracemalloc.is_tracing()
+        profiling.end(sample)
+        build_cache(100)
+
+        # Assert
+        assert tracing_during_call
+        assert not tracemalloc.is_tracing()
+        assert profiling.get_summary()["operations"]["test_service.build_cache"]["samples"] == 2
+        retained.clear()
@@ -0,0 +1,254 @@
+# Unit tests for the CIDR-aware expiring IP blocklist
+
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.middleware.abuse import AbuseScorer
+from app.middleware.blocklist import IpBlocklist, parse_network
+from app.middleware.security import SecurityMiddleware, get_security_summary
+
+
+class TestIpBlocklist:
+    """Test cases for IpBlocklist."""
+
+    @pytest.mark.unit
+    def test_exact_and_cidr_matches(self):
+        """Test that addresses match their exact entries and any enclosing prefix."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.add("198.51.100.7")
+        blocklist.add("203.0.113.0/24")
+        blocklist.add("2001:db8::/32")
+
+        # Act / Assert
+        assert blocklist.is_blocked("198.51.100.7") is True
+        assert blocklist.is_blocked("198.51.100.8") is False
+        assert blocklist.is_blocked("203.0.113.0") is True
+        assert blocklist.is_blocked("203.0.113.255") is True
+        assert blocklist.is_blocked("203.0.114.0") is False
+        assert blocklist.is_blocked("2001:db8:0:0:0:0:0:1") is True
+        assert blocklist.is_blocked("2001:db9::1") is False
+
+    @pytest.mark.unit
+    def test_nested_prefixes_resolve_through_parents(self):
+        """Test that an address after a nested range still matches the range enclosing both."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.add("10.0.0.0/8")
+        blocklist.add("10.1.0.0/16", ttl=10, now=0)
+        blocklist.add("10.1.2.0/24")
+
+        # Act / Assert
+        assert blocklist.is_blocked("10.1.3.1", now=100) is True
+        assert blocklist.is_blocked("10.200.0.1", now=100) is True
+        assert blocklist.is_blocked("11.0.0.1", now=100) is False
+
+    @pytest.mark.unit
+    def test_entries_expire_independently(self):
+        """Test that each entry stops matching at its own expiry and purging drops it."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.add("198.51.100.7", ttl=60, now=0)
+        blocklist.add("203.0.113.0/24", ttl=600, now=0)
+        blocklist.add("192.0.2.0/24", ttl=60, now=0)
+        blocklist.add("192.0.2.0/25", now=0)
+
+        # Act
+        at_30 = [blocklist.is_blocked(ip, now=30) for ip in ("198.51.100.7", "203.0.113.9", "192.0.2.200")]
+        at_120 = [blocklist.is_blocked(ip, now=120) for ip in ("198.51.100.7", "203.0.113.9", "192.0.2.200")]
+        nested_permanent = blocklist.is_blocked("192.0.2.1", now=120)
+        purged = blocklist.purge_expired(now=120)
+
+        # Assert
+        assert at_30 == [True, True, True]
+        assert at_120 == [False, True, False]
+        assert nested_permanent is True
+        assert purged == 2
+        assert len(blocklist) == 2
+
+    @pytest.mark.unit
+    def test_remove_and_readd(self):
+        """Test that removed entries stop matching and a later add never shortens a block."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.add("203.0.113.0/24")
+        blocklist.add("198.51.100.7")
+        blocklist.add("198.51.100.7", ttl=1, now=0)
+
+        # Act
+        removed = blocklist.remove("203.0.113.0/24")
+        removed_again = blocklist.remove("203.0.113.0/24")
+
+        # Assert
+        assert removed is True
+        assert removed_again is False
+        assert blocklist.is_blocked("203.0.113.5") is False
+        assert blocklist.is_blocked("198.51.100.7", now=100) is True
+
+    @pytest.mark.unit
+    def test_load_feed_skips_comments_and_invalid_lines(self):
+        """Test that a threat feed is parsed line by line, tolerating comments and junk."""
+        # Arrange
+        feed = [
+            "# Example threat feed\n",
+            "203.0.113.0/24 ; SBL123\n",
+            "198.51.100.7\n",
+            "\n",
+            "2001:db8:dead::/48  # scanner\n",
+            "not-an-ip\n",
+            "10.0.0.0/33\n",
+        ]
+        blocklist = IpBlocklist()
+
+        # Act
+        loaded = blocklist.load_feed(feed)
+
+        # Assert
+        assert loaded == 3
+        assert blocklist.is_blocked("203.0.113.77") is True
+        assert blocklist.is_blocked("198.51.100.7") is True
+        assert blocklist.is_blocked("2001:db8:dead:1::1") is True
+        assert blocklist.get_stats()["ipv6_prefixes"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("rebuilt", [False, True])
+    def test_changes_apply_before_and_after_rebuild(self, rebuilt):
+        """Test that lookups never rebuild segments and give the same answers either way."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.load_feed(["10.0.0.0/8\n", "203.0.113.0/24\n"])
+        blocklist.add("10.1.0.0/16", ttl=10, now=0)
+        blocklist.add("198.51.100.0/24")
+        blocklist.remove("203.0.113.0/24")
+        if rebuilt:
+            blocklist.rebuild()
+
+        # Act
+        results = [
+            blocklist.is_blocked(ip, now=100)
+            for ip in ("10.1.3.1", "10.200.0.1", "198.51.100.9", "203.0.113.5", "11.0.0.1")
+        ]
+
+        # Assert
+        assert results == [True, True, True, False, False]
+        assert blocklist.get_stats()["rebuilds"] == (2 if rebuilt else 1)
+        assert blocklist.get_stats()["stale_families"] == (0 if rebuilt else 1)
+
+    @pytest.mark.unit
+    def test_background_rebuild(self):
+        """Test that the rebuild thread compiles prefixes added while running."""
+        # Arrange
+        blocklist = IpBlocklist(rebuild_interval=0.01)
+        blocklist.start()
+
+        # Act
+        blocklist.add("203.0.113.0/24")
+        for _ in range(100):
+            if blocklist.get_stats()["stale_families"] == 0:
+                break
+            time.sleep(0.01)
+        blocklist.stop()
+
+        # Assert
+        assert blocklist.get_stats()["stale_families"] == 0
+        assert blocklist.is_blocked("203.0.113.5") is True
+
+    @pytest.mark.unit
+    def test_ipv4_mapped_addresses_match_ipv4_entries(self):
+        """Test that ::ffff:a.b.c.d clients of a dual-stack listener match IPv4 entries."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.add("198.51.100.7")
+        blocklist.add("203.0.113.0/24")
+        blocklist.add("::ffff:192.0.2.0/120")
+
+        # Act / Assert
+        assert blocklist.is_blocked("::ffff:198.51.100.7") is True
+        assert blocklist.is_blocked("::ffff:cb00:7105") is True
+        assert blocklist.is_blocked("0:0:0:0:0:ffff:203.0.113.5") is True
+        assert blocklist.is_blocked("192.0.2.9") is True
+        assert blocklist.is_blocked("::ffff:198.51.100.8") is False
+        assert blocklist.is_blocked("2001:db8::cb00:7105") is False
+        assert blocklist.get_stats()["ipv6_prefixes"] == 0
+
+    @pytest.mark.unit
+    def test_unparseable_client_address_not_blocked(self):
+        """Test that values such as 'unknown' are answered without errors."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.add("0.0.0.0/0")
+
+        # Act / Assert
+        assert blocklist.is_blocked("unknown") is False
+        assert blocklist.is_blocked("1.2.3.4") is True
+
+    @pytest.mark.unit
+    def test_parse_network_clears_host_bits(self):
+        """Test that non-canonical prefixes are normalised and bad input raises ValueError."""
+        # Act / Assert
+        assert parse_network("203.0.113.77/24")[1:] == (0xCB007100, 24)
+        with pytest.raises(ValueError):
+            parse_network("203.0.113.0/abc")
+        with pytest.raises(ValueError):
+            parse_network("300.1.1.1")
+
+
+class TestSecurityMiddlewareBlocklist:
+    """Test cases for blocklist use in SecurityMiddleware."""
+
+    @staticmethod
+    def create_test_app(**middleware_kwargs) -> FastAPI:
+        test_app = FastAPI()
+        test_app.add_middleware(SecurityMiddleware, **middleware_kwargs)
+
+        @test_app.get("/ping")
+        async def ping():
+            return {"ok": True}
+
+        return test_app
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_preloaded_range_blocks_clients(self):
+        """Test that a range in the injected blocklist is refused with 403."""
+        # Arrange
+        blocklist = IpBlocklist()
+        blocklist.add("203.0.113.0/24")
+        test_app = self.create_test_app(blocklist=blocklist)
+        headers = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            blocked = await client.get("/ping", headers={**headers, "x-forwarded-for": "203.0.113.50"})
+            allowed = await client.get("/ping", headers={**headers, "x-forwarded-for": "198.51.100.1"})
+
+        # Assert
+        assert blocked.status_code == 403
+        assert allowed.status_code == 200
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_malicious_user_agent_block_is_temporary(self):
+        """Test that a scanner user agent blocks the client only for the configured time."""
+        # Arrange
+        blocklist = IpBlocklist()
+        test_app = self.create_test_app(blocklist=blocklist, abuse_scorer=AbuseScorer(ban_tiers=((20, 0.05),)))
+        client_ip = {"x-forwarded-for": "198.51.100.9"}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            scanner = await client.get("/ping", headers={**client_ip, "user-agent": "sqlmap/1.7"})
+            during = await client.get("/ping", headers={**client_ip, "user-agent": "Mozilla/5.0"})
+            blocked_count = get_security_summary(test_app)["blocked_ips_count"]
+            await asyncio.sleep(0.06)
+            after = await client.get("/ping", headers={**client_ip, "user-agent": "Mozilla/5.0"})
+
+        # Assert
+        assert scanner.status_code == 403
+        assert during.status_code == 403
+        assert blocked_count == 1
+        assert after.status_code == 200
@@ -0,0 +1,257 @@
+# Unit tests for streaming request body inspection in SecurityMiddleware
+
+import pytest
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+
+from app.middleware.security import SecurityMiddleware, get_security_summary
+from app.middleware.waf import (
+    BODY_TOO_LARGE,
+    DEFAULT_BODY_PATTERNS,
+    StreamingBodyInspector,
+    SuspiciousPatternMatcher,
+)
+
+HEADERS = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)", "content-type": "application/json"}
+
+# Everyday API payloads whose free text contains words the URL patterns flag
+BENIGN_BODIES = [
+    '{"description": "Annual compliance description for the board", "plan": "subscription"}',
+    '{"note": "please update my address to 5 Main St"}',
+    '{"title": "Create new declaration", "status": "draft"}',
+    '{"comment": "Select the files from the list and delete from cart"}',
+    '{"message": "I can\'t log in; the page won\'t load", "type": "support"}',
+    '{"bio": "Manager at Drop Box Inc, union representative"}',
+    '{"html": "<p>Hello <strong>world</strong></p>", "onboarding": true}',
+    '{"url": "https://example.com/a/../b", "path": "docs/guide.md"}',
+    '{"text": "Our operating system (Linux) is evaluated; exec (CEO) approved"}',
+    '{"notes": "Alter the table layout; drop shipping to Friday; update: done"}',
+    '{"name": "O\'Brien or Smith", "role": "viewer"}',
+    '{"transcript": "Scripted onboarding, see the object model and embedded docs"}',
+    '{"description": "Delete from the archive where possible and create a new table of contents"}',
+    'name=O%27Brien&role=viewer&note=please+update+my+address',
+]
+
+# Injection payloads that must still be flagged in a body
+MALICIOUS_BODIES = [
+    '{"q": "1 union select password from users"}',
+    '{"name": "<script>alert(1)</script>"}',
+    '{"name": "\\u003cscript\\u003ealert(1)"}',
+    '{"url": "javascript:alert(document.cookie)"}',
+    '{"img": "<img src=x onerror=alert(1)>"}',
+    '{"user": "admin\' or \'1\'=\'1"}',
+    '{"file": "../../etc/passwd"}',
+    '{"file": "..\\\\..\\\\boot.ini"}',
+    '{"cmd": "system(\'id\')"}',
+    '{"q": "1; DROP TABLE users"}',
+    '{"frame": "<iframe src=//evil>"}',
+    '{"q": "x\'; update users set role=\'admin\' --"}',
+    '{"q": "1; delete from users where 1=1"}',
+    '{"q": "insert into users (email) values (1)"}',
+]
+
+
+def create_test_app(received: list, **middleware_kwargs) -> FastAPI:
+    """Create an app whose /upload endpoint records the body it reads."""
+    test_app = FastAPI()
+    test_app.add_middleware(SecurityMiddleware, **middleware_kwargs)
+
+    @test_app.post("/upload")
+    async def upload(request: Request):
+        chunks = [chunk async for chunk in request.stream()]
+        received.append(b"".join(chunks))
+        return {"bytes": sum(len(chunk) for chunk in chunks)}
+
+    return test_app
+
+
+async def chunked(*chunks: bytes):
+    """Request content without a content-length, sent as the given chunks."""
+    for chunk in chunks:
+        yield chunk
+
+
+class TestStreamingBodyInspector:
+    """Test cases for StreamingBodyInspector."""
+
+    @pytest.mark.unit
+    def test_match_across_chunk_boundary(self):
+        """Test that a pattern split between two chunks is found through the overlap."""
+        # Arrange
+        inspector = StreamingBodyInspector(
+            SuspiciousPatternMatcher(DEFAULT_BODY_PATTERNS), max_bytes=1024, overlap=16
+        )
+
+        # Act
+        first = inspector.feed(b'{"name": "<scr')
+        second = inspector.feed(b'ipt>alert(1)"}')
+
+        # Assert
+        assert first is None
+        assert second == "script_keyword"
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("body", BENIGN_BODIES)
+    def test_benign_payload_not_flagged(self, body):
+        """Test that ordinary words in free text do not trip the body patterns."""
+        # Arrange
+        inspector = StreamingBodyInspector(SuspiciousPatternMatcher(DEFAULT_BODY_PATTERNS))
+
+        # Act / Assert
+        assert inspector.feed(body.encode()) is None
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("body", MALICIOUS_BODIES)
+    def test_injection_payload_flagged(self, body):
+        """Test that injection syntax in a body is still found."""
+        # Arrange
+        inspector = StreamingBodyInspector(SuspiciousPatternMatcher(DEFAULT_BODY_PATTERNS))
+
+        # Act / Assert
+        assert inspector.feed(body.encode()) is not None
+
+    @pytest.mark.unit
+    def test_only_overlap_is_kept(self):
+        """Test that the inspector keeps at most ``overlap`` characters between chunks."""
+        # Arrange
+        inspector = StreamingBodyInspector(SuspiciousPatternMatcher(), max_bytes=1 << 20, overlap=8)
+
+        # Act
+        for _ in range(100):
+            inspector.feed(b"a" * 1000)
+
+        # Assert
+        assert len(inspector._tail) == 8
+        assert inspector.received == 100_000
+
+    @pytest.mark.unit
+    def test_cap_counts_every_body(self):
+        """Test that bytes are counted even when pattern scanning is off."""
+        # Arrange
+        inspector = StreamingBodyInspector(None, max_bytes=10)
+
+        # Act
+        results = [inspector.feed(b"<script>") for _ in range(2)]
+
+        # Assert
+        assert results == [None, BODY_TOO_LARGE]
+
+
+class TestBodyInspectionMiddleware:
+    """Test cases for body inspection in SecurityMiddleware."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_benign_body_reaches_app_intact(self):
+        """Test that a clean chunked body is passed through unchanged."""
+        # Arrange
+        received = []
+        test_app = create_test_app(received)
+        chunks = [b'{"name": "Quarterly', b' report", "notes": "', "café".encode(), b'"}']
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.post("/upload", headers=HEADERS, content=chunked(*chunks))
+
+        # Assert
+        assert response.status_code == 200
+        assert received == [b"".join(chunks)]
+        assert response.headers["x-content-type-options"] == "nosniff"
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_chunked_upload_over_cap_rejected(self):
+        """Test that a body without content-length is refused with 413 once it crosses the cap."""
+        # Arrange
+        received = []
+        test_app = create_test_app(received, max_body_bytes=1000)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.post(
+                "/upload", headers=HEADERS, content=chunked(*[b"x" * 400] * 5)
+            )
+        stats = get_security_summary(test_app)
+
+        # Assert
+        assert response.status_code == 413
+        assert response.json() == {"error": "Request entity too large"}
+        assert received == []
+        assert stats["rejected_bodies"]["too_large"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_declared_length_over_cap_rejected_before_app(self):
+        """Test that a declared content-length over the cap is refused without reading the body."""
+        # Arrange
+        received = []
+        test_app = create_test_app(received, max_body_bytes=1000)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.post("/upload", headers=HEADERS, content=b"x" * 2000)
+
+        # Assert
+        assert response.status_code == 413
+        assert received == []
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_suspicious_body_split_across_chunks_rejected(self):
+        """Test that a JSON body with a pattern split between chunks is refused with 400."""
+        # Arrange
+        received = []
+        test_app = create_test_app(received)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.post(
+                "/upload", headers=HEADERS,
+                content=chunked(b'{"query": "1 uni', b'on select password from users"}')
+            )
+        stats = get_security_summary(test_app)
+
+        # Assert
+        assert response.status_code == 400
+        assert response.json() == {"error": "Bad request"}
+        assert received == []
+        assert stats["rejected_bodies"]["suspicious"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_benign_json_bodies_accepted_without_abuse_score(self):
+        """Test that realistic JSON payloads reach the app and add nothing to the client's abuse score."""
+        # Arrange
+        received = []
+        test_app = create_test_app(received)
+        bodies = [body for body in BENIGN_BODIES if body.startswith("{")]
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            responses = [
+                await client.post("/upload", headers=HEADERS, content=body.encode()) for body in bodies
+            ]
+        stats = get_security_summary(test_app)
+
+        # Assert
+        assert [response.status_code for response in responses] == [200] * len(bodies)
+        assert len(received) == len(bodies)
+        assert stats["rejected_bodies"]["suspicious"] == 0
+        assert stats["abuse_scores"]["signals"]["suspicious_pattern"] == 0
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_binary_body_not_scanned(self):
+        """Test that bodies of uninspected content types are only counted."""
+        # Arrange
+        received = []
+        test_app = create_test_app(received)
+        headers = {**HEADERS, "content-type": "application/octet-stream"}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.post("/upload", headers=headers, content=chunked(b"<script>"))
+
+        # Assert
+        assert response.status_code == 200
+        assert received == [b"<script>"]
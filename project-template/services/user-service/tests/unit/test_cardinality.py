@@ -0,0 +1,117 @@
+# Unit tests for the metric label cardinality guard
+
+import logging
+import tracemalloc
+
+import pytest
+
+from shared.monitoring.cardinality import OVERFLOW_LABEL_VALUE, CardinalityLimiter
+from shared.monitoring.decorators import MetricsCollector
+
+
+@pytest.fixture(autouse=True)
+def quiet_metrics_logging():
+    monitoring_logger = logging.getLogger("shared.monitoring")
+    previous_level = monitoring_logger.level
+    monitoring_logger.setLevel(logging.ERROR)
+    yield
+    monitoring_logger.setLevel(previous_level)
+
+
+class TestCardinalityLimiter:
+    """Test cases for CardinalityLimiter and its use in MetricsCollector."""
+
+    @pytest.mark.unit
+    def test_series_capped_with_overflow_bucket(self):
+        """Test that combinations past the cap are counted in one overflow series."""
+        # Arrange
+        metrics = MetricsCollector("test_service", max_series_per_metric=10)
+
+        # Act
+        for index in range(15):
+            metrics.increment_counter("external_service_error", {"endpoint": f"/api/v1/forms/{index}"})
+
+        # Assert
+        overflow_key = f"test_service.external_service_error.{OVERFLOW_LABEL_VALUE}"
+        assert metrics.cardinality.series_count("test_service.external_service_error") <= 10
+        assert sum(metrics.counters.values()) == 15
+        assert metrics.counters[overflow_key] >= 5
+
+    @pytest.mark.unit
+    def test_hot_series_retained_under_adversarial_churn(self):
+        """Test that frequently hit series survive a flood of one-off label values."""
+        # Arrange
+        metrics = MetricsCollector("test_service", max_series_per_metric=20)
+        hot_endpoints = [f"/api/v1/hot/{index}" for index in range(5)]
+
+        # Act
+        for round_index in range(2000):
+            for endpoint in hot_endpoints:
+                metrics.increment_counter("external_service_error", {"endpoint": endpoint})
+            metrics.increment_counter("external_service_error", {"endpoint": f"/attack/{round_index}"})
+
+        # Assert
+        for endpoint in hot_endpoints:
+            assert metrics.counters[f"test_service.external_service_error.endpoint_{endpoint}"] == 2000
+        assert len(metrics.counters) <= 21
+        assert sum(metrics.counters.values()) == 2000 * 6
+
+    @pytest.mark.unit
+    def test_report_names_exploding_label(self):
+        """Test that the report points at the label whose values keep multiplying."""
+        # Arrange
+        metrics = MetricsCollector("test_service", max_series_per_metric=10)
+
+        # Act
+        for index in range(50):
+            metrics.increment_counter(
+                "database_query_error",
+                {"table": "users", "operation": "select", "error_type": f"Error{index}"}
+            )
+        metrics.increment_counter("database_query_success", {"table": "users", "operation": "select"})
+        report = metrics.cardinality.report()
+
+        # Assert
+        assert report[0]["metric"] == "test_service.database_query_error"
+        assert report[0]["rejected_series"] > 0
+        assert report[0]["compactions"] > 0
+        assert report[0]["exploding_labels"] == ["error_type"]
+        assert report[0]["label_cardinality"]["table"] == 1
+        assert report[1]["rejected_series"] == 0
+
+    @pytest.mark.unit
+    def test_memory_bounded_under_unique_labels(self):
+        """Test that memory stops growing once the cap is reached, however many labels arrive."""
+        # Arrange
+        metrics = MetricsCollector("test_service", max_series_per_metric=100)
+        for index in range(1000):
+            metrics.increment_counter("requests", {"client": f"warmup-{index}"})
+
+        # Act
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        for index in range(20000):
+            metrics.increment_counter("requests", {"client": f"client-{index}"})
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Assert
+        assert len(metrics.counters) <= 101
+        assert current - baseline < 64 * 1024
+
+    @pytest.mark.unit
+    def test_limiter_admits_existing_series(self):
+        """Test that an admitted series keeps its own key after the cap is reached."""
+        # Arrange
+        limiter = CardinalityLimiter(max_series=2)
+        values = {}
+
+        # Act
+        first = limiter.admit("metric", "metric.a", {"k": "a"}, values)
+        limiter.admit("metric", "metric.b", {"k": "b"}, values)
+        again = limiter.admit("metric", "metric.a", {"k": "a"}, values)
+        overflow = limiter.admit("metric", "metric.c", {"k": "c"}, values)
+
+        # Assert
+        assert first == again == "metric.a"
+        assert overflow == f"metric.{OVERFLOW_LABEL_VALUE}"
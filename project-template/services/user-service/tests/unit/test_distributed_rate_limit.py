@@ -0,0 +1,204 @@
+# Unit tests for the shared rate limiter, run against an in-process Redis stand-in
+
+import asyncio
+import hashlib
+import math
+import time
+
+import pytest
+
+from app.middleware.rate_limit import TOKEN_BUCKET_SCRIPT, DistributedRateLimiter, RedisRateLimitBackend
+
+
+class InProcessRedis:
+    """
+    Redis stand-in speaking the redis.asyncio script API.
+
+    The token bucket script is executed by a Python port of its Lua source,
+    against a clock the test controls. ``delay`` makes every call slow.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.scripts = {}
+        self.calls = 0
+        self.delay = 0.0
+        self.now_ms = 1_000_000
+
+    async def script_load(self, script: str) -> str:
+        sha = hashlib.sha1(script.encode()).hexdigest()
+        self.scripts[sha] = script
+        return sha
+
+    def flush_scripts(self):
+        self.scripts.clear()
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if sha not in self.scripts:
+            raise Exception("NOSCRIPT No matching script. Please use EVAL.")
+        assert self.scripts[sha] == TOKEN_BUCKET_SCRIPT
+        key = keys_and_args[0]
+        capacity, window_ms, requested = (float(arg) for arg in keys_and_args[numkeys:])
+        return self._token_bucket(key, capacity, window_ms, int(requested))
+
+    def _token_bucket(self, key, capacity, window_ms, requested):
+        refill_per_ms = capacity / window_ms
+        state = self.hashes.get(key, {})
+        tokens = float(state.get("tokens", capacity))
+        ts = state.get("ts", self.now_ms)
+        tokens = min(capacity, tokens + max(0, self.now_ms - ts) * refill_per_ms)
+        granted = min(requested, math.floor(tokens))
+        tokens -= granted
+        self.hashes[key] = {"tokens": str(tokens), "ts": self.now_ms}
+        retry_ms = math.ceil((1 - tokens) / refill_per_ms) if granted == 0 else 0
+        return [granted, math.floor(tokens), retry_ms]
+
+
+def replicas(redis, count, **kwargs):
+    return [
+        DistributedRateLimiter(RedisRateLimitBackend(redis), expected_replicas=count, **kwargs)
+        for _ in range(count)
+    ]
+
+
+class TestDistributedRateLimiter:
+    """Test cases for DistributedRateLimiter and RedisRateLimitBackend."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_limit_shared_across_replicas(self):
+        """Test that eight replicas together admit the shared limit, not eight times it."""
+        # Arrange
+        redis = InProcessRedis()
+        limiters = replicas(redis, 8, limit=100, window=60)
+
+        # Act
+        allowed = 0
+        for index in range(2000):
+            decision = await limiters[index % 8].check("10.0.0.1")
+            allowed += decision.allowed
+
+        # Assert
+        assert 90 <= allowed <= 100
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_leasing_avoids_round_trip_per_request(self):
+        """Test that a busy client is served from local leases most of the time."""
+        # Arrange
+        redis = InProcessRedis()
+        limiter = DistributedRateLimiter(RedisRateLimitBackend(redis), limit=10000, window=60, expected_replicas=8, max_lease=16)
+
+        # Act
+        decisions = [await limiter.check("10.0.0.1") for _ in range(1000)]
+
+        # Assert
+        assert all(decision.allowed for decision in decisions)
+        assert redis.calls < 100
+        assert limiter.get_stats()["lease_hits"] > 900
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_rejections_cached_until_retry(self):
+        """Test that a limited client is rejected locally until the backend's retry time."""
+        # Arrange
+        redis = InProcessRedis()
+        limiter = DistributedRateLimiter(RedisRateLimitBackend(redis), limit=2, window=60, local_limit=1)
+        for _ in range(2):
+            await limiter.check("10.0.0.1")
+        calls_before = redis.calls
+
+        # Act
+        first = await limiter.check("10.0.0.1")
+        repeated = [await limiter.check("10.0.0.1") for _ in range(50)]
+
+        # Assert
+        assert first.allowed is False
+        assert first.retry_after == pytest.approx(30.0)
+        assert not any(decision.allowed for decision in repeated)
+        assert redis.calls == calls_before + 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_concurrent_checks_share_one_round_trip(self):
+        """Test that concurrent checks for one key wait for a single in-flight lease."""
+        # Arrange
+        redis = InProcessRedis()
+        redis.delay = 0.01
+        limiter = DistributedRateLimiter(RedisRateLimitBackend(redis), limit=100, window=60, expected_replicas=8, timeout=1.0)
+
+        # Act
+        decisions = await asyncio.gather(*(limiter.check("10.0.0.1") for _ in range(20)))
+
+        # Assert
+        assert all(decision.allowed for decision in decisions)
+        assert redis.calls < 10
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_fallback_limit_is_share_of_global_limit(self):
+        """Test that a degraded backend leaves each replica its share of the limit, not all of it."""
+        # Arrange
+        redis = InProcessRedis()
+        redis.delay = 0.2
+        limiters = replicas(redis, 4, limit=100, window=60, timeout=0.01)
+
+        # Act
+        admitted = 0
+        for limiter in limiters:
+            for _ in range(100):
+                admitted += (await limiter.check("10.0.0.1")).allowed
+
+        # Assert
+        assert admitted == 100
+        with pytest.raises(ValueError):
+            DistributedRateLimiter(RedisRateLimitBackend(redis), limit=100, window=60)
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_slow_backend_falls_back_to_local_limit(self):
+        """Test that a slow backend is bypassed for local limits and retried after the backoff."""
+        # Arrange
+        redis = InProcessRedis()
+        redis.delay = 0.2
+        limiter = DistributedRateLimiter(
+            RedisRateLimitBackend(redis), limit=100, window=60,
+            local_limit=5, timeout=0.02, degraded_backoff=0.1
+        )
+
+        # Act
+        start = time.perf_counter()
+        decisions = [await limiter.check("10.0.0.1") for _ in range(10)]
+        elapsed = time.perf_counter() - start
+        degraded = limiter.degraded
+        redis.delay = 0.0
+        await asyncio.sleep(0.15)
+        recovered = await limiter.check("10.0.0.2")
+
+        # Assert
+        assert [decision.allowed for decision in decisions] == [True] * 5 + [False] * 5
+        assert elapsed < 0.1
+        assert degraded is True
+        assert limiter.get_stats()["backend_failures"] == 1
+        assert recovered.allowed is True
+        assert limiter.degraded is False
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_script_reloaded_after_noscript(self):
+        """Test that the backend reloads its script when the server's script cache was flushed."""
+        # Arrange
+        redis = InProcessRedis()
+        backend = RedisRateLimitBackend(redis)
+        await backend.acquire("10.0.0.1", 1, 10, 60)
+        redis.flush_scripts()
+
+        # Act
+        granted, remaining, retry_after = await backend.acquire("10.0.0.1", 3, 10, 60)
+
+        # Assert
+        assert (granted, remaining, retry_after) == (3, 6, 0.0)
+        assert "ratelimit:10.0.0.1" in redis.hashes
@@ -0,0 +1,480 @@
+# Unit tests for the metrics middleware
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
+
+from app.middleware.metrics import (
+    EventLoopLagMonitor,
+    LatencyHistogram,
+    MetricsMiddleware,
+    OVERFLOW_ROUTE,
+    RollingWindow,
+    SpaceSavingCounter,
+    TopTotals,
+    UNMATCHED_ROUTE,
+    get_metrics_summary,
+    parse_queue_start,
+    reset_metrics,
+)
+
+
+def create_test_app(**middleware_kwargs) -> FastAPI:
+    """Create a small app wrapped in MetricsMiddleware."""
+    test_app = FastAPI()
+    test_app.add_middleware(MetricsMiddleware, **middleware_kwargs)
+
+    @test_app.get("/api/v1/users/{user_id}")
+    async def get_user(user_id: str):
+        return {"id": user_id}
+
+    @test_app.get("/api/v1/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"id": item_id}
+
+    @test_app.get("/stream")
+    async def stream():
+        async def chunks():
+            for index in range(3):
+                yield f"chunk-{index}\n".encode()
+        return StreamingResponse(chunks())
+
+    @test_app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    @test_app.post("/upload")
+    async def upload(request: Request):
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+        return {"received": received}
+
+    test_app.state.release = asyncio.Event()
+
+    @test_app.get("/wait")
+    async def wait():
+        await test_app.state.release.wait()
+        return {"released": True}
+
+    return test_app
+
+
+class TestLatencyHistogram:
+    """Test cases for LatencyHistogram."""
+
+    @pytest.mark.unit
+    def test_observe_places_values_in_buckets(self):
+        """Test observations land in the bucket of their upper bound."""
+        # Arrange
+        histogram = LatencyHistogram(bounds=(0.1, 1.0))
+
+        # Act
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5.0)
+
+        # Assert
+        assert histogram.buckets == [1, 1, 1]
+        assert histogram.count == 3
+        assert histogram.to_dict()["buckets"] == {"0.1": 1, "1.0": 2, "+Inf": 3}
+
+    @pytest.mark.unit
+    def test_quantile_interpolates_within_bucket(self):
+        """Test quantile estimation on a uniform distribution."""
+        # Arrange
+        histogram = LatencyHistogram(bounds=(0.1, 0.2, 0.3, 0.4))
+        for value in (0.05, 0.15, 0.25, 0.35):
+            histogram.observe(value)
+
+        # Act & Assert
+        assert histogram.quantile(0.5) == pytest.approx(0.2)
+        assert histogram.quantile(1.0) == pytest.approx(0.4)
+        assert LatencyHistogram().quantile(0.95) == 0.0
+
+
+class TestRollingWindow:
+    """Test cases for RollingWindow."""
+
+    @pytest.mark.unit
+    def test_snapshot_only_counts_recent_buckets(self):
+        """Test that requests older than the window drop out of the rolling totals."""
+        # Arrange
+        window = RollingWindow(window_seconds=60)
+        window.record("GET /a", 0.01, is_error=True, now=1000)
+        window.record("GET /a", 0.01, is_error=False, now=1070)
+        window.record("GET /a", 0.01, is_error=False, now=1075)
+
+        # Act
+        snapshot = window.snapshot(now=1080)
+
+        # Assert
+        assert snapshot["requests"] == 2
+        assert snapshot["errors"] == 0
+        assert snapshot["routes"]["GET /a"]["count"] == 2
+
+    @pytest.mark.unit
+    def test_slot_is_recycled_after_wraparound(self):
+        """Test that a ring slot reused for a newer second starts empty."""
+        # Arrange
+        window = RollingWindow(window_seconds=10)
+        window.record("GET /a", 0.01, is_error=True, now=5)
+
+        # Act
+        window.record("GET /b", 2.0, is_error=False, now=15)
+        snapshot = window.snapshot(now=15)
+
+        # Assert
+        assert snapshot["requests"] == 1
+        assert set(snapshot["routes"]) == {"GET /b"}
+        assert snapshot["routes"]["GET /b"]["p95_duration_ms"] > 1000
+
+
+class TestSpaceSavingCounter:
+    """Test cases for SpaceSavingCounter."""
+
+    @pytest.mark.unit
+    def test_keeps_heavy_hitters_within_capacity(self):
+        """Test that frequent items survive a long tail of one-off items."""
+        # Arrange
+        counter = SpaceSavingCounter(capacity=4)
+
+        # Act
+        for index in range(200):
+            for _ in range(3):
+                counter.offer("GET /hot")
+            for _ in range(2):
+                counter.offer("GET /warm")
+            counter.offer(f"GET /cold-{index}")
+
+        # Assert
+        top = counter.top(2)
+        assert len(counter.counters) == 4
+        assert [item for item, _, _ in top] == ["GET /hot", "GET /warm"]
+        assert top[0][1] >= 600
+
+
+class TestTopTotals:
+    """Test cases for TopTotals."""
+
+    @pytest.mark.unit
+    def test_keeps_largest_totals_within_capacity(self):
+        """Test that growing totals displace the smallest and the ranking stays exact."""
+        # Arrange
+        top = TopTotals(capacity=2)
+
+        # Act
+        top.update("GET /a", 100)
+        top.update("GET /b", 50)
+        top.update("GET /c", 10)
+        top.update("GET /c", 80)
+        top.update("GET /b", 60)
+        top.update("GET /b", 500)
+
+        # Assert
+        assert top.top() == [("GET /b", 500), ("GET /a", 100)]
+
+
+class TestSaturationSignals:
+    """Test cases for queueing time parsing and event loop lag sampling."""
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("header_value", [
+        "t=1700000000.250",
+        "1700000000250",
+        "t=1700000000250000",
+        "1700000000250000000",
+    ])
+    def test_parse_queue_start_units(self, header_value):
+        """Test that second, millisecond, microsecond and nanosecond timestamps are normalised."""
+        # Act
+        queue_time = parse_queue_start(header_value, now=1700000000.5)
+
+        # Assert
+        assert queue_time == pytest.approx(0.25)
+
+    @pytest.mark.unit
+    def test_parse_queue_start_rejects_invalid_values(self):
+        """Test that malformed and implausible headers are ignored, small skew is clamped."""
+        # Act & Assert
+        assert parse_queue_start("garbage", now=1700000000.0) is None
+        assert parse_queue_start("t=1000", now=1700000000.0) is None
+        assert parse_queue_start("t=1700000000.1", now=1700000000.0) == 0.0
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_event_loop_lag_monitor_detects_blocking(self):
+        """Test that blocking the loop shows up as lag."""
+        # Arrange
+        application = SimpleNamespace(state=SimpleNamespace(metrics={'event_loop_lag': LatencyHistogram()}))
+        monitor = EventLoopLagMonitor(interval=0.01)
+        monitor.start(application)
+        await asyncio.sleep(0.02)
+
+        # Act
+        time.sleep(0.1)
+        await asyncio.sleep(0.03)
+        monitor.stop()
+
+        # Assert
+        lag = application.state.metrics['event_loop_lag']
+        assert lag.count >= 2
+        assert lag.quantile(1.0) >= 0.05
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_loop_lag_sampled_only_between_start_and_stop(self):
+        """Test that requests never start lag sampling and lifespan start/stop control it."""
+        # Arrange
+        test_app = create_test_app()
+        middleware = MetricsMiddleware(None, loop_lag_interval=0.01)
+        application = SimpleNamespace(state=SimpleNamespace())
+
+        def lag_tasks():
+            return [task for task in asyncio.all_tasks() if "EventLoopLagMonitor" in repr(task.get_coro())]
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            await client.get("/api/v1/users/1")
+        tasks_after_request = lag_tasks()
+        middleware.start(application)
+        await asyncio.sleep(0.05)
+        middleware.stop()
+        await asyncio.sleep(0)
+
+        # Assert
+        assert tasks_after_request == []
+        assert application.state.metrics['event_loop_lag'].count >= 1
+        assert lag_tasks() == []
+
+
+class TestMetricsMiddleware:
+    """Test cases for MetricsMiddleware."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_labels_by_route_template(self):
+        """Test that path parameters collapse into one route template label."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            for index in range(25):
+                await client.get(f"/api/v1/users/user-{index}")
+            await client.get("/does-not-exist")
+
+        # Assert
+        endpoints = test_app.state.metrics['endpoints']
+        assert set(endpoints) == {
+            "GET /api/v1/users/{user_id}",
+            f"GET {UNMATCHED_ROUTE}",
+        }
+        assert endpoints["GET /api/v1/users/{user_id}"].count == 25
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_routed_requests_reuse_router_match(self, monkeypatch):
+        """Test that routes are matched again only for requests the router did not handle."""
+        # Arrange
+        test_app = create_test_app()
+        matched = []
+        original = MetricsMiddleware._route_template
+
+        def counting_route_template(self, scope):
+            matched.append(scope["path"])
+            return original(self, scope)
+
+        monkeypatch.setattr(MetricsMiddleware, "_route_template", counting_route_template)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            for index in range(5):
+                await client.get(f"/api/v1/users/user-{index}")
+            await client.post("/api/v1/items/1")
+            await client.get("/does-not-exist")
+
+        # Assert
+        assert matched == ["/does-not-exist"]
+        assert set(test_app.state.metrics['endpoints']) == {
+            "GET /api/v1/users/{user_id}",
+            "POST /api/v1/items/{item_id}",
+            f"GET {UNMATCHED_ROUTE}",
+        }
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_route_label_cardinality_cap(self):
+        """Test that labels beyond the cap are folded into the overflow label."""
+        # Arrange
+        test_app = create_test_app(max_route_labels=1)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            await client.get("/api/v1/users/1")
+            await client.get("/api/v1/items/1")
+            await client.get("/stream")
+
+        # Assert
+        endpoints = test_app.state.metrics['endpoints']
+        assert set(endpoints) == {"GET /api/v1/users/{user_id}", OVERFLOW_ROUTE}
+        assert endpoints[OVERFLOW_ROUTE].count == 2
+        assert test_app.state.metrics['route_overflow'] == 2
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_unknown_methods_share_one_label(self):
+        """Test that made-up HTTP methods cannot each claim a route label."""
+        # Arrange
+        test_app = create_test_app(max_route_labels=5)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            for index in range(20):
+                await client.request(f"X{index}", "/api/v1/users/1")
+            await client.get("/api/v1/users/1")
+
+        # Assert
+        endpoints = test_app.state.metrics['endpoints']
+        assert set(endpoints) == {"OTHER /api/v1/users/{user_id}", "GET /api/v1/users/{user_id}"}
+        assert endpoints["OTHER /api/v1/users/{user_id}"].count == 20
+        assert test_app.state.metrics['route_overflow'] == 0
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_adds_metrics_headers_and_streams_body(self):
+        """Test metrics headers are added and streaming bodies pass through intact."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.get("/stream")
+
+        # Assert
+        assert response.status_code == 200
+        assert response.text == "chunk-0\nchunk-1\nchunk-2\n"
+        assert float(response.headers["x-request-duration"]) >= 0
+        assert response.headers["x-request-count"] == "1"
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_counts_unhandled_errors(self):
+        """Test that exceptions raised by the app are counted and re-raised."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            with pytest.raises(RuntimeError):
+                await client.get("/boom")
+
+        # Assert
+        assert test_app.state.metrics['errors'] == 1
+        assert test_app.state.metrics['request_count'] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_summary_reports_percentiles_and_resets(self):
+        """Test the metrics summary exposes per-route percentiles and can be reset."""
+        # Arrange
+        test_app = create_test_app()
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            await client.get("/api/v1/users/1")
+
+        # Act
+        summary = get_metrics_summary(test_app)
+        reset_metrics(test_app)
+
+        # Assert
+        top_endpoint = summary["top_endpoints"][0]
+        assert top_endpoint["endpoint"] == "GET /api/v1/users/{user_id}"
+        assert top_endpoint["count"] == 1
+        assert "p95_duration_ms" in top_endpoint
+        assert summary["latency_histograms"]["GET /api/v1/users/{user_id}"]["count"] == 1
+        assert test_app.state.metrics['request_count'] == 0
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_health_follows_rolling_error_rate_slo(self):
+        """Test that a burst of recent failures degrades health regardless of lifetime totals."""
+        # Arrange
+        test_app = create_test_app(slo={'max_error_rate': 0.1, 'min_requests': 5})
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            for index in range(5):
+                await client.get(f"/api/v1/users/{index}")
+        healthy_summary = get_metrics_summary(test_app)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            for _ in range(2):
+                with pytest.raises(RuntimeError):
+                    await client.get("/boom")
+        degraded_summary = get_metrics_summary(test_app)
+
+        # Assert
+        assert healthy_summary["health_status"] == "healthy"
+        assert degraded_summary["health_status"] == "degraded"
+        assert degraded_summary["rolling_window"]["errors"] == 2
+        assert degraded_summary["slo_breaches"][0].startswith("error_rate")
+        assert degraded_summary["rolling_window"]["routes"]["GET /boom"]["error_rate"] == 1.0
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_tracks_in_flight_requests_and_queue_time(self):
+        """Test in-flight gauges per route and queueing time from X-Request-Start."""
+        # Arrange
+        test_app = create_test_app()
+        headers = {"X-Request-Start": f"t={time.time() - 0.2:.3f}"}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            pending = [
+                asyncio.ensure_future(client.get("/wait", headers=headers))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0.05)
+            during = get_metrics_summary(test_app)["saturation"]
+            test_app.state.release.set()
+            await asyncio.gather(*pending)
+        after = get_metrics_summary(test_app)["saturation"]
+
+        # Assert
+        assert during["in_flight"] == {"GET /wait": 3}
+        assert after["in_flight_total"] == 0
+        assert after["in_flight_peak_total"] == 3
+        assert after["in_flight_max_at_read"]["GET /wait"] == 3
+        assert after["queue_time"]["count"] == 3
+        assert after["queue_time_p50_ms"] >= 100
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_records_payload_sizes_for_chunked_bodies(self):
+        """Test request and response byte counts without a content-length header."""
+        # Arrange
+        test_app = create_test_app()
+
+        async def chunked_body():
+            for _ in range(4):
+                yield b"x" * 1000
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            upload_response = await client.post("/upload", content=chunked_body())
+            stream_response = await client.get("/stream")
+
+        # Assert
+        payload_sizes = {
+            entry["endpoint"]: entry
+            for entry in get_metrics_summary(test_app)["payload_sizes"]
+        }
+        assert upload_response.json() == {"received": 4000}
+        assert payload_sizes["POST /upload"]["request_bytes_total"] == 4000
+        assert payload_sizes["POST /upload"]["response_bytes_total"] == len(upload_response.content)
+        assert payload_sizes["GET /stream"]["response_bytes_total"] == len(stream_response.content)
+        assert payload_sizes["GET /stream"]["request_sizes"]["buckets"]["128"] == 1
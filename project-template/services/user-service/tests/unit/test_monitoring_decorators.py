@@ -0,0 +1,243 @@
+# Unit tests for the shared monitoring decorators
+
+import time
+from unittest.mock import patch
+
+import pytest
+
+from shared.monitoring.decorators import (
+    INSTRUMENTATION_COUNTERS,
+    INSTRUMENTATION_FULL,
+    INSTRUMENTATION_OFF,
+    INSTRUMENTATION_SAMPLED,
+    MAX_TIMER_SAMPLES,
+    MetricsCollector,
+    TimerContext,
+    database_operation,
+    external_service_call,
+    get_metrics_collector,
+    set_instrumentation_level,
+    trace_function,
+    trace_method,
+)
+
+
+class TestTimerContext:
+    """Test cases for TimerContext."""
+
+    @pytest.mark.unit
+    def test_stop_after_exit_records_once(self):
+        """Test that stop() after the with-block does not record a second duration."""
+        # Arrange
+        metrics = MetricsCollector("test_service")
+
+        # Act
+        with patch.object(metrics, "record_duration") as record_duration:
+            with metrics.start_timer("operation.duration") as timer:
+                pass
+            timer.stop()
+            timer.__exit__(None, None, None)
+
+        # Assert
+        record_duration.assert_called_once()
+        assert record_duration.call_args.args[1] == timer.duration
+
+    @pytest.mark.unit
+    def test_repeated_stop_records_once(self):
+        """Test that repeated stop() calls return the same duration and record once."""
+        # Arrange
+        metrics = MetricsCollector("test_service")
+        timer = metrics.start_timer("operation.duration")
+
+        # Act
+        with patch.object(metrics, "record_duration") as record_duration:
+            first = timer.stop()
+            second = timer.stop()
+
+        # Assert
+        record_duration.assert_called_once()
+        assert first == second == timer.duration
+
+    @pytest.mark.unit
+    def test_timer_started_without_enter_measures(self):
+        """Test that start_timer() starts the clock even when not used as a context manager."""
+        # Arrange
+        metrics = MetricsCollector("test_service")
+        timer = metrics.start_timer("operation.duration")
+
+        # Act
+        time.sleep(0.01)
+        duration = timer.stop()
+
+        # Assert
+        assert duration >= 0.01
+
+    @pytest.mark.unit
+    def test_duration_ignores_wall_clock_jumps(self):
+        """Test that a wall clock stepping backwards cannot produce a negative duration."""
+        # Arrange
+        metrics = MetricsCollector("test_service")
+        wall_clock = iter([1_000_000.0, 999_000.0])
+
+        # Act
+        with patch("time.time", lambda: next(wall_clock)):
+            timer = TimerContext(metrics, "operation.duration")
+            duration = timer.stop()
+
+        # Assert
+        assert duration >= 0
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_database_operation_records_once(self):
+        """Test that database_operation records exactly one duration per operation."""
+        # Arrange
+        metrics = MetricsCollector("test_service")
+
+        # Act
+        with patch.object(metrics, "record_duration") as record_duration:
+            async with database_operation("users", "select", metrics):
+                pass
+            async with external_service_call("form-service", "/api/v1/forms", metrics):
+                pass
+
+        # Assert
+        assert [call.args[0] for call in record_duration.call_args_list] == [
+            "database_query_duration",
+            "external_service_duration",
+        ]
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_trace_function_records_once_on_error(self):
+        """Test that a failing traced function records exactly one duration."""
+        # Arrange
+        @trace_function("test_service.fail")
+        async def fail():
+            raise ValueError("failure")
+
+        # Act
+        with patch.object(MetricsCollector, "record_duration") as record_duration:
+            with pytest.raises(ValueError):
+                await fail()
+
+        # Assert
+        record_duration.assert_called_once()
+
+
+@pytest.fixture
+def instrumentation_level():
+    yield set_instrumentation_level
+    set_instrumentation_level(INSTRUMENTATION_FULL, 1.0)
+
+
+class TestInstrumentationLevels:
+    """Test cases for the instrumentation levels of trace_function and trace_method."""
+
+    @pytest.mark.unit
+    def test_off_at_decoration_returns_original_function(self, instrumentation_level):
+        """Test that decorating while off returns the function unchanged."""
+        # Arrange
+        instrumentation_level(INSTRUMENTATION_OFF)
+
+        def handler():
+            return "ok"
+
+        class Repository:
+            def get(self):
+                return "ok"
+
+        # Act
+        traced = trace_function("level_service.handler")(handler)
+        traced_method = trace_method("level_service.get")(Repository.get)
+
+        # Assert
+        assert traced is handler
+        assert traced_method is Repository.get
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_runtime_switch_for_decorated_functions(self, instrumentation_level):
+        """Test that already-decorated functions follow runtime level changes."""
+        # Arrange
+        metrics = get_metrics_collector("switch_service")
+        metrics.counters.clear()
+        metrics.timers.clear()
+
+        @trace_function("switch_service.handle")
+        async def handle():
+            return "ok"
+
+        success_key = "switch_service.switch_service.handle.success"
+        duration_key = "switch_service.switch_service.handle.duration"
+
+        # Act / Assert
+        instrumentation_level(INSTRUMENTATION_OFF)
+        await handle()
+        assert success_key not in metrics.counters
+
+        instrumentation_level(INSTRUMENTATION_COUNTERS)
+        await handle()
+        assert metrics.counters[success_key] == 1
+        assert duration_key not in metrics.timers
+
+        instrumentation_level(INSTRUMENTATION_FULL)
+        await handle()
+        assert metrics.counters[success_key] == 2
+        assert len(metrics.timers[duration_key]) == 1
+
+    @pytest.mark.unit
+    def test_sampled_level_times_only_a_fraction(self, instrumentation_level):
+        """Test that sampled mode counts every call but fully instruments only the sampled ones."""
+        # Arrange
+        metrics = get_metrics_collector("sampled_service")
+        metrics.counters.clear()
+        metrics.timers.clear()
+        instrumentation_level(INSTRUMENTATION_SAMPLED, 0.1)
+
+        @trace_function("sampled_service.work")
+        def work():
+            return None
+
+        # Act
+        for _ in range(2000):
+            work()
+
+        # Assert
+        assert metrics.counters["sampled_service.sampled_service.work.success"] == 2000
+        assert 100 < len(metrics.timers["sampled_service.sampled_service.work.duration"]) < 300
+
+    @pytest.mark.unit
+    def test_counters_level_counts_errors(self, instrumentation_level):
+        """Test that errors are counted by type in counters mode."""
+        # Arrange
+        metrics = get_metrics_collector("error_service")
+        metrics.counters.clear()
+        instrumentation_level(INSTRUMENTATION_COUNTERS)
+
+        @trace_function("error_service.fail")
+        def fail():
+            raise KeyError("missing")
+
+        # Act
+        with pytest.raises(KeyError):
+            fail()
+
+        # Assert
+        assert metrics.counters["error_service.error_service.fail.error.error_type_KeyError"] == 1
+
+    @pytest.mark.unit
+    def test_timer_samples_bounded(self):
+        """Test that a shared collector keeps only the most recent durations per metric."""
+        # Arrange
+        metrics = MetricsCollector("bounded_service")
+
+        # Act
+        with patch("shared.monitoring.decorators.logger"):
+            for index in range(MAX_TIMER_SAMPLES + 10):
+                metrics.record_duration("operation.duration", float(index))
+
+        # Assert
+        samples = metrics.timers["bounded_service.operation.duration"]
+        assert len(samples) == MAX_TIMER_SAMPLES
+        assert samples[-1] == float(MAX_TIMER_SAMPLES + 9)
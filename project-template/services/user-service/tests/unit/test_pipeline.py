@@ -0,0 +1,165 @@
+# Unit tests for the fused request pipeline
+
+import uuid
+
+import pytest
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+
+from app.middleware.metrics import MetricsMiddleware, get_metrics_summary
+from app.middleware.pipeline import RequestPipeline, get_pipeline_summary
+from app.middleware.security import SecurityMiddleware, get_security_summary
+
+BROWSER = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+
+
+def create_test_app(**pipeline_kwargs) -> FastAPI:
+    """Create a small app behind a RequestPipeline with both stages."""
+    test_app = FastAPI()
+    pipeline_kwargs.setdefault("security", SecurityMiddleware(None))
+    pipeline_kwargs.setdefault("metrics", MetricsMiddleware(None))
+    test_app.add_middleware(RequestPipeline, **pipeline_kwargs)
+
+    @test_app.get("/api/v1/users/{user_id}")
+    async def get_user(user_id: str, request: Request):
+        return {"id": user_id, "request_id": request.state.request_id}
+
+    @test_app.post("/upload")
+    async def upload(request: Request):
+        return {"received": len(await request.body())}
+
+    @test_app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    @test_app.api_route("/health/live", methods=["GET", "POST"])
+    async def liveness():
+        return {"status": "alive"}
+
+    return test_app
+
+
+class TestRequestPipeline:
+    """Test cases for RequestPipeline."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_single_pass_adds_all_response_headers(self):
+        """Test that one response carries request id, security and metrics headers and is counted once."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.get("/api/v1/users/1", headers=BROWSER)
+
+        # Assert
+        assert response.status_code == 200
+        assert response.json()["request_id"] == response.headers["x-request-id"]
+        uuid.UUID(response.headers["x-request-id"])
+        assert response.headers.get_list("x-frame-options") == ["DENY"]
+        assert response.headers["ratelimit-remaining"] == "99"
+        assert response.headers["x-request-count"] == "1"
+        assert "x-request-duration" in response.headers
+        assert get_metrics_summary(test_app)["status_code_distribution"] == {200: 1}
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_caller_request_id_reused_when_valid(self):
+        """Test that a well-formed X-Request-ID is propagated and a malformed one replaced."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            valid = await client.get("/api/v1/users/1", headers={**BROWSER, "x-request-id": "gw-42.abc"})
+            invalid = await client.get("/api/v1/users/1", headers={**BROWSER, "x-request-id": "a b<script>"})
+
+        # Assert
+        assert valid.headers["x-request-id"] == "gw-42.abc"
+        assert invalid.headers["x-request-id"] != "a b<script>"
+        uuid.UUID(invalid.headers["x-request-id"])
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_rejections_measured_and_tagged(self):
+        """Test that security rejections carry a request id and are recorded by the metrics stage."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            scanner = await client.get("/api/v1/users/1", headers={"user-agent": "sqlmap/1.7"})
+            # The scanner hit reaches the first ban tier
+            banned = await client.get("/api/v1/users/1", headers=BROWSER)
+
+        # Assert
+        assert scanner.status_code == 403
+        assert scanner.json() == {"error": "Access forbidden"}
+        assert "x-request-id" in scanner.headers
+        assert banned.status_code == 403
+        assert get_metrics_summary(test_app)["status_code_distribution"] == {403: 2}
+        assert get_security_summary(test_app)["abuse_scores"]["signals"]["malicious_user_agent"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_streamed_body_violation_replaces_response(self):
+        """Test that a body over the limit is answered with 413 by the security stage."""
+        # Arrange
+        test_app = create_test_app(security=SecurityMiddleware(None, max_body_bytes=16))
+
+        async def chunked_body():
+            for _ in range(4):
+                yield b"x" * 8
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.post("/upload", content=chunked_body(), headers=BROWSER)
+
+        # Assert
+        assert response.status_code == 413
+        assert "x-request-id" in response.headers
+        assert get_security_summary(test_app)["rejected_bodies"]["too_large"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_unhandled_error_mapped_to_json_500(self):
+        """Test that an application error becomes a JSON 500 with the request id and is counted as an error."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.get("/boom", headers={**BROWSER, "x-request-id": "req-1"})
+
+        # Assert
+        assert response.status_code == 500
+        assert response.json() == {"error": "Internal server error", "request_id": "req-1"}
+        assert response.headers["x-request-id"] == "req-1"
+        assert response.headers["x-content-type-options"] == "nosniff"
+        summary = get_metrics_summary(test_app)
+        assert summary["total_errors"] == 1
+        assert summary["status_code_distribution"] == {500: 1}
+        assert summary["latency_histograms"]["GET /boom"]["count"] == 1
+        assert summary["rolling_window"]["errors"] == 1
+        assert get_pipeline_summary(test_app)["mapped_errors"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_liveness_fast_path_bypasses_stages(self):
+        """Test that GET /health/live skips every stage while other methods on it do not."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            # An empty user agent would be refused by the security stage
+            probes = [await client.get("/health/live", headers={"user-agent": ""}) for _ in range(3)]
+            post = await client.post("/health/live", headers={"user-agent": ""})
+
+        # Assert
+        assert [probe.status_code for probe in probes] == [200, 200, 200]
+        assert "x-request-id" not in probes[0].headers
+        assert post.status_code == 403
+        assert get_metrics_summary(test_app)["total_requests"] == 1
+        assert get_pipeline_summary(test_app)["fast_path_requests"] == 3
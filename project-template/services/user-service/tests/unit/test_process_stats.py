@@ -0,0 +1,153 @@
+# Unit tests for the /proc-based process stats collector and GC pause tracking
+
+import gc
+import os
+import time
+
+import pytest
+
+from shared.monitoring.process_stats import GcPauseTracker, ProcessStatsCollector, read_process_stats
+
+HAS_PROCFS = os.path.exists("/proc/self/statm")
+
+
+def write_fake_proc(root, comm="python (worker) x"):
+    proc = root / "self"
+    (proc / "fd").mkdir(parents=True)
+    for fd in range(7):
+        (proc / "fd" / str(fd)).touch()
+    (proc / "statm").write_text("50000 12000 3000 1 0 20000 0\n")
+    # utime=250 ticks, stime=50 ticks, num_threads=9
+    fields = ["S"] + ["0"] * 10 + ["250", "50"] + ["0"] * 4 + ["9"] + ["0"] * 30
+    (proc / "stat").write_text(f"1234 ({comm}) " + " ".join(fields) + "\n")
+    (proc / "status").write_text(
+        "Name:\tpython\nVmHWM:\t   80000 kB\nVmRSS:\t   48000 kB\n"
+        "voluntary_ctxt_switches:\t12\nnonvoluntary_ctxt_switches:\t3\n"
+    )
+    (root / "meminfo").write_text("MemTotal:       1000000 kB\nMemFree:         500000 kB\n")
+    return str(proc)
+
+
+class TestProcessStats:
+    """Test cases for ProcessStatsCollector and GcPauseTracker."""
+
+    @pytest.mark.unit
+    def test_parses_proc_files(self, tmp_path):
+        """Test that statm, stat, status and fd are parsed, including a command name with spaces and parentheses."""
+        # Arrange
+        proc_root = write_fake_proc(tmp_path)
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        clock_ticks = os.sysconf("SC_CLK_TCK")
+
+        # Act
+        stats = ProcessStatsCollector(proc_root=proc_root, cgroup_root=str(tmp_path / "cgroup")).get_stats()
+
+        # Assert
+        assert stats["source"] == "procfs"
+        assert stats["rss_bytes"] == 12000 * page_size
+        assert stats["vms_bytes"] == 50000 * page_size
+        assert stats["rss_peak_bytes"] == 80000 * 1024
+        assert stats["cpu_user_seconds"] == 250 / clock_ticks
+        assert stats["cpu_system_seconds"] == 50 / clock_ticks
+        assert stats["threads"] == 9
+        assert stats["open_fds"] == 7
+        assert stats["voluntary_context_switches"] == 12
+        assert stats["percent"] == round(12000 * page_size / (1000000 * 1024) * 100, 3)
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("limit_file,limit,expected_total", [
+        ("memory.max", "524288000\n", 524288000),
+        ("memory.max", "max\n", 1000000 * 1024),
+        ("memory/memory.limit_in_bytes", "262144000\n", 262144000),
+        ("memory/memory.limit_in_bytes", "9223372036854771712\n", 1000000 * 1024),
+    ])
+    def test_percent_relative_to_cgroup_memory_limit(self, tmp_path, limit_file, limit, expected_total):
+        """Test that memory percent uses the cgroup v2 or v1 limit and ignores unlimited values."""
+        # Arrange
+        proc_root = write_fake_proc(tmp_path)
+        cgroup_root = tmp_path / "cgroup"
+        (cgroup_root / limit_file).parent.mkdir(parents=True, exist_ok=True)
+        (cgroup_root / limit_file).write_text(limit)
+        page_size = os.sysconf("SC_PAGE_SIZE")
+
+        # Act
+        stats = ProcessStatsCollector(proc_root=proc_root, cgroup_root=str(cgroup_root)).get_stats()
+
+        # Assert
+        assert stats["percent"] == round(12000 * page_size / expected_total * 100, 3)
+
+    @pytest.mark.unit
+    def test_falls_back_to_rusage_without_procfs(self, tmp_path):
+        """Test that a missing procfs yields rusage-based stats instead of an error."""
+        # Act
+        stats = ProcessStatsCollector(proc_root=str(tmp_path / "missing")).get_stats()
+
+        # Assert
+        assert stats["source"] == "rusage"
+        assert stats["rss_peak_bytes"] > 0
+        assert stats["threads"] >= 1
+
+    @pytest.mark.unit
+    @pytest.mark.skipif(not HAS_PROCFS, reason="requires procfs")
+    def test_open_fds_track_real_process(self, tmp_path):
+        """Test that the live reading follows file descriptors opened by the process."""
+        # Arrange
+        before = read_process_stats()["open_fds"]
+
+        # Act
+        handles = [open(tmp_path / f"f{index}", "w") for index in range(5)]
+        try:
+            during = read_process_stats()["open_fds"]
+        finally:
+            for handle in handles:
+                handle.close()
+
+        # Assert
+        assert during - before == 5
+
+    @pytest.mark.unit
+    def test_served_from_cache_between_refreshes(self, tmp_path):
+        """Test that get_stats does no I/O and the background thread refreshes the snapshot."""
+        # Arrange
+        proc_root = write_fake_proc(tmp_path)
+        collector = ProcessStatsCollector(refresh_interval=0.05, proc_root=proc_root)
+        collector.start()
+        try:
+            first = collector.get_stats()["refreshed_at"]
+            os.remove(os.path.join(proc_root, "statm"))
+
+            # Act
+            cached = collector.get_stats()
+            time.sleep(0.2)
+            refreshed = collector.get_stats()
+        finally:
+            collector.stop()
+
+        # Assert
+        assert cached["refreshed_at"] == first
+        assert cached["source"] == "procfs"
+        assert refreshed["source"] == "rusage"
+        assert refreshed["refreshed_at"] > first
+
+    @pytest.mark.unit
+    def test_gc_pause_histogram(self):
+        """Test that every collection lands in its generation's pause histogram."""
+        # Arrange
+        tracker = GcPauseTracker()
+        tracker.install()
+
+        # Act
+        try:
+            for _ in range(5):
+                gc.collect(0)
+            gc.collect(2)
+        finally:
+            tracker.uninstall()
+        summary = tracker.get_summary()
+
+        # Assert
+        assert summary["gen0"]["collections"] >= 5
+        assert sum(summary["gen0"]["pause_histogram_ms"].values()) == summary["gen0"]["collections"]
+        assert summary["gen2"]["collections"] >= 1
+        assert summary["gen2"]["pause_max_ms"] > 0
+        assert tracker.installed is False
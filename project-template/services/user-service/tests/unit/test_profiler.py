@@ -0,0 +1,143 @@
+# Unit tests for the on-demand stack sampler
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from shared.monitoring.decorators import trace_function
+from shared.monitoring.profiler import StackSampler, _active_operations, sample_for
+
+
+def busy_wait(seconds: float):
+    """Burn CPU in a recognisable frame."""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@trace_function("test_service.crunch")
+def crunch(seconds: float):
+    busy_wait(seconds)
+
+
+@trace_function("test_service.wait_for_upstream")
+async def wait_for_upstream(seconds: float):
+    await asyncio.sleep(seconds)
+
+
+class TestStackSampler:
+    """Test cases for StackSampler."""
+
+    @pytest.mark.unit
+    def test_samples_threads_annotated_with_operation(self):
+        """Test that a worker thread's samples carry the active trace_function operation."""
+        # Arrange
+        sampler = StackSampler(interval=0.005)
+        worker = threading.Thread(target=crunch, args=(0.3,), name="worker")
+
+        # Act
+        sampler.start()
+        worker.start()
+        worker.join()
+        profile = sampler.stop()
+
+        # Assert
+        collapsed = profile.to_collapsed()
+        worker_lines = [line for line in collapsed.splitlines() if line.startswith("thread:worker;")]
+        assert profile.sample_count > 10
+        assert any("[test_service.crunch]" in line and "busy_wait" in line for line in worker_lines)
+        assert not _active_operations
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_samples_suspended_asyncio_tasks(self):
+        """Test that suspended tasks are sampled along their await chain with operation annotations."""
+        # Arrange
+        task = asyncio.create_task(wait_for_upstream(0.3), name="upstream-call")
+
+        # Act
+        profile = await sample_for(0.15, interval=0.005, include_tasks=True)
+        await task
+
+        # Assert
+        task_stacks = [stack for stack in profile.samples if stack[0] == "task:upstream-call"]
+        assert any(
+            "[test_service.wait_for_upstream]" in stack
+            and any(frame.startswith("wait_for_upstream") for frame in stack)
+            and any(frame.startswith("sleep") for frame in stack)
+            for stack in task_stacks
+        )
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_loop_thread_samples_attributed_to_running_task(self, monkeypatch):
+        """Test that the loop thread's samples carry the running task's operation without asyncio calls."""
+        # Arrange
+        loop = asyncio.get_running_loop()
+        loop_thread_id = threading.get_ident()
+        sampler = StackSampler(interval=0.005, loop=loop, include_tasks=True)
+
+        def loop_thread_only(function):
+            def guarded(*args, **kwargs):
+                if threading.get_ident() != loop_thread_id:
+                    raise AssertionError("asyncio called from the sampler thread")
+                return function(*args, **kwargs)
+            return guarded
+
+        @trace_function("test_service.crunch_on_loop")
+        async def crunch_on_loop():
+            busy_wait(0.2)
+
+        # Act
+        sampler.start()
+        monkeypatch.setattr(asyncio, "all_tasks", loop_thread_only(asyncio.all_tasks))
+        monkeypatch.setattr(asyncio, "current_task", loop_thread_only(asyncio.current_task))
+        await asyncio.create_task(crunch_on_loop())
+        profile = sampler.stop()
+
+        # Assert
+        loop_thread = f"thread:{threading.current_thread().name}"
+        assert any(
+            stack[0] == loop_thread and "[test_service.crunch_on_loop]" in stack
+            and any(frame.startswith("busy_wait") for frame in stack)
+            for stack in profile.samples
+        )
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_only_one_session_at_a_time(self):
+        """Test that a concurrent profiling session is refused."""
+        # Arrange
+        first = asyncio.create_task(sample_for(0.1, interval=0.01))
+        await asyncio.sleep(0.02)
+
+        # Act / Assert
+        with pytest.raises(RuntimeError):
+            await sample_for(0.1)
+        await first
+        await sample_for(0.01)
+
+    @pytest.mark.unit
+    def test_speedscope_export(self):
+        """Test the speedscope document shape and shared frame table."""
+        # Arrange
+        sampler = StackSampler(interval=0.01)
+        sampler.profile.samples[("thread:main", "a (x.py:1)", "b (x.py:5)")] = 3
+        sampler.profile.samples[("thread:main", "a (x.py:1)")] = 1
+        sampler.profile.samples[("thread:io", "c (y.py:2)")] = 2
+
+        # Act
+        document = sampler.profile.to_speedscope(name="test")
+
+        # Assert
+        frames = [frame["name"] for frame in document["shared"]["frames"]]
+        assert sorted(frames) == ["a (x.py:1)", "b (x.py:5)", "c (y.py:2)"]
+        main = document["profiles"][0]
+        assert main["name"] == "thread:main"
+        assert main["type"] == "sampled"
+        assert [[frames[i] for i in sample] for sample in main["samples"]] == [
+            ["a (x.py:1)", "b (x.py:5)"], ["a (x.py:1)"]
+        ]
+        assert main["weights"] == pytest.approx([0.03, 0.01])
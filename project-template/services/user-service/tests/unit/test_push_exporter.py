@@ -0,0 +1,236 @@
+# Unit tests for the StatsD push exporter, run against a local UDP listener
+
+import logging
+import socket
+import threading
+import time
+
+import pytest
+
+from shared.monitoring.decorators import get_metrics_collector
+from shared.monitoring.exporters import StatsDExporter, pack_datagrams
+
+
+class UdpListener:
+    """Collects every datagram sent to a local UDP port."""
+
+    def __init__(self):
+        self.packets = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.settimeout(0.05)
+        self.port = self._socket.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._running = False
+        self._thread.join()
+        self._socket.close()
+
+    def _receive(self):
+        while self._running:
+            try:
+                self.packets.append(self._socket.recv(65535))
+            except socket.timeout:
+                continue
+
+    def wait_for(self, count: int, timeout: float = 2.0):
+        deadline = time.monotonic() + timeout
+        while len(self.packets) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def lines(self, prefix: str):
+        return [
+            line.decode()
+            for packet in self.packets
+            for line in packet.split(b"\n")
+            if line.startswith(prefix.encode())
+        ]
+
+    def counter_totals(self, prefix: str):
+        totals = {}
+        for line in self.lines(prefix):
+            name, rest = line.split(":", 1)
+            value, kind = rest.split("|")
+            if kind == "c":
+                totals[name] = totals.get(name, 0) + float(value)
+        return totals
+
+
+@pytest.fixture(autouse=True)
+def quiet_metrics_logging():
+    monitoring_logger = logging.getLogger("shared.monitoring")
+    previous_level = monitoring_logger.level
+    monitoring_logger.setLevel(logging.ERROR)
+    yield
+    monitoring_logger.setLevel(previous_level)
+
+
+class TestStatsDExporter:
+    """Test cases for StatsDExporter."""
+
+    @pytest.mark.unit
+    def test_counter_totals_and_packet_count_at_high_call_rate(self):
+        """Test that concurrent increments arrive as exact deltas in a handful of MTU-sized datagrams."""
+        # Arrange
+        metrics = get_metrics_collector("push_counters")
+        with UdpListener() as listener:
+            exporter = StatsDExporter(port=listener.port, prefix="cf", flush_interval=60, max_packet_size=1432)
+            exporter.start()
+
+            def hammer(worker: int):
+                for index in range(25000):
+                    metrics.increment_counter("requests", {"route": f"/r/{index % 50}"}, log=False)
+
+            # Act
+            threads = [threading.Thread(target=hammer, args=(worker,)) for worker in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            exporter.stop()
+            stats = exporter.get_stats()
+            listener.wait_for(stats["packets_sent"])
+
+        # Assert
+        totals = listener.counter_totals("cf.push_counters.")
+        assert sum(totals.values()) == 100000
+        assert len(totals) == 50
+        assert totals["cf.push_counters.requests.route__r_7"] == 2000
+        assert len(listener.packets) == stats["packets_sent"]
+        assert stats["packets_sent"] <= 3
+        assert all(len(packet) <= 1432 for packet in listener.packets)
+
+    @pytest.mark.unit
+    def test_deltas_across_flushes(self):
+        """Test that each flush sends only what was counted since the previous one."""
+        # Arrange
+        metrics = get_metrics_collector("push_deltas")
+        metrics.increment_counter("logins", log=False)
+        with UdpListener() as listener:
+            exporter = StatsDExporter(port=listener.port, flush_interval=60)
+            exporter.start()
+
+            # Act
+            for _ in range(3):
+                metrics.increment_counter("logins", log=False)
+            exporter.flush()
+            exporter.flush()
+            for _ in range(2):
+                metrics.increment_counter("logins", log=False)
+            exporter.stop()
+            listener.wait_for(2)
+
+        # Assert
+        assert listener.lines("push_deltas.") == ["push_deltas.logins:3|c", "push_deltas.logins:2|c"]
+
+    @pytest.mark.unit
+    def test_durations_aggregated_into_histogram_lines(self):
+        """Test that durations are summarised per interval instead of sent one by one."""
+        # Arrange
+        metrics = get_metrics_collector("push_timers")
+        with UdpListener() as listener:
+            exporter = StatsDExporter(port=listener.port, flush_interval=60)
+            exporter.start()
+
+            # Act
+            for index in range(1, 10001):
+                metrics.record_duration("query", index / 1_000_000)
+            exporter.stop()
+            listener.wait_for(1)
+
+        # Assert
+        lines = dict(line.split(":", 1) for line in listener.lines("push_timers."))
+        assert lines["push_timers.query.count"] == "10000|c"
+        assert lines["push_timers.query.min"] == "0.001|g"
+        assert lines["push_timers.query.max"] == "10.0|g"
+        assert float(lines["push_timers.query.sum"].split("|")[0]) == pytest.approx(50005.0)
+        assert 3.0 < float(lines["push_timers.query.p50"].split("|")[0]) < 7.0
+        assert len(listener.packets) == 1
+
+    @pytest.mark.unit
+    def test_overflow_folding_not_double_counted(self):
+        """Test that series folded into overflow by the cardinality guard are not pushed twice."""
+        # Arrange
+        metrics = get_metrics_collector("push_overflow")
+        metrics.cardinality.max_series = 10
+        metrics.cardinality.retain = 5
+        with UdpListener() as listener:
+            exporter = StatsDExporter(port=listener.port, flush_interval=60)
+            exporter.start()
+
+            # Act
+            for index in range(10):
+                metrics.increment_counter("errors", {"code": str(index)}, log=False)
+            exporter.flush()
+            for index in range(10, 40):
+                metrics.increment_counter("errors", {"code": str(index)}, log=False)
+            exporter.stop()
+            listener.wait_for(2)
+
+        # Assert
+        assert sum(listener.counter_totals("push_overflow.").values()) == 40
+
+    @pytest.mark.unit
+    def test_readmitted_series_not_double_counted(self):
+        """Test that a series folded into overflow and re-admitted in the same interval is pushed once."""
+        # Arrange
+        metrics = get_metrics_collector("push_readmitted")
+        metrics.cardinality.max_series = 4
+        metrics.cardinality.retain = 2
+        with UdpListener() as listener:
+            exporter = StatsDExporter(port=listener.port, flush_interval=60)
+            exporter.start()
+            for index in range(4):
+                for _ in range(index + 1):
+                    metrics.increment_counter("errors", {"code": str(index)}, log=False)
+            exporter.flush()
+
+            # Act
+            metrics.increment_counter("errors", {"code": "4"}, log=False)
+            metrics.increment_counter("errors", {"code": "5"}, log=False)
+            metrics.increment_counter("errors", {"code": "1"}, log=False)
+            exporter.stop()
+            listener.wait_for(2)
+
+        # Assert
+        totals = listener.counter_totals("push_readmitted.")
+        assert metrics.counters["push_readmitted.errors.code_1"] == 1
+        assert totals["push_readmitted.errors.code_1"] == 3
+        assert totals["push_readmitted.errors.__overflow__"] == 2
+        assert sum(totals.values()) == 13
+
+    @pytest.mark.unit
+    def test_pack_datagrams_respects_size_and_drops_oversized_lines(self):
+        """Test that lines are packed up to the size limit and lines that can never fit are dropped."""
+        # Arrange
+        lines = [f"metric.{index}:1|c" for index in range(100)] + ["x" * 600 + ":1|c"]
+
+        # Act
+        packets = pack_datagrams(lines, 512)
+
+        # Assert
+        assert all(len(packet) <= 512 for packet in packets)
+        assert sum(packet.count(b"\n") + 1 for packet in packets) == 100
+        assert len(packets) == 3
+
+    @pytest.mark.unit
+    def test_send_errors_counted_not_raised(self):
+        """Test that an unreachable agent is counted as a send error without raising."""
+        # Arrange
+        metrics = get_metrics_collector("push_errors")
+        exporter = StatsDExporter(host="256.0.0.1", port=8125, flush_interval=60)
+        exporter.start()
+        metrics.increment_counter("events", log=False)
+
+        # Act
+        exporter.stop()
+
+        # Assert
+        assert exporter.get_stats()["send_errors"] >= 1
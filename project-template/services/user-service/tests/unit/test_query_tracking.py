@@ -0,0 +1,163 @@
+# Unit tests for query fingerprinting and N+1 detection
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.middleware.metrics import MetricsMiddleware
+from shared.monitoring.decorators import MetricsCollector, database_operation
+from shared.monitoring.queries import OVERFLOW_FINGERPRINT, QueryTracker, fingerprint_sql, record_query
+
+
+class TestFingerprintSql:
+    """Test cases for SQL fingerprinting."""
+
+    @pytest.mark.unit
+    def test_literals_and_parameters_are_normalised(self):
+        """Test that statements differing only in values share a fingerprint."""
+        # Arrange
+        statements = [
+            "SELECT * FROM users WHERE id = 42 AND email = 'a@b.com'",
+            "select *  from users\n where id = 7 and email = 'it''s@x.io'",
+            "SELECT * FROM users WHERE id = $1 AND email = $2",
+            "SELECT * FROM users WHERE id = :id AND email = :email -- lookup",
+            "SELECT * FROM users WHERE id = %(id)s AND email = %s",
+        ]
+
+        # Act
+        fingerprints = {fingerprint_sql(statement) for statement in statements}
+
+        # Assert
+        assert fingerprints == {"select * from users where id = ? and email = ?"}
+
+    @pytest.mark.unit
+    def test_in_lists_and_values_collapse(self):
+        """Test that IN lists and multi-row VALUES collapse regardless of length."""
+        # Act
+        short_in = fingerprint_sql("SELECT id FROM roles WHERE user_id IN (1, 2)")
+        long_in = fingerprint_sql("SELECT id FROM roles WHERE user_id IN (1, 2, 3, 4, 5)")
+        values = fingerprint_sql("INSERT INTO audit (a, b) VALUES (1, 'x'), (2, 'y'), (3, 'z')")
+
+        # Assert
+        assert short_in == long_in == "select id from roles where user_id in (?+)"
+        assert values == "insert into audit (a, b) values (?+)"
+
+    @pytest.mark.unit
+    def test_casts_and_identifiers_are_preserved(self):
+        """Test that type casts and digits inside identifiers are not treated as values."""
+        # Act
+        fingerprint = fingerprint_sql("SELECT col1 FROM table2 WHERE id = '1'::uuid")
+
+        # Assert
+        assert fingerprint == "select col1 from table2 where id = ?::uuid"
+
+
+class TestQueryTracker:
+    """Test cases for QueryTracker."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_flags_repeated_fingerprint_as_n_plus_one(self):
+        """Test that a fingerprint executed more than the threshold in one request is flagged."""
+        # Arrange
+        tracker = QueryTracker(n_plus_one_threshold=3)
+        metrics = MetricsCollector("test_service")
+
+        # Act
+        token, profile = tracker.begin()
+        async with database_operation("users", "select", metrics, query="SELECT * FROM users LIMIT 10"):
+            pass
+        for role_id in range(5):
+            async with database_operation("roles", "select", metrics, query=f"SELECT * FROM roles WHERE id = {role_id}"):
+                pass
+        flagged = tracker.end(token, profile, route="GET /api/v1/users/")
+        summary = tracker.get_summary()
+
+        # Assert
+        assert flagged == ["select * from roles where id = ?"]
+        assert summary["requests_profiled"] == 1
+        assert summary["queries_per_request_max"] == 6
+        assert summary["n_plus_one"] == [{
+            "route": "GET /api/v1/users/",
+            "fingerprint": "select * from roles where id = ?",
+            "requests_flagged": 1,
+            "max_executions_per_request": 5
+        }]
+
+    @pytest.mark.unit
+    def test_top_fingerprints_ordered_by_total_time(self):
+        """Test that the summary ranks fingerprints by accumulated time."""
+        # Arrange
+        tracker = QueryTracker()
+
+        # Act
+        token, profile = tracker.begin()
+        record_query("select cheap", 1_000)
+        record_query("select cheap", 1_000)
+        record_query("select costly", 5_000_000)
+        tracker.end(token, profile)
+        summary = tracker.get_summary()
+
+        # Assert
+        assert [f["fingerprint"] for f in summary["top_fingerprints"]] == ["select costly", "select cheap"]
+        assert summary["top_fingerprints"][1]["executions"] == 2
+
+    @pytest.mark.unit
+    def test_fingerprints_capped(self):
+        """Test that fingerprints past the cap fold into the overflow fingerprint."""
+        # Arrange
+        tracker = QueryTracker(max_fingerprints=2)
+
+        # Act
+        token, profile = tracker.begin()
+        for index in range(5):
+            record_query(f"select {index}", 1_000)
+        tracker.end(token, profile)
+        summary = tracker.get_summary()
+
+        # Assert
+        fingerprints = {f["fingerprint"]: f["executions"] for f in summary["top_fingerprints"]}
+        assert len(fingerprints) == 3
+        assert fingerprints[OVERFLOW_FINGERPRINT] == 3
+
+    @pytest.mark.unit
+    def test_queries_outside_request_are_ignored(self):
+        """Test that queries with no open profile are not attributed anywhere."""
+        # Arrange
+        tracker = QueryTracker()
+
+        # Act
+        record_query("select 1", 1_000)
+
+        # Assert
+        assert tracker.get_summary()["top_fingerprints"] == []
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_middleware_attributes_queries_to_route_template(self):
+        """Test that the metrics middleware opens a profile per request and labels findings by route."""
+        # Arrange
+        tracker = QueryTracker(n_plus_one_threshold=2)
+        metrics = MetricsCollector("test_service")
+        test_app = FastAPI()
+        test_app.add_middleware(MetricsMiddleware, query_tracker=tracker)
+
+        @test_app.get("/api/v1/users/{user_id}")
+        async def get_user(user_id: str):
+            for _ in range(3):
+                async with database_operation("business_units", "select", metrics):
+                    pass
+            return {"id": user_id}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            await client.get("/api/v1/users/1")
+            await client.get("/api/v1/users/2")
+        summary = tracker.get_summary()
+
+        # Assert
+        assert summary["requests_profiled"] == 2
+        assert summary["queries_per_request_avg"] == 3
+        assert summary["n_plus_one"][0]["route"] == "GET /api/v1/users/{user_id}"
+        assert summary["n_plus_one"][0]["fingerprint"] == "select business_units"
+        assert summary["n_plus_one"][0]["requests_flagged"] == 2
@@ -0,0 +1,277 @@
+# Unit tests for identity-aware hierarchical quotas
+
+import json
+import os
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.middleware.quotas import JwtIdentityResolver, QuotaEngine
+from app.middleware.security import SecurityMiddleware
+
+BROWSER = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+
+POLICY = {
+    "route_classes": [{"name": "write", "methods": ["POST", "PUT", "PATCH", "DELETE"]}],
+    "default_route_class": "read",
+    "limits": {
+        "read": {"tenant": [5, 60], "user": [3, 60], "ip": [6, 60]},
+        "write": {"user": [1, 60]},
+    },
+    "tenants": {"enterprise": {"read": {"tenant": [100, 60], "user": [50, 60], "ip": [50, 60]}}},
+}
+
+# Bearer token -> (tenant_id, user_id), standing in for validated JWT claims
+TOKENS = {
+    "Bearer alice": ("acme", "alice"),
+    "Bearer bob": ("acme", "bob"),
+    "Bearer carol": ("globex", "carol"),
+    "Bearer dave": ("enterprise", "dave"),
+}
+
+
+def check_many(engine, identity, count, method="GET", client_ip="10.0.0.1"):
+    return [engine.check(client_ip, identity, method, "/api/v1/users", now=0) for _ in range(count)]
+
+
+class TestQuotaEngine:
+    """Test cases for QuotaEngine."""
+
+    @pytest.mark.unit
+    def test_user_limit_then_tenant_ceiling(self):
+        """Test that users are limited individually and together by their tenant's ceiling."""
+        # Arrange
+        engine = QuotaEngine(POLICY)
+
+        # Act
+        alice = check_many(engine, ("acme", "alice"), 4)
+        bob = check_many(engine, ("acme", "bob"), 3)
+        carol = check_many(engine, ("globex", "carol"), 1)
+
+        # Assert
+        assert [decision.allowed for decision in alice] == [True, True, True, False]
+        assert alice[-1].level == "user"
+        assert [decision.allowed for decision in bob] == [True, True, False]
+        assert bob[-1].level == "tenant"
+        assert carol[0].allowed is True
+        assert engine.get_stats()["rejected_by_level"] == {"tenant": 1, "user": 1, "ip": 0}
+
+    @pytest.mark.unit
+    def test_remaining_exact_at_large_monotonic_time(self):
+        """Test that remaining is not under-counted by float rounding when now is far from zero."""
+        # Arrange
+        engine = QuotaEngine({"limits": {"default": {"user": [100, 60]}}})
+
+        # Act
+        first = engine.check("10.0.0.1", ("acme", "alice"), "GET", "/api/v1/users", now=3.2e7)
+        second = engine.check("10.0.0.1", ("acme", "alice"), "GET", "/api/v1/users", now=3.2e7)
+
+        # Assert
+        assert first.remaining == 99
+        assert second.remaining == 98
+
+    @pytest.mark.unit
+    def test_rejected_request_consumes_no_quota(self):
+        """Test that a request refused at one level is not counted at the others."""
+        # Arrange
+        engine = QuotaEngine(POLICY)
+        check_many(engine, ("acme", "alice"), 3)
+
+        # Act
+        for _ in range(10):
+            engine.check("10.0.0.1", ("acme", "alice"), "GET", "/api/v1/users", now=0)
+        bob = check_many(engine, ("acme", "bob"), 2)
+
+        # Assert
+        assert all(decision.allowed for decision in bob)
+
+    @pytest.mark.unit
+    def test_route_classes_counted_separately(self):
+        """Test that exhausting the write quota leaves reads untouched."""
+        # Arrange
+        engine = QuotaEngine(POLICY)
+
+        # Act
+        writes = check_many(engine, ("acme", "alice"), 2, method="POST")
+        read = engine.check("10.0.0.1", ("acme", "alice"), "GET", "/api/v1/users", now=0)
+
+        # Assert
+        assert [decision.allowed for decision in writes] == [True, False]
+        assert writes[-1].route_class == "write"
+        assert read.allowed is True
+        assert read.route_class == "read"
+
+    @pytest.mark.unit
+    def test_anonymous_requests_limited_per_ip(self):
+        """Test that requests without a valid identity fall back to the IP quota."""
+        # Arrange
+        engine = QuotaEngine(POLICY)
+
+        # Act
+        first_ip = check_many(engine, None, 7, client_ip="10.0.0.1")
+        second_ip = check_many(engine, None, 1, client_ip="10.0.0.2")
+
+        # Assert
+        assert [decision.allowed for decision in first_ip] == [True] * 6 + [False]
+        assert first_ip[-1].level == "ip"
+        assert second_ip[0].allowed is True
+
+    @pytest.mark.unit
+    def test_authenticated_requests_also_limited_per_ip(self):
+        """Test that tenant, user and IP limits are all checked for an authenticated request."""
+        # Arrange
+        engine = QuotaEngine(POLICY)
+        check_many(engine, None, 5, client_ip="10.0.0.1")
+
+        # Act
+        alice = check_many(engine, ("acme", "alice"), 2, client_ip="10.0.0.1")
+        alice_elsewhere = check_many(engine, ("acme", "alice"), 1, client_ip="10.0.0.2")
+
+        # Assert
+        assert [decision.allowed for decision in alice] == [True, False]
+        assert alice[-1].level == "ip"
+        assert alice[0].level == "ip"
+        assert alice[0].remaining == 0
+        assert alice_elsewhere[0].allowed is True
+        assert alice_elsewhere[0].remaining == 1
+
+    @pytest.mark.unit
+    def test_tenant_overrides(self):
+        """Test that a tenant-specific limit replaces the default for that tenant only."""
+        # Arrange
+        engine = QuotaEngine(POLICY)
+
+        # Act
+        dave = check_many(engine, ("enterprise", "dave"), 20)
+
+        # Assert
+        assert all(decision.allowed for decision in dave)
+        assert dave[-1].limit == 50
+
+    @pytest.mark.unit
+    def test_policy_file_reloaded_when_changed(self, tmp_path):
+        """Test that edits to the policy file take effect without a restart."""
+        # Arrange
+        policy_path = tmp_path / "quotas.json"
+        policy_path.write_text(json.dumps(POLICY))
+        engine = QuotaEngine(policy_path=str(policy_path), reload_interval=0)
+        relaxed = {**POLICY, "limits": {"read": {"user": [1000, 60]}}}
+
+        # Act
+        before = check_many(engine, ("acme", "alice"), 4)
+        policy_path.write_text(json.dumps(relaxed))
+        os.utime(policy_path, (1, 1))
+        after = check_many(engine, ("acme", "alice"), 10)
+        policy_path.write_text("{not json")
+        os.utime(policy_path, (2, 2))
+        still_relaxed = check_many(engine, ("acme", "alice"), 1)
+
+        # Assert
+        assert before[-1].allowed is False
+        assert all(decision.allowed for decision in after)
+        assert still_relaxed[0].allowed is True
+        assert engine.get_stats()["policy_reloads"] == 1
+
+    @pytest.mark.unit
+    def test_invalid_policy_rejected(self):
+        """Test that unknown levels and non-positive limits are refused on reload."""
+        # Arrange
+        engine = QuotaEngine(POLICY)
+
+        # Act / Assert
+        with pytest.raises(ValueError):
+            engine.reload({"limits": {"read": {"org": [10, 60]}}})
+        with pytest.raises(ValueError):
+            engine.reload({"limits": {"read": {"user": [0, 60]}}})
+        assert engine.policy.limits["read"]["user"] == (3, 60.0)
+
+    @pytest.mark.unit
+    def test_jwt_identity_resolver(self):
+        """Test that tenant and user come from validated claims and bad tokens are anonymous."""
+        # Arrange
+        jwt = pytest.importorskip("jose").jwt
+        resolver = JwtIdentityResolver("test-secret-key", "HS256")
+        token = jwt.encode({"sub": "a@example.com", "user_id": "42", "tenant_id": "acme"}, "test-secret-key")
+        forged = jwt.encode({"sub": "a@example.com", "user_id": "42", "tenant_id": "acme"}, "wrong-key")
+
+        # Act / Assert
+        assert resolver(f"Bearer {token}") == ("acme", "42")
+        assert resolver(f"Bearer {token}") == ("acme", "42")
+        assert resolver(f"Bearer {forged}") is None
+        assert resolver(f"Basic {token}") is None
+        assert resolver.invalid_tokens == 1
+
+
+class TestSecurityMiddlewareQuotas:
+    """Test cases for quotas and RateLimit headers in SecurityMiddleware."""
+
+    @staticmethod
+    def create_test_app(**middleware_kwargs) -> FastAPI:
+        test_app = FastAPI()
+        test_app.add_middleware(SecurityMiddleware, **middleware_kwargs)
+
+        @test_app.get("/api/v1/users")
+        async def list_users():
+            return []
+
+        return test_app
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_users_behind_one_address_limited_separately(self):
+        """Test that users sharing an IP get their own quotas and RateLimit headers."""
+        # Arrange
+        engine = QuotaEngine(POLICY, identity_resolver=TOKENS.get)
+        test_app = self.create_test_app(quota_engine=engine)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            alice = [
+                await client.get("/api/v1/users", headers={**BROWSER, "authorization": "Bearer alice"})
+                for _ in range(4)
+            ]
+            carol = await client.get("/api/v1/users", headers={**BROWSER, "authorization": "Bearer carol"})
+
+        # Assert
+        assert [response.status_code for response in alice] == [200, 200, 200, 429]
+        assert alice[0].headers["ratelimit-limit"] == "3"
+        assert alice[0].headers["ratelimit-remaining"] == "2"
+        assert alice[0].headers["ratelimit-policy"] == "3;w=60"
+        assert alice[-1].headers["ratelimit-remaining"] == "0"
+        assert int(alice[-1].headers["retry-after"]) > 0
+        assert carol.status_code == 200
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_ip_limiter_sends_ratelimit_headers(self):
+        """Test that the default per-IP limiter also reports RateLimit headers."""
+        # Arrange
+        test_app = self.create_test_app(max_requests_per_minute=10)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            response = await client.get("/api/v1/users", headers=BROWSER)
+
+        # Assert
+        assert response.headers["ratelimit-limit"] == "10"
+        assert response.headers["ratelimit-remaining"] == "9"
+        assert response.headers["ratelimit-policy"] == "10;w=60"
+
+    @pytest.mark.unit
+    def test_forwarded_for_only_trusted_from_proxies(self):
+        """Test that X-Forwarded-For hops are believed only when added by trusted proxies."""
+        # Arrange
+        middleware = SecurityMiddleware(None, trusted_proxies=["10.0.0.0/8"])
+
+        def client_ip(peer, forwarded_for):
+            request = type("FakeRequest", (), {})()
+            request.client = type("Client", (), {"host": peer})()
+            request.headers = {"x-forwarded-for": forwarded_for}
+            return middleware._get_client_ip(request)
+
+        # Act / Assert
+        assert client_ip("203.0.113.9", "1.2.3.4") == "203.0.113.9"
+        assert client_ip("10.0.0.5", "1.2.3.4, 198.51.100.7") == "198.51.100.7"
+        assert client_ip("10.0.0.5", "198.51.100.7, 10.1.1.1") == "198.51.100.7"
+        assert client_ip("10.0.0.5", "") == "10.0.0.5"
@@ -0,0 +1,147 @@
+# Unit tests for the GCRA rate limiter and its use in SecurityMiddleware
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.middleware.rate_limit import GcraRateLimiter
+from app.middleware.security import SecurityMiddleware
+
+
+def create_test_app(**middleware_kwargs) -> FastAPI:
+    """Create a small app wrapped in SecurityMiddleware."""
+    test_app = FastAPI()
+    test_app.add_middleware(SecurityMiddleware, **middleware_kwargs)
+
+    @test_app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return test_app
+
+
+class TestGcraRateLimiter:
+    """Test cases for GcraRateLimiter."""
+
+    @pytest.mark.unit
+    def test_burst_then_steady_rate(self):
+        """Test that a full burst is allowed, then one request per emission interval."""
+        # Arrange
+        limiter = GcraRateLimiter(limit=10, window=60)
+
+        # Act
+        burst = [limiter.check("10.0.0.1", now=100.0).allowed for _ in range(11)]
+        blocked = limiter.check("10.0.0.1", now=100.0)
+        too_early = limiter.check("10.0.0.1", now=105.9)
+        on_time = limiter.check("10.0.0.1", now=106.0)
+
+        # Assert
+        assert burst == [True] * 10 + [False]
+        assert blocked.retry_after == pytest.approx(6.0)
+        assert too_early.allowed is False
+        assert on_time.allowed is True
+        assert on_time.remaining == 0
+
+    @pytest.mark.unit
+    def test_remaining_and_reset(self):
+        """Test that remaining counts down and reset_after covers the used quota."""
+        # Arrange
+        limiter = GcraRateLimiter(limit=100, window=60)
+
+        # Act
+        first = limiter.check("10.0.0.1", now=0.0)
+        for _ in range(9):
+            tenth = limiter.check("10.0.0.1", now=0.0)
+        later = limiter.check("10.0.0.1", now=60.0)
+
+        # Assert
+        assert first.remaining == 99
+        assert tenth.remaining == 90
+        assert tenth.reset_after == pytest.approx(6.0)
+        assert later.remaining == 99
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("now", [12345.678, 1.7e6, 3.2e7, 8.64e8])
+    def test_remaining_exact_at_large_monotonic_times(self, now):
+        """Test that float rounding in TATs far from zero does not drop a request from remaining."""
+        # Arrange
+        limiter = GcraRateLimiter(limit=100, window=60)
+
+        # Act
+        first = limiter.check("10.0.0.1", now=now)
+        second = limiter.check("10.0.0.1", now=now)
+
+        # Assert
+        assert first.remaining == 99
+        assert second.remaining == 98
+
+    @pytest.mark.unit
+    def test_keys_are_independent(self):
+        """Test that one client's exhaustion does not affect another."""
+        # Arrange
+        limiter = GcraRateLimiter(limit=2, window=60)
+
+        # Act
+        for _ in range(3):
+            limiter.check("10.0.0.1", now=0.0)
+
+        # Assert
+        assert limiter.check("10.0.0.1", now=0.0).allowed is False
+        assert limiter.check("10.0.0.2", now=0.0).allowed is True
+
+    @pytest.mark.unit
+    def test_idle_keys_expire(self):
+        """Test that keys whose quota has fully replenished are dropped as new clients arrive."""
+        # Arrange
+        limiter = GcraRateLimiter(limit=100, window=60)
+        for index in range(1000):
+            limiter.check(f"10.0.{index // 256}.{index % 256}", now=0.0)
+
+        # Act
+        for index in range(1000):
+            limiter.check(f"192.168.{index // 256}.{index % 256}", now=120.0)
+
+        # Assert
+        assert len(limiter) == 1000
+        assert limiter.get_stats()["expired_keys"] == 1000
+        assert limiter.get_stats()["evicted_keys"] == 0
+
+    @pytest.mark.unit
+    def test_memory_cap_evicts_least_recent(self):
+        """Test that max_keys bounds tracked clients and evicts the least recently seen first."""
+        # Arrange
+        limiter = GcraRateLimiter(limit=1, window=60, max_keys=100)
+        limiter.check("hot", now=0.0)
+
+        # Act
+        for index in range(500):
+            limiter.check(f"client-{index}", now=1.0)
+            if index % 50 == 0:
+                limiter.check("hot", now=1.0)
+
+        # Assert
+        assert len(limiter) == 100
+        assert limiter.get_stats()["evicted_keys"] == 401
+        assert limiter.check("hot", now=1.0).allowed is False
+
+
+class TestSecurityMiddlewareRateLimit:
+    """Test cases for rate limiting in SecurityMiddleware."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_429_with_retry_after(self):
+        """Test that requests past the limit get 429 with a Retry-After derived from the limiter."""
+        # Arrange
+        test_app = create_test_app(max_requests_per_minute=3, rate_limit_window=60)
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            statuses = [(await client.get("/ping")).status_code for _ in range(3)]
+            limited = await client.get("/ping")
+
+        # Assert
+        assert statuses == [200, 200, 200]
+        assert limited.status_code == 429
+        assert limited.headers["retry-after"] == "20"
+        assert limited.headers["x-content-type-options"] == "nosniff"
@@ -0,0 +1,302 @@
+# Unit tests for outbound call resilience, run against a local latency-injecting stub server
+
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import pytest
+
+from shared.monitoring.decorators import MetricsCollector, external_service_call
+from shared.monitoring.resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    MAX_POLICIES,
+    BulkheadFullError,
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilienceConfig,
+    configure_endpoint,
+    get_policy,
+    get_resilience_stats,
+    reset_policies,
+)
+
+
+class StubServer:
+    """Minimal HTTP/1.1 server; ``?delay=<seconds>&status=<code>`` shape each response."""
+
+    def __init__(self):
+        self.requests = 0
+        self._server = None
+        self._handlers = set()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                self.requests += 1
+                query = parse_qs(urlsplit(request_line.split()[1].decode()).query)
+                await asyncio.sleep(float(query.get("delay", ["0"])[0]))
+                status = int(query.get("status", ["200"])[0])
+                writer.write(
+                    f"HTTP/1.1 {status} X\r\ncontent-length: 2\r\ncontent-type: text/plain\r\n\r\nok".encode()
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+async def call_stub(client, metrics, delay=0.0, status=200, endpoint="/api/v1/forms"):
+    """Call the stub through external_service_call, raising on 5xx like real callers do."""
+    async with external_service_call("form-service", endpoint, metrics, resilient=True):
+        response = await client.get(f"/forms?delay={delay}&status={status}")
+        response.raise_for_status()
+        return response
+
+
+@pytest.fixture(autouse=True)
+def isolated_policies():
+    reset_policies()
+    yield
+    reset_policies()
+
+
+class TestCircuitBreaker:
+    """Test cases for CircuitBreaker."""
+
+    @pytest.mark.unit
+    def test_opens_then_half_opens_after_recovery_timeout(self):
+        """Test the closed -> open -> half-open -> closed cycle."""
+        # Arrange
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.05, half_open_max_calls=1)
+
+        # Act / Assert
+        breaker.record_failure()
+        assert breaker.state == CIRCUIT_CLOSED
+        breaker.record_failure()
+        assert breaker.state == CIRCUIT_OPEN
+        assert breaker.allow() is False
+
+        breaker.opened_at -= 0.1
+        assert breaker.allow() is True
+        assert breaker.state == CIRCUIT_HALF_OPEN
+        assert breaker.allow() is False
+
+        breaker.record_success()
+        assert breaker.state == CIRCUIT_CLOSED
+
+
+class TestExternalServiceCallResilience:
+    """Test cases for the resilience layer in external_service_call."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_adaptive_timeout_tracks_latency(self):
+        """Test that the timeout tightens to a multiple of the observed p99 and cancels slow calls."""
+        # Arrange
+        configure_endpoint("form-service", "/api/v1/forms", ResilienceConfig(
+            min_samples=10, min_timeout=0.05, max_timeout=5.0, timeout_multiplier=3.0
+        ))
+        metrics = MetricsCollector("test_service")
+
+        async with StubServer() as stub, httpx.AsyncClient(base_url=stub.base_url) as client:
+            # Act
+            for _ in range(10):
+                await call_stub(client, metrics, delay=0.01)
+            policy = get_policy("form-service", "/api/v1/forms")
+            timeout = policy.timeout
+
+            # Assert
+            assert 0.05 <= timeout < 0.5
+            with pytest.raises(TimeoutError):
+                await call_stub(client, metrics, delay=1.0)
+            assert policy.timeouts == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_circuit_opens_on_failures_and_recovers(self):
+        """Test that repeated 5xx responses open the circuit and a healthy probe closes it."""
+        # Arrange
+        configure_endpoint("form-service", "/api/v1/forms", ResilienceConfig(
+            failure_threshold=3, recovery_timeout=0.1
+        ))
+        metrics = MetricsCollector("test_service")
+
+        async with StubServer() as stub, httpx.AsyncClient(base_url=stub.base_url) as client:
+            # Act
+            for _ in range(3):
+                with pytest.raises(httpx.HTTPStatusError):
+                    await call_stub(client, metrics, status=503)
+            requests_before = stub.requests
+            with pytest.raises(CircuitOpenError):
+                await call_stub(client, metrics)
+            requests_while_open = stub.requests - requests_before
+
+            await asyncio.sleep(0.15)
+            await call_stub(client, metrics)
+
+            # Assert
+            assert requests_while_open == 0
+            assert get_policy("form-service", "/api/v1/forms").breaker.state == CIRCUIT_CLOSED
+            assert metrics.counters[
+                "test_service.external_service_rejected.service_form-service.endpoint_/api/v1/forms.reason_circuit open"
+            ] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_bulkhead_rejects_excess_concurrency(self):
+        """Test that calls beyond max_concurrent are rejected instead of piling up."""
+        # Arrange
+        configure_endpoint("form-service", "/api/v1/forms", ResilienceConfig(max_concurrent=2, max_wait=0.02))
+        metrics = MetricsCollector("test_service")
+
+        async with StubServer() as stub, httpx.AsyncClient(base_url=stub.base_url) as client:
+            # Act
+            results = await asyncio.gather(
+                *(call_stub(client, metrics, delay=0.2) for _ in range(4)),
+                return_exceptions=True
+            )
+
+            # Assert
+            rejected = [r for r in results if isinstance(r, BulkheadFullError)]
+            assert len(rejected) == 2
+            assert stub.requests == 2
+            assert get_policy("form-service", "/api/v1/forms").in_flight == 0
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_hedged_request_beats_slow_attempt(self):
+        """Test that a hedge fired after the p95 returns before a stalled first attempt."""
+        # Arrange
+        configure_endpoint("form-service", "/api/v1/forms", ResilienceConfig(
+            min_samples=5, hedge=True, max_hedge_ratio=1.0
+        ))
+        metrics = MetricsCollector("test_service")
+        delays = iter([0.01] * 5 + [1.0, 0.01])
+
+        async with StubServer() as stub, httpx.AsyncClient(base_url=stub.base_url) as client:
+            for _ in range(5):
+                async with external_service_call("form-service", "/api/v1/forms", metrics, resilient=True) as call:
+                    await call.hedge(lambda: client.get(f"/forms?delay={next(delays)}"))
+
+            # Act
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            async with external_service_call("form-service", "/api/v1/forms", metrics, resilient=True) as call:
+                response = await call.hedge(lambda: client.get(f"/forms?delay={next(delays)}"))
+            elapsed = loop.time() - started
+
+            # Assert
+            assert response.status_code == 200
+            assert call.hedged is True
+            assert elapsed < 0.5
+            assert get_policy("form-service", "/api/v1/forms").hedged_calls == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_policies_keyed_by_service_and_endpoint(self):
+        """Test that an open circuit on one endpoint does not affect another."""
+        # Arrange
+        configure_endpoint("form-service", "/api/v1/forms", ResilienceConfig(failure_threshold=1))
+        metrics = MetricsCollector("test_service")
+
+        async with StubServer() as stub, httpx.AsyncClient(base_url=stub.base_url) as client:
+            # Act
+            with pytest.raises(httpx.HTTPStatusError):
+                await call_stub(client, metrics, status=500)
+            response = await call_stub(client, metrics, endpoint="/api/v1/templates")
+
+            # Assert
+            assert get_policy("form-service", "/api/v1/forms").breaker.state == CIRCUIT_OPEN
+            assert response.status_code == 200
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_client_errors_do_not_open_circuit(self):
+        """Test that 4xx responses and errors from the caller's own code are not service failures."""
+        # Arrange
+        configure_endpoint("form-service", "/api/v1/forms", ResilienceConfig(failure_threshold=2))
+        metrics = MetricsCollector("test_service")
+
+        async with StubServer() as stub, httpx.AsyncClient(base_url=stub.base_url) as client:
+            # Act
+            for _ in range(3):
+                with pytest.raises(httpx.HTTPStatusError):
+                    await call_stub(client, metrics, status=404)
+            for _ in range(3):
+                with pytest.raises(ValueError):
+                    async with external_service_call("form-service", "/api/v1/forms", metrics, resilient=True):
+                        # The stub answers with plain text
+                        (await client.get("/forms")).json()
+
+            # Assert
+            assert get_policy("form-service", "/api/v1/forms").breaker.state == CIRCUIT_CLOSED
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_connection_errors_open_circuit(self):
+        """Test that transport failures count against the breaker."""
+        # Arrange
+        configure_endpoint("form-service", "/api/v1/forms", ResilienceConfig(failure_threshold=2))
+        metrics = MetricsCollector("test_service")
+
+        async with StubServer() as stub:
+            base_url = stub.base_url
+
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            # Act
+            for _ in range(2):
+                with pytest.raises(httpx.ConnectError):
+                    await call_stub(client, metrics)
+
+        # Assert
+        assert get_policy("form-service", "/api/v1/forms").breaker.state == CIRCUIT_OPEN
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_resilience_is_opt_in(self):
+        """Test that calls without resilient=True create no policy."""
+        # Arrange
+        metrics = MetricsCollector("test_service")
+
+        # Act
+        async with external_service_call("form-service", "/api/v1/forms", metrics):
+            pass
+
+        # Assert
+        assert get_resilience_stats() == []
+
+    @pytest.mark.unit
+    def test_policy_count_is_bounded(self):
+        """Test that caller-supplied endpoints cannot grow the policy map without bound."""
+        # Arrange
+        first = get_policy("form-service", "/api/v1/forms")
+
+        # Act
+        for i in range(MAX_POLICIES + 10):
+            get_policy("form-service", f"/api/v1/forms/{i}")
+
+        # Assert
+        assert len(get_resilience_stats()) == MAX_POLICIES
+        assert get_policy("form-service", "/api/v1/forms") is not first
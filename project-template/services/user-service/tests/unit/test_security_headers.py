@@ -0,0 +1,111 @@
+# Unit tests for raw security header injection and pre-rendered rejections
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from httpx import AsyncClient
+from starlette.responses import JSONResponse
+
+from app.middleware.security import REJECTION_ERRORS, SecurityMiddleware, append_raw_headers
+
+BROWSER = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+
+
+def create_test_app(**middleware_kwargs) -> FastAPI:
+    test_app = FastAPI()
+    test_app.add_middleware(SecurityMiddleware, **middleware_kwargs)
+
+    @test_app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @test_app.get("/framed")
+    async def framed():
+        return PlainTextResponse("embeddable", headers={"X-Frame-Options": "SAMEORIGIN", "X-App": "1"})
+
+    return test_app
+
+
+class TestSecurityHeaders:
+    """Test cases for security headers and rejections in SecurityMiddleware."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_headers_added_once_and_override_application(self):
+        """Test that every security header appears exactly once, replacing the application's own."""
+        # Arrange
+        test_app = create_test_app()
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            ping = await client.get("/ping", headers=BROWSER)
+            framed = await client.get("/framed", headers=BROWSER)
+
+        # Assert
+        for response in (ping, framed):
+            assert response.headers.get_list("x-frame-options") == ["DENY"]
+            assert response.headers["strict-transport-security"] == "max-age=31536000; includeSubDomains"
+        assert framed.headers["x-app"] == "1"
+        assert framed.text == "embeddable"
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_rejections_match_json_response(self):
+        """Test that each pre-rendered rejection has the same body and headers JSONResponse produced."""
+        # Arrange
+        middleware = SecurityMiddleware(None)
+
+        async def capture(respond):
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await respond(send)
+            return messages
+
+        for status, error in REJECTION_ERRORS.items():
+            # Act
+            expected = await capture(
+                lambda send: JSONResponse({"error": error}, status, middleware.security_headers)({}, None, send)
+            )
+            actual = await capture(lambda send: middleware._reject(send, status))
+
+            # Assert
+            assert actual[0]["status"] == status
+            assert sorted(actual[0]["headers"]) == sorted(expected[0]["headers"])
+            assert actual[1]["body"] == expected[1]["body"]
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_rejection_header_blocks_not_shared(self):
+        """Test that outer middleware appending to a rejection's headers cannot alter the next one."""
+        # Arrange
+        middleware = SecurityMiddleware(None)
+        sent = []
+
+        async def appending_send(message):
+            if message["type"] == "http.response.start":
+                message["headers"].append((b"x-request-id", b"abc"))
+                sent.append(message["headers"])
+
+        # Act
+        await middleware._reject(appending_send, 403)
+        await middleware._reject(appending_send, 403)
+
+        # Assert
+        assert sent[1].count((b"x-request-id", b"abc")) == 1
+
+    @pytest.mark.unit
+    def test_append_raw_headers(self):
+        """Test that conflicting names are replaced and others kept in order."""
+        # Arrange
+        app_headers = [(b"content-type", b"text/plain"), (b"x-frame-options", b"SAMEORIGIN")]
+        ours = [(b"x-frame-options", b"DENY")]
+
+        # Act
+        combined = append_raw_headers(app_headers, ours, frozenset({b"x-frame-options"}))
+
+        # Assert
+        assert combined == [(b"content-type", b"text/plain"), (b"x-frame-options", b"DENY")]
+        assert app_headers[1] == (b"x-frame-options", b"SAMEORIGIN")
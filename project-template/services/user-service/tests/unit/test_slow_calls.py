@@ -0,0 +1,121 @@
+# Unit tests for the slow-call recorder
+
+import asyncio
+
+import pytest
+
+from shared.monitoring.decorators import MetricsCollector, database_operation, trace_function
+from shared.monitoring.slow_calls import SlowCallRecorder, argument_shape, slow_call_recorder
+
+
+@pytest.fixture(autouse=True)
+def clean_recorder():
+    slow_call_recorder.clear()
+    slow_call_recorder.thresholds.clear()
+    yield
+    slow_call_recorder.clear()
+    slow_call_recorder.thresholds.clear()
+
+
+class TestArgumentShape:
+    """Test cases for argument_shape."""
+
+    @pytest.mark.unit
+    def test_shapes_hide_values(self):
+        """Test that shapes describe type and size but never contents."""
+        # Act
+        shapes = [
+            argument_shape("secret-password"),
+            argument_shape(42),
+            argument_shape({"email": "a@b.com", "role": "admin"}),
+            argument_shape([{"id": 1}, {"id": 2}, {"id": 3}]),
+            argument_shape(None),
+            argument_shape(MetricsCollector("svc")),
+        ]
+
+        # Assert
+        assert shapes == ["str[15]", "int", "dict[2]", "list[3]<dict[1]>", "NoneType", "MetricsCollector"]
+
+
+class TestSlowCallRecorder:
+    """Test cases for slow-call recording through trace_function."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_slow_call_keeps_shapes_span_tree_and_task_stack(self):
+        """Test that a call over threshold records argument shapes, child spans and the suspended stack."""
+        # Arrange
+        metrics = MetricsCollector("test_service")
+
+        @trace_function("test_service.load_user", slow_threshold=0.02)
+        async def load_user(user_id: str, include_roles: bool = False):
+            async with database_operation("users", "select", metrics):
+                await asyncio.sleep(0.05)
+            return {"id": user_id}
+
+        # Act
+        await load_user("3f1c9a2e", include_roles=True)
+        calls = slow_call_recorder.get_slow_calls()
+
+        # Assert
+        assert len(calls) == 1
+        call = calls[0]
+        assert call["operation"] == "test_service.load_user"
+        assert call["args"] == ["str[8]"]
+        assert call["kwargs"] == {"include_roles": "bool"}
+        assert call["span_tree"]["name"] == "test_service.load_user"
+        assert call["span_tree"]["children"][0]["name"] == "db.select users"
+        assert call["span_tree"]["children"][0]["duration_ms"] >= 40
+        assert any("load_user" in frame for frame in call["task_stack"])
+        assert any(frame.startswith("sleep") for frame in call["task_stack"])
+        assert "3f1c9a2e" not in str(call)
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_fast_calls_not_recorded(self):
+        """Test that calls under the operation threshold are discarded."""
+        # Arrange
+        slow_call_recorder.set_threshold("test_service.fast", 0.5)
+
+        @trace_function("test_service.fast")
+        async def fast():
+            await asyncio.sleep(0)
+
+        # Act
+        await fast()
+
+        # Assert
+        assert slow_call_recorder.get_slow_calls() == []
+
+    @pytest.mark.unit
+    def test_sync_calls_and_errors_recorded(self):
+        """Test that sync functions are recorded with the error type and no task stack."""
+        # Arrange
+        @trace_function("test_service.parse", slow_threshold=0)
+        def parse(payload):
+            raise ValueError("bad payload")
+
+        # Act
+        with pytest.raises(ValueError):
+            parse(b"raw bytes")
+        calls = slow_call_recorder.get_slow_calls()
+
+        # Assert
+        assert calls[0]["error"] == "ValueError"
+        assert calls[0]["args"] == ["bytes[9]"]
+        assert calls[0]["task_stack"] is None
+
+    @pytest.mark.unit
+    def test_buffer_keeps_slowest_calls_slowest_first(self):
+        """Test that the buffer keeps the slowest calls, not the most recent, and returns them slowest first."""
+        # Arrange
+        recorder = SlowCallRecorder(capacity=3, default_threshold=0)
+
+        # Act
+        for duration in (0.5, 0.1, 0.3, 0.2) + (0.15,) * 10:
+            watch = recorder.begin("test_service.op", (), {})
+            recorder.end(watch, duration)
+
+        # Assert
+        assert [call["duration_ms"] for call in recorder.get_slow_calls()] == [500.0, 300.0, 200.0]
+        assert [call["duration_ms"] for call in recorder.get_slow_calls(limit=1)] == [500.0]
@@ -0,0 +1,256 @@
+# Unit tests for per-tenant usage metering
+
+import asyncio
+import json
+import threading
+
+import pytest
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.pipeline import RequestPipeline
+from app.middleware.quotas import QuotaEngine
+from app.middleware.security import SecurityMiddleware
+from shared.monitoring import metering
+from shared.monitoring.decorators import MetricsCollector, database_operation, external_service_call
+from shared.monitoring.metering import (
+    ANONYMOUS_TENANT,
+    CpuShareClock,
+    JsonLinesUsageSink,
+    UsageMeter,
+    set_current_tenant,
+)
+
+
+class TestUsageMeter:
+    """Test cases for UsageMeter."""
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_attributes_db_and_external_time_to_tenant(self):
+        """Test that monitored DB and outbound calls accrue to the current tenant."""
+        # Arrange
+        meter = UsageMeter()
+        metrics = MetricsCollector("test_service")
+
+        # Act
+        token, usage = meter.begin()
+        set_current_tenant("tenant-a")
+        async with database_operation("users", "select", metrics):
+            await asyncio.sleep(0.01)
+        async with external_service_call("form-service", "/api/v1/forms", metrics):
+            await asyncio.sleep(0.02)
+        meter.end(token, usage, wall_time=0.05)
+        rollups = meter.flush()
+
+        # Assert
+        assert len(rollups) == 1
+        rollup = rollups[0]
+        assert rollup["tenant_id"] == "tenant-a"
+        assert rollup["requests"] == 1
+        assert rollup["db_calls"] == 1
+        assert rollup["db_time_ms"] >= 10
+        assert rollup["external_calls"] == 1
+        assert rollup["external_time_ms"] >= 20
+        assert rollup["wall_time_ms"] == 50
+
+    @pytest.mark.unit
+    def test_unattributed_requests_roll_up_as_anonymous(self):
+        """Test that requests without a tenant are still counted."""
+        # Arrange
+        meter = UsageMeter()
+
+        # Act
+        for _ in range(3):
+            token, usage = meter.begin()
+            meter.end(token, usage, wall_time=0.001)
+        rollups = meter.flush()
+
+        # Assert
+        assert rollups[0]["tenant_id"] == ANONYMOUS_TENANT
+        assert rollups[0]["requests"] == 3
+        assert meter.flush() == []
+
+    @pytest.mark.unit
+    def test_stop_flushes_to_json_lines_sink(self, tmp_path):
+        """Test that stopping the meter writes pending rollups to the sink."""
+        # Arrange
+        path = tmp_path / "usage.jsonl"
+        meter = UsageMeter(sink=JsonLinesUsageSink(str(path)), flush_interval=60)
+        meter.start()
+        for tenant in ("tenant-a", "tenant-b", "tenant-a"):
+            token, usage = meter.begin()
+            meter.end(token, usage, wall_time=0.01, tenant_id=tenant)
+
+        # Act
+        meter.stop()
+
+        # Assert
+        rollups = {row["tenant_id"]: row for row in map(json.loads, path.read_text().splitlines())}
+        assert rollups["tenant-a"]["requests"] == 2
+        assert rollups["tenant-b"]["requests"] == 1
+
+    @pytest.mark.unit
+    def test_usage_ended_on_other_threads_flushed_once(self):
+        """Test that each thread's totals are rolled up, and a window only reports new usage."""
+        # Arrange
+        meter = UsageMeter()
+
+        def serve(count):
+            for _ in range(count):
+                token, usage = meter.begin()
+                meter.end(token, usage, wall_time=0.001, tenant_id="tenant-a")
+
+        # Act
+        workers = [threading.Thread(target=serve, args=(100,)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        first = meter.flush()
+        serve(5)
+        second = meter.flush()
+
+        # Assert
+        assert first[0]["requests"] == 400
+        assert second[0]["requests"] == 5
+        assert second[0]["wall_time_ms"] == pytest.approx(5)
+        assert meter.flush() == []
+
+    @pytest.mark.unit
+    def test_json_lines_sink_resolves_relative_path(self, tmp_path, monkeypatch):
+        """Test that the sink's path is fixed at construction and its directory created on write."""
+        # Arrange
+        monkeypatch.chdir(tmp_path)
+        sink = JsonLinesUsageSink("usage/rollups.jsonl")
+        monkeypatch.chdir("/")
+
+        # Act
+        sink([{"tenant_id": "tenant-a", "requests": 1}])
+
+        # Assert
+        assert sink.path == str(tmp_path / "usage" / "rollups.jsonl")
+        assert json.loads((tmp_path / "usage" / "rollups.jsonl").read_text())["requests"] == 1
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_metrics_middleware_reads_tenant_from_request_state(self):
+        """Test that the middleware attributes requests using request.state.tenant_id."""
+        # Arrange
+        meter = UsageMeter()
+        test_app = FastAPI()
+        test_app.add_middleware(MetricsMiddleware, usage_meter=meter)
+
+        @test_app.get("/whoami")
+        async def whoami(request: Request):
+            request.state.tenant_id = request.headers["x-tenant"]
+            return {}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            await client.get("/whoami", headers={"x-tenant": "tenant-a"})
+            await client.get("/whoami", headers={"x-tenant": "tenant-b"})
+            await client.get("/whoami", headers={"x-tenant": "tenant-b"})
+        rollups = {row["tenant_id"]: row for row in meter.flush()}
+
+        # Assert
+        assert rollups["tenant-a"]["requests"] == 1
+        assert rollups["tenant-b"]["requests"] == 2
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_pipeline_meters_tenant_of_validated_token(self):
+        """Test that the security stage's resolved identity reaches the usage meter through the pipeline."""
+        # Arrange
+        meter = UsageMeter()
+        tokens = {"Bearer alice": ("acme", "alice"), "Bearer carol": ("globex", "carol")}
+        policy = {"limits": {"default": {"tenant": [100, 60], "ip": [100, 60]}}}
+        test_app = FastAPI()
+        test_app.add_middleware(
+            RequestPipeline,
+            security=SecurityMiddleware(None, quota_engine=QuotaEngine(policy, identity_resolver=tokens.get)),
+            metrics=MetricsMiddleware(None, usage_meter=meter)
+        )
+
+        @test_app.get("/api/v1/users")
+        async def list_users():
+            return []
+
+        browser = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            await client.get("/api/v1/users", headers={**browser, "authorization": "Bearer alice"})
+            await client.get("/api/v1/users", headers={**browser, "authorization": "Bearer alice"})
+            await client.get("/api/v1/users", headers={**browser, "authorization": "Bearer carol"})
+            await client.get("/api/v1/users", headers={**browser, "authorization": "Bearer forged"})
+        rollups = {row["tenant_id"]: row for row in meter.flush()}
+
+        # Assert
+        assert rollups["acme"]["requests"] == 2
+        assert rollups["globex"]["requests"] == 1
+        assert rollups[ANONYMOUS_TENANT]["requests"] == 1
+        assert all(row["cpu_time_ms"] >= 0 for row in rollups.values())
+
+    @pytest.mark.unit
+    @pytest.mark.asyncio
+    async def test_pipeline_meters_tenant_without_quotas(self):
+        """Test that the tenant is resolved for metering when identity quotas are disabled."""
+        # Arrange
+        meter = UsageMeter()
+        tokens = {"Bearer alice": ("acme", "alice")}
+        test_app = FastAPI()
+        test_app.add_middleware(
+            RequestPipeline,
+            security=SecurityMiddleware(None, identity_resolver=tokens.get),
+            metrics=MetricsMiddleware(None, usage_meter=meter)
+        )
+
+        @test_app.get("/api/v1/users")
+        async def list_users():
+            return []
+
+        browser = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+
+        # Act
+        async with AsyncClient(app=test_app, base_url="http://test") as client:
+            await client.get("/api/v1/users", headers={**browser, "authorization": "Bearer alice"})
+            await client.get("/api/v1/users", headers=browser)
+        rollups = {row["tenant_id"]: row for row in meter.flush()}
+
+        # Assert
+        assert rollups["acme"]["requests"] == 1
+        assert rollups[ANONYMOUS_TENANT]["requests"] == 1
+
+
+class TestCpuShareClock:
+    """Test cases for CpuShareClock."""
+
+    @pytest.mark.unit
+    def test_overlapping_requests_split_cpu_time(self, monkeypatch):
+        """Test that CPU used while two requests are in flight is charged half to each, and idle CPU to none."""
+        # Arrange
+        cpu = [0.0]
+        monkeypatch.setattr(metering.time, "thread_time", lambda: cpu[0])
+        clock = CpuShareClock()
+
+        # Act
+        first = clock.enter()
+        cpu[0] = 0.010
+        second = clock.enter()
+        cpu[0] = 0.030
+        first_cpu = clock.leave(first)
+        cpu[0] = 0.035
+        second_cpu = clock.leave(second)
+        # Work done while idle (background tasks, flushes) is not charged
+        cpu[0] = 0.040
+        third = clock.enter()
+        cpu[0] = 0.050
+        third_cpu = clock.leave(third)
+
+        # Assert
+        assert first_cpu == pytest.approx(0.020)
+        assert second_cpu == pytest.approx(0.015)
+        assert first_cpu + second_cpu == pytest.approx(0.035)
+        assert third_cpu == pytest.approx(0.010)
@@ -0,0 +1,238 @@
+"""
+Sampled allocation profiling for traced operations.
+
+When enabled, a fraction of ``trace_function(track_allocations=True)`` calls
+record the net change in traced memory across the call, read with
+``tracemalloc.get_traced_memory()`` (two counter reads per call).
+
+tracemalloc traces every allocation in the process, roughly doubling the cost
+of allocating, whatever the sample rate. It is therefore only running while a
+sampled or captured call is in progress: the first such call starts it and
+the last one to finish stops it (unless something else had started it).
+The overhead is paid by everything that runs during sampled calls, so it
+grows with the sample rate, call duration and concurrency. Memory allocated
+before tracing started is untraced, so frees of it do not show in a delta,
+and allocations by concurrently running tasks show up as noise; low sample
+rates over long periods average this out.
+
+Allocation sites come from tracemalloc snapshot diffs. They are only taken for
+explicit captures: ``request_capture(operation)`` arms a diff around the next
+call of that operation, and tracing starts with that call.
+"""
+
+import random
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_SITES = 10
+DEFAULT_TRACEBACK_FRAMES = 1
+MAX_SITES_PER_OPERATION = 50
+
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class AllocationSample:
+    """Baseline for one sampled call; ``snapshot`` is set only for a requested capture."""
+
+    __slots__ = ('operation', 'start_bytes', 'snapshot')
+
+    def __init__(self, operation: str, start_bytes: int, snapshot: Optional[tracemalloc.Snapshot]):
+        self.operation = operation
+        self.start_bytes = start_bytes
+        self.snapshot = snapshot
+
+
+class OperationAllocations:
+    """Aggregated allocation statistics for one operation."""
+
+    __slots__ = ('samples', 'net_bytes_total', 'net_bytes_max', 'sites', 'last_diff', 'last_diff_at')
+
+    def __init__(self):
+        self.samples = 0
+        self.net_bytes_total = 0
+        self.net_bytes_max = 0
+        self.sites: Counter = Counter()
+        self.last_diff: List[str] = []
+        self.last_diff_at: Optional[str] = None
+
+
+class AllocationProfiler:
+    """
+    Samples allocations of traced operations with tracemalloc, tracing only
+    while a sampled or captured call is in progress.
+
+    Usage:
+        allocation_profiler.enable(sample_rate=0.01)
+        allocation_profiler.request_capture("user_service.list_users")
+
+        sample = allocation_profiler.begin("user_service.list_users")
+        try:
+            ...
+        finally:
+            if sample is not None:
+                allocation_profiler.end(sample)
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        top_sites: int = DEFAULT_TOP_SITES,
+        traceback_frames: int = DEFAULT_TRACEBACK_FRAMES
+    ):
+        self.sample_rate = sample_rate
+        self.top_sites = top_sites
+        self.traceback_frames = traceback_frames
+        self._operations: Dict[str, OperationAllocations] = {}
+        self._lock = threading.Lock()
+        # Operations whose next call takes a snapshot diff
+        self._pending_captures: set = set()
+        # Only one call at a time takes snapshots
+        self._snapshot_lock = threading.Lock()
+        # Sampled or captured calls in progress; tracing runs while there are any
+        self._active = 0
+        self._started_tracing = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def enable(self, sample_rate: Optional[float] = None):
+        """Begin sampling; tracemalloc runs only during sampled calls."""
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        logger.info(
+            "Allocation profiling enabled",
+            extra={"custom_dimensions": {"sample_rate": self.sample_rate}}
+        )
+
+    def disable(self):
+        """Stop sampling and captures; tracing stops when calls in progress finish."""
+        self.sample_rate = 0.0
+        with self._lock:
+            self._pending_captures.clear()
+        logger.info("Allocation profiling disabled")
+
+    def request_capture(self, operation: str):
+        """Take a snapshot diff around the next call of ``operation``."""
+        with self._lock:
+            self._pending_captures.add(operation)
+
+    def begin(self, operation: str) -> Optional[AllocationSample]:
+        """Return a baseline if this call is sampled or captured, else None."""
+        if self._pending_captures and operation in self._pending_captures:
+            return self._begin_capture(operation)
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        self._start_tracing()
+        return AllocationSample(operation, tracemalloc.get_traced_memory()[0], None)
+
+    def _begin_capture(self, operation: str) -> Optional[AllocationSample]:
+        if not self._snapshot_lock.acquire(blocking=False):
+            # Another capture is running; try again on a later call
+            return None
+        with self._lock:
+            self._pending_captures.discard(operation)
+        self._start_tracing()
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        return AllocationSample(operation, tracemalloc.get_traced_memory()[0], snapshot)
+
+    def _start_tracing(self):
+        with self._lock:
+            if self._active == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.traceback_frames)
+                self._started_tracing = True
+            self._active += 1
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._active -= 1
+            if self._active == 0 and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def end(self, sample: AllocationSample):
+        """Fold the sampled call's allocation delta into its operation's statistics."""
+        try:
+            net_bytes = tracemalloc.get_traced_memory()[0] - sample.start_bytes
+            diff = None
+            if sample.snapshot is not None:
+                after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+                diff = after.compare_to(sample.snapshot, 'lineno')[:self.top_sites]
+        finally:
+            if sample.snapshot is not None:
+                self._snapshot_lock.release()
+            self._stop_tracing()
+
+        with self._lock:
+            stats = self._operations.get(sample.operation)
+            if stats is None:
+                stats = self._operations[sample.operation] = OperationAllocations()
+            stats.samples += 1
+            stats.net_bytes_total += net_bytes
+            if net_bytes > stats.net_bytes_max:
+                stats.net_bytes_max = net_bytes
+            if diff is not None:
+                for stat in diff:
+                    if stat.size_diff > 0:
+                        frame = stat.traceback[0]
+                        stats.sites[f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+                if len(stats.sites) > MAX_SITES_PER_OPERATION:
+                    stats.sites = Counter(dict(stats.sites.most_common(MAX_SITES_PER_OPERATION)))
+                stats.last_diff = [str(stat) for stat in diff]
+                stats.last_diff_at = datetime.utcnow().isoformat()
+
+    def get_summary(self) -> dict:
+        """Per-operation net allocation metrics and top allocation sites."""
+        with self._lock:
+            operations = {
+                operation: {
+                    "samples": stats.samples,
+                    "net_bytes_avg": round(stats.net_bytes_total / stats.samples) if stats.samples else 0,
+                    "net_bytes_max": stats.net_bytes_max,
+                    "top_sites": [
+                        {"site": site, "bytes": size}
+                        for site, size in stats.sites.most_common(self.top_sites)
+                    ]
+                }
+                for operation, stats in self._operations.items()
+            }
+        traced_current, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "tracing": tracemalloc.is_tracing(),
+            "active_calls": self._active,
+            "traced_memory_bytes": traced_current,
+            "traced_memory_peak_bytes": traced_peak,
+            "pending_captures": sorted(self._pending_captures),
+            "operations": operations
+        }
+
+    def get_snapshot_diff(self, operation: str) -> Optional[str]:
+        """The most recent snapshot diff for an operation as text, or None."""
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None or stats.last_diff_at is None:
+                return None
+            lines = list(stats.last_diff)
+            taken_at = stats.last_diff_at
+        return f"# {operation} allocation diff at {taken_at}\n" + "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+
+# Process-wide profiler used by trace_function(track_allocations=True)
+allocation_profiler = AllocationProfiler()
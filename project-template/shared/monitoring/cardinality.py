@@ -0,0 +1,157 @@
+"""
+Label cardinality guard for labelled metrics.
+
+Each metric may hold at most ``max_series`` label combinations. Past the cap,
+new combinations are folded into a single overflow series. Every time the
+overflow absorbs another ``max_series // 2`` new combinations, the metric is
+compacted: the top half of its series by value are retained, the rest are
+folded into the overflow, and their slots are reopened. Memory per metric
+stays bounded whatever the traffic, and series that matter survive a flood
+of one-off label values.
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SERIES_PER_METRIC = 100
+
+# Label value for the series that absorbs combinations past the cap
+OVERFLOW_LABEL_VALUE = "__overflow__"
+
+# Called with (series key, overflow key) for every series folded by a
+# compaction, e.g. by push exporters that report counter deltas
+_fold_listeners: List[Callable[[str, str], None]] = []
+
+
+def add_fold_listener(listener: Callable[[str, str], None]):
+    """Receive every series folded into an overflow series by any CardinalityLimiter."""
+    if listener not in _fold_listeners:
+        _fold_listeners.append(listener)
+
+
+def remove_fold_listener(listener: Callable[[str, str], None]):
+    if listener in _fold_listeners:
+        _fold_listeners.remove(listener)
+
+
+class MetricSeries:
+    """Admitted label combinations for one metric."""
+
+    __slots__ = ('series', 'overflow_key', 'rejected', 'rejected_since_compaction', 'compactions')
+
+    def __init__(self, overflow_key: str):
+        # series key -> labels
+        self.series: Dict[str, Dict[str, str]] = {}
+        self.overflow_key = overflow_key
+        self.rejected = 0
+        self.rejected_since_compaction = 0
+        self.compactions = 0
+
+
+class CardinalityLimiter:
+    """
+    Caps the number of label combinations per metric.
+
+    Usage:
+        limiter = CardinalityLimiter(max_series=100)
+        if series_key not in counters:
+            series_key = limiter.admit(metric_key, series_key, labels, counters)
+        counters[series_key] = counters.get(series_key, 0) + 1
+    """
+
+    def __init__(self, max_series: int = DEFAULT_MAX_SERIES_PER_METRIC):
+        self.max_series = max_series
+        self.retain = max(1, max_series // 2)
+        self._metrics: Dict[str, MetricSeries] = {}
+        self._lock = threading.Lock()
+
+    def admit(self, metric_key: str, series_key: str, labels: Dict[str, str], values: Dict[str, int]) -> str:
+        """
+        Return the key a new series should be stored under.
+
+        ``values`` is the store holding the metric's series, used to pick the
+        series to retain when the metric is compacted.
+        """
+        with self._lock:
+            metric = self._metrics.get(metric_key)
+            if metric is None:
+                metric = self._metrics[metric_key] = MetricSeries(f"{metric_key}.{OVERFLOW_LABEL_VALUE}")
+            if series_key in metric.series:
+                return series_key
+            if len(metric.series) < self.max_series:
+                metric.series[series_key] = dict(labels)
+                return series_key
+
+            metric.rejected += 1
+            metric.rejected_since_compaction += 1
+            if metric.rejected_since_compaction >= self.retain:
+                self._compact(metric_key, metric, values)
+            return metric.overflow_key
+
+    def _compact(self, metric_key: str, metric: MetricSeries, values: Dict[str, int]):
+        ranked = sorted(metric.series, key=lambda key: values.get(key, 0), reverse=True)
+        folded = 0
+        for series_key in ranked[self.retain:]:
+            del metric.series[series_key]
+            value = values.pop(series_key, 0)
+            values[metric.overflow_key] = values.get(metric.overflow_key, 0) + value
+            folded += 1
+            for listener in _fold_listeners:
+                listener(series_key, metric.overflow_key)
+        metric.rejected_since_compaction = 0
+        metric.compactions += 1
+
+        logger.warning(
+            f"Metric cardinality cap reached: {metric_key}",
+            extra={
+                "custom_dimensions": {
+                    "metric": metric_key,
+                    "max_series": self.max_series,
+                    "folded_series": folded,
+                    "rejected_series": metric.rejected,
+                    "exploding_labels": self._exploding_labels(metric)
+                }
+            }
+        )
+
+    def _label_cardinality(self, metric: MetricSeries) -> Dict[str, int]:
+        distinct: Dict[str, set] = {}
+        for labels in metric.series.values():
+            for name, value in labels.items():
+                distinct.setdefault(name, set()).add(value)
+        return {name: len(values) for name, values in distinct.items()}
+
+    def _exploding_labels(self, metric: MetricSeries) -> List[str]:
+        """Label names whose distinct values account for most of the admitted series."""
+        cardinality = self._label_cardinality(metric)
+        threshold = max(2, len(metric.series) // 2)
+        return sorted(name for name, count in cardinality.items() if count >= threshold)
+
+    def report(self, limit: int = 20) -> List[dict]:
+        """Metrics ordered by pressure: rejected series first, then series count."""
+        with self._lock:
+            entries = [
+                {
+                    "metric": metric_key,
+                    "series": len(metric.series),
+                    "max_series": self.max_series,
+                    "rejected_series": metric.rejected,
+                    "compactions": metric.compactions,
+                    "label_cardinality": self._label_cardinality(metric),
+                    "exploding_labels": self._exploding_labels(metric) if metric.rejected else []
+                }
+                for metric_key, metric in self._metrics.items()
+            ]
+        entries.sort(key=lambda entry: (entry["rejected_series"], entry["series"]), reverse=True)
+        return entries[:limit]
+
+    def series_count(self, metric_key: Optional[str] = None) -> int:
+        """Admitted series for one metric, or across all metrics."""
+        with self._lock:
+            if metric_key is not None:
+                metric = self._metrics.get(metric_key)
+                return len(metric.series) if metric is not None else 0
+            return sum(len(metric.series) for metric in self._metrics.values())
@@ -4,10 +4,14 @@ These decorators ensure every function follows the monitoring patterns
 defined in .cursorrules.
 """
 
+import os
 import time
+import random
 import logging
 import functools
-from typing import Any, Callable, Dict, Optional
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
 from contextlib import asynccontextmanager
 import asyncio
 import traceback
@@ -21,24 +25,95 @@ try:
 except ImportError:
     HAS_OPENCENSUS = False
 
+from shared.monitoring.metering import record_db_time, record_external_time
+from shared.monitoring.queries import fingerprint_sql, record_query
+from shared.monitoring.resilience import CallGuard, ServiceUnavailableError, get_policy
+from shared.monitoring.profiler import push_operation, pop_operation
+from shared.monitoring.slow_calls import end_span, slow_call_recorder, start_span
+from shared.monitoring.allocations import allocation_profiler
+from shared.monitoring.cardinality import CardinalityLimiter, DEFAULT_MAX_SERIES_PER_METRIC
+
 logger = logging.getLogger(__name__)
 
+# Instrumentation levels for trace_function / trace_method:
+# - off: decorators return the original function; already-wrapped functions call straight through
+# - counters: success/error counters only, no logging, timing or spans
+# - sampled: full instrumentation for a MONITORING_INSTRUMENTATION_SAMPLE_RATE fraction of calls, counters for the rest
+# - full: counters, timing, logging, spans, slow-call and allocation tracking on every call
+INSTRUMENTATION_OFF = "off"
+INSTRUMENTATION_COUNTERS = "counters"
+INSTRUMENTATION_SAMPLED = "sampled"
+INSTRUMENTATION_FULL = "full"
+INSTRUMENTATION_LEVELS = (INSTRUMENTATION_OFF, INSTRUMENTATION_COUNTERS, INSTRUMENTATION_SAMPLED, INSTRUMENTATION_FULL)
+
+# Most recent durations kept per timer metric
+MAX_TIMER_SAMPLES = 1000
+
+# Read from the environment at import so that "off" takes effect for functions decorated at import time
+_instrumentation_level = os.environ.get("MONITORING_INSTRUMENTATION_LEVEL", INSTRUMENTATION_FULL).lower()
+if _instrumentation_level not in INSTRUMENTATION_LEVELS:
+    logger.warning(f"Unknown MONITORING_INSTRUMENTATION_LEVEL '{_instrumentation_level}', using full")
+    _instrumentation_level = INSTRUMENTATION_FULL
+# Independent of MONITORING_SAMPLING_RATE, which is the OpenCensus trace sampling rate
+_sampling_rate = float(os.environ.get("MONITORING_INSTRUMENTATION_SAMPLE_RATE", "1.0"))
+
+
+def set_instrumentation_level(level: str, sampling_rate: Optional[float] = None):
+    """
+    Switch the instrumentation level at runtime.
+    
+    Functions decorated while the level was "off" stay unwrapped; every other
+    decorated function picks up the new level on its next call.
+    """
+    global _instrumentation_level, _sampling_rate
+    level = level.lower()
+    if level not in INSTRUMENTATION_LEVELS:
+        raise ValueError(f"Unknown instrumentation level: {level}")
+    if sampling_rate is not None:
+        _sampling_rate = sampling_rate
+    _instrumentation_level = level
+    logger.info(
+        "Instrumentation level changed",
+        extra={"custom_dimensions": {"level": level, "sampling_rate": _sampling_rate}}
+    )
+
+
+def get_instrumentation_level() -> str:
+    """Current instrumentation level."""
+    return _instrumentation_level
+
 
 class MetricsCollector:
-    """Centralized metrics collection for services."""
+    """
+    Centralized metrics collection for services.
+    
+    Labelled counters are capped at ``max_series_per_metric`` label
+    combinations per metric; see shared.monitoring.cardinality. Timers are
+    kept per metric name only: labels passed to ``start_timer`` or
+    ``record_duration`` go to the log record, not into the timer series,
+    so they add no series whatever their cardinality.
+    """
     
-    def __init__(self, service_name: str):
+    def __init__(self, service_name: str, max_series_per_metric: int = DEFAULT_MAX_SERIES_PER_METRIC):
         self.service_name = service_name
         self.counters: Dict[str, int] = {}
-        self.timers: Dict[str, list] = {}
+        self.timers: Dict[str, deque] = {}
+        self.cardinality = CardinalityLimiter(max_series_per_metric)
+        # Counters are incremented from worker threads as well as the event loop
+        self._counter_lock = threading.Lock()
     
-    def increment_counter(self, metric_name: str, labels: Optional[Dict[str, str]] = None):
+    def increment_counter(self, metric_name: str, labels: Optional[Dict[str, str]] = None, log: bool = True):
         """Increment a counter metric."""
         key = f"{self.service_name}.{metric_name}"
-        if labels:
-            key += f".{'.'.join(f'{k}_{v}' for k, v in labels.items())}"
+        series_key = f"{key}.{'.'.join(f'{k}_{v}' for k, v in labels.items())}" if labels else key
         
-        self.counters[key] = self.counters.get(key, 0) + 1
+        with self._counter_lock:
+            if labels and series_key not in self.counters:
+                # Compaction folds series into overflow, so admit under the same lock
+                series_key = self.cardinality.admit(key, series_key, labels, self.counters)
+            value = self.counters[series_key] = self.counters.get(series_key, 0) + 1
+        if not log:
+            return
         
         # Log metric to Application Insights
         logger.info(
@@ -48,22 +123,24 @@ class MetricsCollector:
                     "metric_name": metric_name,
                     "service": self.service_name,
                     "labels": labels or {},
-                    "value": self.counters[key]
+                    "value": value
                 }
             }
         )
     
-    def start_timer(self, metric_name: str) -> 'TimerContext':
-        """Start a timer for duration measurement."""
-        return TimerContext(self, metric_name)
+    def start_timer(self, metric_name: str, labels: Optional[Dict[str, str]] = None) -> 'TimerContext':
+        """Start a timer for duration measurement; ``labels`` are only logged."""
+        return TimerContext(self, metric_name, labels)
     
     def record_duration(self, metric_name: str, duration: float, labels: Optional[Dict[str, str]] = None):
-        """Record a duration metric."""
+        """Record a duration under ``metric_name``; ``labels`` are only logged."""
         key = f"{self.service_name}.{metric_name}"
         if key not in self.timers:
-            self.timers[key] = []
+            self.timers[key] = deque(maxlen=MAX_TIMER_SAMPLES)
         
         self.timers[key].append(duration)
+        for listener in _duration_listeners:
+            listener(key, duration)
         
         # Log duration to Application Insights
         logger.info(
@@ -79,51 +156,148 @@ class MetricsCollector:
         )
 
 
+_collectors: Dict[str, MetricsCollector] = {}
+
+# Called with (metric key, seconds) for every recorded duration, e.g. by push exporters
+_duration_listeners: List[Callable[[str, float], None]] = []
+
+
+def add_duration_listener(listener: Callable[[str, float], None]):
+    """Receive every duration recorded by any MetricsCollector."""
+    if listener not in _duration_listeners:
+        _duration_listeners.append(listener)
+
+
+def remove_duration_listener(listener: Callable[[str, float], None]):
+    if listener in _duration_listeners:
+        _duration_listeners.remove(listener)
+
+
+def get_metrics_collector(service_name: str) -> MetricsCollector:
+    """Shared MetricsCollector for a service, created on first use."""
+    collector = _collectors.get(service_name)
+    if collector is None:
+        collector = _collectors.setdefault(service_name, MetricsCollector(service_name))
+    return collector
+
+
+def get_cardinality_report(limit: int = 20) -> dict:
+    """Series counts, rejections and exploding labels for every shared collector."""
+    return {
+        service_name: {
+            "total_series": len(collector.counters),
+            "metrics": collector.cardinality.report(limit)
+        }
+        for service_name, collector in list(_collectors.items())
+    }
+
+
 class TimerContext:
-    """Context manager for timing operations."""
+    """
+    Context manager for timing operations.
     
-    def __init__(self, metrics_collector: MetricsCollector, metric_name: str):
+    Timing uses the monotonic ``perf_counter_ns`` clock, so NTP adjustments
+    cannot produce negative or skewed durations. The clock starts when the
+    timer is created (and restarts on ``__enter__``); the duration is recorded
+    exactly once, by whichever of ``__exit__`` or ``stop()`` runs first.
+    """
+    
+    __slots__ = ('metrics_collector', 'metric_name', 'labels', 'start_ns', 'duration_ns')
+    
+    def __init__(
+        self,
+        metrics_collector: MetricsCollector,
+        metric_name: str,
+        labels: Optional[Dict[str, str]] = None
+    ):
         self.metrics_collector = metrics_collector
         self.metric_name = metric_name
-        self.start_time: Optional[float] = None
-        self.duration: Optional[float] = None
+        self.labels = labels
+        self.start_ns = time.perf_counter_ns()
+        self.duration_ns: Optional[int] = None
+    
+    @property
+    def duration(self) -> Optional[float]:
+        """Recorded duration in seconds, or None while the timer is running."""
+        return self.duration_ns / 1e9 if self.duration_ns is not None else None
+    
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the timer started (the recorded duration once stopped)."""
+        if self.duration_ns is not None:
+            return self.duration_ns / 1e9
+        return (time.perf_counter_ns() - self.start_ns) / 1e9
     
     def __enter__(self):
-        self.start_time = time.time()
+        if self.duration_ns is None:
+            self.start_ns = time.perf_counter_ns()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.start_time:
-            self.duration = time.time() - self.start_time
-            self.metrics_collector.record_duration(self.metric_name, self.duration)
+        self.stop()
     
-    def stop(self):
-        """Manually stop the timer."""
-        if self.start_time and not self.duration:
-            self.duration = time.time() - self.start_time
-            self.metrics_collector.record_duration(self.metric_name, self.duration)
+    def stop(self) -> float:
+        """Stop the timer and record the duration; later calls are no-ops."""
+        if self.duration_ns is None:
+            self.duration_ns = time.perf_counter_ns() - self.start_ns
+            self.metrics_collector.record_duration(self.metric_name, self.duration_ns / 1e9, self.labels)
+        return self.duration_ns / 1e9
 
 
-def trace_function(operation_name: str, service_name: Optional[str] = None):
+def trace_function(
+    operation_name: str,
+    service_name: Optional[str] = None,
+    slow_threshold: Optional[float] = None,
+    track_allocations: bool = False
+):
     """
     Decorator to add comprehensive monitoring to any function.
     
+    Calls slower than ``slow_threshold`` seconds (default: the recorder's
+    per-operation threshold) are kept by ``slow_call_recorder``. With
+    ``track_allocations`` a sample of calls is profiled by
+    ``allocation_profiler`` whenever it is enabled. How much of this runs
+    is governed by the instrumentation level (see set_instrumentation_level).
+    
     Usage:
         @trace_function("user_service.create_user")
         async def create_user(...):
             pass
     """
     def decorator(func: Callable) -> Callable:
+        if _instrumentation_level == INSTRUMENTATION_OFF:
+            return func
+        
+        # Extract service name from operation name if not provided
+        if service_name:
+            svc_name = service_name
+        else:
+            svc_name = operation_name.split('.')[0] if '.' in operation_name else 'unknown'
+        metrics = get_metrics_collector(svc_name)
+        success_metric = f"{operation_name}.success"
+        error_metric = f"{operation_name}.error"
+        
         @functools.wraps(func)
         async def async_wrapper(*args, **kwargs):
-            # Extract service name from operation name if not provided
-            if service_name:
-                svc_name = service_name
-            else:
-                svc_name = operation_name.split('.')[0] if '.' in operation_name else 'unknown'
+            level = _instrumentation_level
+            if level == INSTRUMENTATION_OFF:
+                return await func(*args, **kwargs)
+            if level == INSTRUMENTATION_COUNTERS or (
+                level == INSTRUMENTATION_SAMPLED and random.random() >= _sampling_rate
+            ):
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    metrics.increment_counter(error_metric, {"error_type": type(e).__name__}, log=False)
+                    raise
+                metrics.increment_counter(success_metric, log=False)
+                return result
             
-            metrics = MetricsCollector(svc_name)
             timer = metrics.start_timer(f"{operation_name}.duration")
+            operation_key = push_operation(operation_name)
+            watch = slow_call_recorder.begin(operation_name, args, kwargs, slow_threshold)
+            allocations = allocation_profiler.begin(operation_name) if track_allocations else None
+            error = None
             
             # Start distributed tracing if available
             tracer = None
@@ -154,7 +328,7 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
                     result = func(*args, **kwargs)
                 
                 # Record success
-                metrics.increment_counter(f"{operation_name}.success")
+                metrics.increment_counter(success_metric)
                 
                 logger.info(
                     f"Completed {operation_name} successfully",
@@ -162,7 +336,7 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
                         "custom_dimensions": {
                             "operation": operation_name,
                             "service": svc_name,
-                            "duration_ms": timer.duration * 1000 if timer.duration else 0
+                            "duration_ms": timer.elapsed * 1000
                         }
                     }
                 )
@@ -170,9 +344,10 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
                 return result
                 
             except Exception as e:
+                error = e
                 # Record error
                 metrics.increment_counter(
-                    f"{operation_name}.error",
+                    error_metric,
                     {"error_type": type(e).__name__}
                 )
                 
@@ -197,16 +372,35 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
                 
             finally:
                 # Always stop timer and finish span
-                timer.stop()
+                slow_call_recorder.end(watch, timer.stop(), error)
+                if allocations is not None:
+                    allocation_profiler.end(allocations)
+                pop_operation(operation_key)
                 if span:
                     tracer.end_span()
         
         @functools.wraps(func)
         def sync_wrapper(*args, **kwargs):
             # Similar implementation for sync functions
-            svc_name = service_name or operation_name.split('.')[0]
-            metrics = MetricsCollector(svc_name)
+            level = _instrumentation_level
+            if level == INSTRUMENTATION_OFF:
+                return func(*args, **kwargs)
+            if level == INSTRUMENTATION_COUNTERS or (
+                level == INSTRUMENTATION_SAMPLED and random.random() >= _sampling_rate
+            ):
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    metrics.increment_counter(error_metric, {"error_type": type(e).__name__}, log=False)
+                    raise
+                metrics.increment_counter(success_metric, log=False)
+                return result
+            
             timer = metrics.start_timer(f"{operation_name}.duration")
+            operation_key = push_operation(operation_name)
+            watch = slow_call_recorder.begin(operation_name, args, kwargs, slow_threshold)
+            allocations = allocation_profiler.begin(operation_name) if track_allocations else None
+            error = None
             
             logger.info(
                 f"Starting {operation_name}",
@@ -221,7 +415,7 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
             
             try:
                 result = func(*args, **kwargs)
-                metrics.increment_counter(f"{operation_name}.success")
+                metrics.increment_counter(success_metric)
                 
                 logger.info(
                     f"Completed {operation_name} successfully",
@@ -236,8 +430,9 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
                 return result
                 
             except Exception as e:
+                error = e
                 metrics.increment_counter(
-                    f"{operation_name}.error",
+                    error_metric,
                     {"error_type": type(e).__name__}
                 )
                 
@@ -254,7 +449,10 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
                 raise
                 
             finally:
-                timer.stop()
+                slow_call_recorder.end(watch, timer.stop(), error)
+                if allocations is not None:
+                    allocation_profiler.end(allocations)
+                pop_operation(operation_key)
         
         if asyncio.iscoroutinefunction(func):
             return async_wrapper
@@ -264,7 +462,7 @@ def trace_function(operation_name: str, service_name: Optional[str] = None):
     return decorator
 
 
-def trace_method(operation_name: str):
+def trace_method(operation_name: str, slow_threshold: Optional[float] = None, track_allocations: bool = False):
     """
     Decorator specifically for class methods.
     
@@ -275,20 +473,34 @@ def trace_method(operation_name: str):
                 pass
     """
     def decorator(func: Callable) -> Callable:
+        if _instrumentation_level == INSTRUMENTATION_OFF:
+            return func
+        
+        # One traced wrapper per service name, built on first use
+        traced: Dict[str, Callable] = {}
+        
+        def traced_for(instance) -> Callable:
+            # Extract class name for context
+            class_name = instance.__class__.__name__
+            service_name = getattr(instance, 'service_name', class_name.lower().replace('repository', '').replace('service', ''))
+            wrapper = traced.get(service_name)
+            if wrapper is None:
+                wrapper = traced[service_name] = trace_function(
+                    operation_name, service_name, slow_threshold, track_allocations
+                )(func)
+            return wrapper
+        
         @functools.wraps(func)
         async def async_wrapper(self, *args, **kwargs):
-            # Extract class name for context
-            class_name = self.__class__.__name__
-            service_name = getattr(self, 'service_name', class_name.lower().replace('repository', '').replace('service', ''))
-            
-            return await trace_function(operation_name, service_name)(func)(self, *args, **kwargs)
+            if _instrumentation_level == INSTRUMENTATION_OFF:
+                return await func(self, *args, **kwargs)
+            return await traced_for(self)(self, *args, **kwargs)
         
         @functools.wraps(func)
         def sync_wrapper(self, *args, **kwargs):
-            class_name = self.__class__.__name__
-            service_name = getattr(self, 'service_name', class_name.lower().replace('repository', '').replace('service', ''))
-            
-            return trace_function(operation_name, service_name)(func)(self, *args, **kwargs)
+            if _instrumentation_level == INSTRUMENTATION_OFF:
+                return func(self, *args, **kwargs)
+            return traced_for(self)(self, *args, **kwargs)
         
         if asyncio.iscoroutinefunction(func):
             return async_wrapper
@@ -299,15 +511,25 @@ def trace_method(operation_name: str):
 
 
 @asynccontextmanager
-async def database_operation(table_name: str, operation: str, metrics_collector: MetricsCollector):
+async def database_operation(
+    table_name: str,
+    operation: str,
+    metrics_collector: MetricsCollector,
+    query: Optional[str] = None
+):
     """
     Context manager for database operations monitoring.
     
+    The operation is counted against the current request's query profile under
+    the fingerprint of ``query`` when given, otherwise under "<operation> <table>".
+    
     Usage:
-        async with database_operation("users", "select", metrics):
-            result = await db.execute(query)
+        async with database_operation("users", "select", metrics, query=str(stmt)):
+            result = await db.execute(stmt)
     """
     timer = metrics_collector.start_timer("database_query_duration")
+    span, span_token = start_span(f"db.{operation} {table_name}")
+    error: Optional[BaseException] = None
     
     logger.debug(
         f"Database operation started: {operation} on {table_name}",
@@ -334,12 +556,13 @@ async def database_operation(table_name: str, operation: str, metrics_collector:
                 "custom_dimensions": {
                     "table": table_name,
                     "operation": operation,
-                    "duration_ms": timer.duration * 1000 if timer.duration else 0
+                    "duration_ms": timer.elapsed * 1000
                 }
             }
         )
         
     except Exception as e:
+        error = e
         metrics_collector.increment_counter(
             "database_query_error",
             {"table": table_name, "operation": operation, "error_type": type(e).__name__}
@@ -359,19 +582,62 @@ async def database_operation(table_name: str, operation: str, metrics_collector:
         raise
         
     finally:
-        timer.stop()
+        end_span(span, span_token, error)
+        # Attribute database time to the tenant of the current request
+        record_db_time(timer.stop())
+        fingerprint = fingerprint_sql(query) if query else f"{operation} {table_name}"
+        record_query(fingerprint, timer.duration_ns)
 
 
 @asynccontextmanager
-async def external_service_call(service_name: str, endpoint: str, metrics_collector: MetricsCollector):
+async def external_service_call(
+    service_name: str,
+    endpoint: str,
+    metrics_collector: MetricsCollector,
+    resilient: bool = False
+):
     """
     Context manager for external service calls monitoring.
     
+    With ``resilient=True`` the block runs under the (service, endpoint)
+    resilience policy: it is rejected with ServiceUnavailableError while the
+    circuit is open or the bulkhead is full, and cancelled with TimeoutError once
+    the adaptive timeout expires. Only timeouts, connection errors and 5xx
+    responses raised in the block count as failures. ``endpoint`` should be a
+    route template, not a URL with ids in it.
+    
     Usage:
         async with external_service_call("declaration-service", "/api/v1/declarations", metrics):
             response = await http_client.post(url, json=data)
+    
+        # Hedge idempotent reads once they outlive the endpoint's p95
+        async with external_service_call("form-service", "/api/v1/forms", metrics, resilient=True) as call:
+            response = await call.hedge(lambda: http_client.get(url))
     """
+    policy = get_policy(service_name, endpoint) if resilient else None
+    if policy is not None:
+        try:
+            await policy.acquire()
+        except ServiceUnavailableError as e:
+            metrics_collector.increment_counter(
+                "external_service_rejected",
+                {"service": service_name, "endpoint": endpoint, "reason": e.reason}
+            )
+            logger.warning(
+                f"External service call rejected: {service_name}{endpoint}",
+                extra={
+                    "custom_dimensions": {
+                        "service": service_name,
+                        "endpoint": endpoint,
+                        "reason": e.reason
+                    }
+                }
+            )
+            raise
+    
     timer = metrics_collector.start_timer("external_service_duration")
+    span, span_token = start_span(f"http.{service_name}{endpoint}")
+    error: Optional[BaseException] = None
     
     logger.info(
         f"External service call started: {service_name}{endpoint}",
@@ -385,7 +651,12 @@ async def external_service_call(service_name: str, endpoint: str, metrics_collec
     )
     
     try:
-        yield
+        if policy is None:
+            yield None
+        else:
+            guard = CallGuard(policy)
+            async with asyncio.timeout(guard.timeout):
+                yield guard
         
         metrics_collector.increment_counter(
             "external_service_success",
@@ -398,12 +669,13 @@ async def external_service_call(service_name: str, endpoint: str, metrics_collec
                 "custom_dimensions": {
                     "service": service_name,
                     "endpoint": endpoint,
-                    "duration_ms": timer.duration * 1000 if timer.duration else 0
+                    "duration_ms": timer.elapsed * 1000
                 }
             }
         )
         
     except Exception as e:
+        error = e
         metrics_collector.increment_counter(
             "external_service_error",
             {"service": service_name, "endpoint": endpoint, "error_type": type(e).__name__}
@@ -416,14 +688,25 @@ async def external_service_call(service_name: str, endpoint: str, metrics_collec
                     "service": service_name,
                     "endpoint": endpoint,
                     "error": str(e),
-                    "error_type": type(e).__name__
+                    "error_type": type(e).__name__,
+                    "circuit_state": policy.breaker.state if policy is not None else None
                 }
             }
         )
         raise
+    
+    except BaseException as e:
+        # Cancellation of the caller; not a verdict on the remote service
+        error = e
+        raise
         
     finally:
-        timer.stop()
+        end_span(span, span_token, error if isinstance(error, Exception) else None)
+        # Attribute outbound call time to the tenant of the current request
+        duration = timer.stop()
+        record_external_time(duration)
+        if policy is not None:
+            policy.release(duration, error)
 
 
 class BusinessRuleViolation(Exception):
@@ -0,0 +1,307 @@
+"""
+Push exporters for the shared metrics registry.
+
+For deployments that cannot be scraped, ``StatsDExporter`` pushes the
+counters and durations of every collector returned by
+``get_metrics_collector`` to a StatsD-compatible UDP endpoint.
+Aggregation happens in process over each flush interval:
+- counters are sent as the delta since the previous flush
+- durations are summarised into count, sum, min, max and percentiles
+
+The resulting lines are packed into datagrams no larger than
+``max_packet_size``. This keeps packet counts and the agent's work
+proportional to the number of series, not to the call rate.
+"""
+
+import re
+import time
+import random
+import socket
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared.monitoring.decorators import _collectors, add_duration_listener, remove_duration_listener
+from shared.monitoring.cardinality import add_fold_listener, remove_fold_listener
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATSD_PORT = 8125
+DEFAULT_FLUSH_INTERVAL_SECONDS = 10.0
+
+# 1500-byte Ethernet MTU minus IP and UDP headers, with headroom for IP options
+DEFAULT_MAX_PACKET_SIZE = 1432
+
+# Durations kept per metric and interval for percentile estimates (reservoir sampled)
+DEFAULT_RESERVOIR_SIZE = 256
+
+HISTOGRAM_PERCENTILES = (50, 95, 99)
+
+_UNSAFE_NAME_CHARS = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+@lru_cache(maxsize=4096)
+def statsd_name(key: str) -> str:
+    """Metric key with characters that are reserved in the StatsD line format replaced."""
+    return _UNSAFE_NAME_CHARS.sub("_", key)
+
+
+class HistogramAggregate:
+    """Durations recorded for one metric during the current flush interval."""
+
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'reservoir')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float("inf")
+        self.maximum = 0.0
+        self.reservoir: List[float] = []
+
+
+def pack_datagrams(lines: List[str], max_packet_size: int) -> List[bytes]:
+    """Join newline-separated lines into as few datagrams of at most ``max_packet_size`` bytes as possible."""
+    packets: List[bytes] = []
+    current: List[bytes] = []
+    size = 0
+    for line in lines:
+        encoded = line.encode("utf-8")
+        if len(encoded) > max_packet_size:
+            continue
+        added = len(encoded) + (1 if current else 0)
+        if size + added > max_packet_size:
+            packets.append(b"\n".join(current))
+            current, size = [], 0
+            added = len(encoded)
+        current.append(encoded)
+        size += added
+    if current:
+        packets.append(b"\n".join(current))
+    return packets
+
+
+class StatsDExporter:
+    """
+    Aggregates the shared metrics registry and pushes it over UDP in the StatsD line format.
+
+    Usage:
+        exporter = StatsDExporter(host="statsd.monitoring", prefix="complianceflow")
+        exporter.start()
+        ...
+        exporter.stop()  # final flush
+
+    Counter deltas come from diffing ``MetricsCollector.counters`` at flush
+    time, so increment_counter pays nothing extra. Series folded into an
+    overflow series by the cardinality guard are reported by a fold listener,
+    so their already-pushed value is not pushed again as part of the overflow.
+    Durations arrive through a duration listener and are folded into
+    per-interval aggregates.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_STATSD_PORT,
+        prefix: str = "",
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+        max_packet_size: int = DEFAULT_MAX_PACKET_SIZE,
+        reservoir_size: int = DEFAULT_RESERVOIR_SIZE
+    ):
+        self.host = host
+        self.port = port
+        self.prefix = f"{statsd_name(prefix)}." if prefix else ""
+        self.flush_interval = flush_interval
+        self.max_packet_size = max_packet_size
+        self.reservoir_size = reservoir_size
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, HistogramAggregate] = {}
+        # service name -> counter values at the previous flush
+        self._previous_counters: Dict[str, Dict[str, int]] = {}
+        # (series key, overflow key) folded since the previous flush, in order
+        self._folds: List[Tuple[str, str]] = []
+        self._flush_lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._address: Optional[Tuple[Any, ...]] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "flushes": 0,
+            "packets_sent": 0,
+            "bytes_sent": 0,
+            "lines_sent": 0,
+            "dropped_lines": 0,
+            "send_errors": 0,
+            "last_flush_duration_ms": 0.0
+        }
+
+    def observe(self, key: str, duration: float):
+        """Fold one duration (seconds) into the current interval; registered as a duration listener."""
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = HistogramAggregate()
+            histogram.count += 1
+            histogram.total += duration
+            if duration < histogram.minimum:
+                histogram.minimum = duration
+            if duration > histogram.maximum:
+                histogram.maximum = duration
+            if len(histogram.reservoir) < self.reservoir_size:
+                histogram.reservoir.append(duration)
+            else:
+                slot = random.randrange(histogram.count)
+                if slot < self.reservoir_size:
+                    histogram.reservoir[slot] = duration
+
+    def observe_fold(self, series_key: str, overflow_key: str):
+        """Note a series folded into an overflow series; registered as a fold listener."""
+        with self._lock:
+            self._folds.append((series_key, overflow_key))
+
+    def _counter_lines(self) -> List[str]:
+        lines = []
+        for service_name, collector in list(_collectors.items()):
+            # Folds happen under the counter lock, so the copy and the folds agree
+            with collector._counter_lock:
+                current = dict(collector.counters)
+                with self._lock:
+                    folds = [fold for fold in self._folds if fold[1] in current]
+                    if folds:
+                        self._folds = [fold for fold in self._folds if fold[1] not in current]
+
+            # The reported part of a folded series' value now sits in the
+            # overflow series, and the series restarts from zero if re-admitted
+            baseline = dict(self._previous_counters.get(service_name, {}))
+            for series_key, overflow_key in folds:
+                baseline[overflow_key] = baseline.get(overflow_key, 0) + baseline.pop(series_key, 0)
+
+            for key, value in current.items():
+                delta = value - baseline.get(key, 0)
+                if delta < 0:
+                    # Collector was reset since the previous flush
+                    delta = value
+                if delta > 0:
+                    lines.append(f"{self.prefix}{statsd_name(key)}:{delta}|c")
+            self._previous_counters[service_name] = current
+        return lines
+
+    def _histogram_lines(self) -> List[str]:
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+        lines = []
+        for key, histogram in histograms.items():
+            name = f"{self.prefix}{statsd_name(key)}"
+            samples = sorted(histogram.reservoir)
+            lines.append(f"{name}.count:{histogram.count}|c")
+            lines.append(f"{name}.sum:{round(histogram.total * 1000, 3)}|c")
+            lines.append(f"{name}.min:{round(histogram.minimum * 1000, 3)}|g")
+            lines.append(f"{name}.max:{round(histogram.maximum * 1000, 3)}|g")
+            for percentile in HISTOGRAM_PERCENTILES:
+                index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+                lines.append(f"{name}.p{percentile}:{round(samples[index] * 1000, 3)}|g")
+        return lines
+
+    def flush(self) -> int:
+        """Send everything aggregated since the last flush; returns the number of datagrams sent."""
+        with self._flush_lock:
+            started = time.perf_counter()
+            lines = self._counter_lines() + self._histogram_lines()
+            packets = pack_datagrams(lines, self.max_packet_size)
+            packed_lines = sum(packet.count(b"\n") + 1 for packet in packets)
+
+            sent = 0
+            for packet in packets:
+                try:
+                    self._send(packet)
+                    sent += 1
+                    self._stats["bytes_sent"] += len(packet)
+                except OSError as e:
+                    self._stats["send_errors"] += 1
+                    logger.warning(
+                        "StatsD datagram send failed",
+                        extra={
+                            "custom_dimensions": {
+                                "host": self.host,
+                                "port": self.port,
+                                "error": str(e),
+                                "error_type": type(e).__name__
+                            }
+                        }
+                    )
+
+            self._stats["flushes"] += 1
+            self._stats["packets_sent"] += sent
+            self._stats["lines_sent"] += packed_lines
+            self._stats["dropped_lines"] += len(lines) - packed_lines
+            self._stats["last_flush_duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            return sent
+
+    def _send(self, packet: bytes):
+        if self._socket is None or self._address is None:
+            family, socktype, proto, _, address = socket.getaddrinfo(
+                self.host, self.port, type=socket.SOCK_DGRAM
+            )[0]
+            self._socket = socket.socket(family, socktype, proto)
+            self._address = address
+        self._socket.sendto(packet, self._address)
+
+    def get_stats(self) -> dict:
+        with self._flush_lock:
+            return {
+                "host": self.host,
+                "port": self.port,
+                "flush_interval": self.flush_interval,
+                "max_packet_size": self.max_packet_size,
+                "running": self._thread is not None and self._thread.is_alive(),
+                **self._stats
+            }
+
+    def start(self):
+        """Start receiving durations and the background flush thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # Counters accumulated before start are not pushed as one huge delta
+        for service_name, collector in list(_collectors.items()):
+            with collector._counter_lock:
+                self._previous_counters[service_name] = dict(collector.counters)
+        with self._lock:
+            self._folds = []
+        add_fold_listener(self.observe_fold)
+        add_duration_listener(self.observe)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="statsd-exporter-flush", daemon=True)
+        self._thread.start()
+        logger.info(
+            "StatsD exporter started",
+            extra={
+                "custom_dimensions": {
+                    "host": self.host,
+                    "port": self.port,
+                    "flush_interval": self.flush_interval
+                }
+            }
+        )
+
+    def stop(self):
+        """Stop the background thread, flush whatever is pending and close the socket."""
+        remove_duration_listener(self.observe)
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval)
+            self._thread = None
+        self.flush()
+        remove_fold_listener(self.observe_fold)
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(
+                    "StatsD exporter flush failed",
+                    extra={"custom_dimensions": {"error": str(e), "error_type": type(e).__name__}}
+                )
@@ -0,0 +1,290 @@
+"""
+Per-tenant usage metering for billing and capacity planning.
+
+Request wall time, CPU time, database time (from ``database_operation``) and
+outbound call time (from ``external_service_call``) are attributed to the
+tenant of the current request, aggregated in memory and flushed as compact
+rollups.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Tenant label for requests that never authenticated
+ANONYMOUS_TENANT = "anonymous"
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 60.0
+
+
+class RequestUsage:
+    """Mutable usage accumulator shared by everything running inside one request."""
+
+    __slots__ = ('tenant_id', 'cpu_start', 'db_time', 'db_calls', 'external_time', 'external_calls')
+
+    def __init__(self):
+        self.tenant_id: Optional[str] = None
+        self.cpu_start = 0.0
+        self.db_time = 0.0
+        self.db_calls = 0
+        self.external_time = 0.0
+        self.external_calls = 0
+
+
+# The same RequestUsage object is visible from copied contexts (thread pool
+# dependencies, background tasks), so updates made there are not lost.
+_current_usage: ContextVar[Optional[RequestUsage]] = ContextVar("current_usage", default=None)
+
+
+def set_current_tenant(tenant_id: str):
+    """Attribute the current request to a tenant (call once the token is validated)."""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.tenant_id = str(tenant_id)
+
+
+def record_db_time(duration: float):
+    """Add database time in seconds to the current request."""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.db_time += duration
+        usage.db_calls += 1
+
+
+def record_external_time(duration: float):
+    """Add outbound service call time in seconds to the current request."""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.external_time += duration
+        usage.external_calls += 1
+
+
+class CpuShareClock:
+    """
+    Per-request share of one thread's CPU time.
+
+    Requests served by an event loop interleave on the same thread, so a plain
+    ``time.thread_time()`` delta would charge each request for the work of
+    every request that overlapped it. This clock advances by the CPU time used
+    divided by the number of requests in flight, and a request is charged the
+    clock's advance between ``enter`` and ``leave``. CPU used while nothing
+    is in flight (background tasks, flushes, accepting connections) is not
+    charged to any request, and neither is CPU spent in other threads
+    (thread pool dependencies).
+    """
+
+    __slots__ = ('active', 'share', 'last_cpu')
+
+    def __init__(self):
+        self.active = 0
+        self.share = 0.0
+        self.last_cpu = time.thread_time()
+
+    def enter(self) -> float:
+        """Start charging a request; returns the mark to pass to ``leave``."""
+        now = time.thread_time()
+        active = self.active
+        if active:
+            self.share += (now - self.last_cpu) / active
+        self.last_cpu = now
+        self.active = active + 1
+        return self.share
+
+    def leave(self, mark: float) -> float:
+        """Stop charging a request; returns its CPU time in seconds."""
+        now = time.thread_time()
+        active = self.active
+        self.share += (now - self.last_cpu) / active
+        self.last_cpu = now
+        self.active = active - 1
+        return self.share - mark
+
+
+class JsonLinesUsageSink:
+    """
+    Append rollups to a local JSON lines file.
+
+    A relative ``path`` is resolved against the working directory once, at
+    construction; the file's directory is created on the first write.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+
+    def __call__(self, rollups: List[dict]):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            for rollup in rollups:
+                f.write(json.dumps(rollup) + "\n")
+
+
+class KafkaUsageSink:
+    """Publish rollups to a Kafka topic through a confluent-kafka producer."""
+
+    def __init__(self, producer, topic: str = "user.usage.metered"):
+        self.producer = producer
+        self.topic = topic
+
+    def __call__(self, rollups: List[dict]):
+        for rollup in rollups:
+            self.producer.produce(self.topic, key=rollup["tenant_id"], value=json.dumps(rollup))
+        self.producer.poll(0)
+
+
+class UsageMeter:
+    """
+    Aggregates per-tenant usage in memory and flushes rollups every ``flush_interval``.
+
+    Usage:
+        meter = UsageMeter(sink=JsonLinesUsageSink("/var/log/usage.jsonl"))
+        meter.start()
+
+        token, usage = meter.begin()
+        try:
+            ...  # handle the request
+        finally:
+            meter.end(token, usage, wall_time)
+
+    Each thread calling ``end`` keeps its own running totals, written by that
+    thread only, so the request path takes no lock. ``flush`` reads a copy
+    of every thread's totals and reports the change since the previous flush;
+    a request ending during the copy may be split across two windows, but
+    nothing is lost or counted twice.
+    """
+
+    def __init__(
+        self,
+        sink: Optional[Callable[[List[dict]], None]] = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+        service_name: str = "unknown"
+    ):
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        # One totals dict per thread calling end:
+        # tenant_id -> [requests, wall_time, db_time, db_calls, external_time, external_calls, cpu_time]
+        self._thread_totals: List[Dict[str, List[float]]] = []
+        # Sum of every thread's totals as of the last flush
+        self._flushed: Dict[str, List[float]] = {}
+        self._window_start = time.time()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Per thread: its CpuShareClock (the event loop's) and its totals
+        self._local = threading.local()
+
+    def _register_thread(self) -> CpuShareClock:
+        totals: Dict[str, List[float]] = {}
+        with self._lock:
+            self._thread_totals.append(totals)
+        self._local.totals = totals
+        clock = self._local.clock = CpuShareClock()
+        return clock
+
+    def begin(self):
+        """Open a usage scope for a request; returns (token, usage)."""
+        usage = RequestUsage()
+        clock = getattr(self._local, 'clock', None) or self._register_thread()
+        usage.cpu_start = clock.enter()
+        return _current_usage.set(usage), usage
+
+    def end(self, token, usage: RequestUsage, wall_time: float, tenant_id: Optional[str] = None):
+        """Close a usage scope and fold it into the current rollup window."""
+        _current_usage.reset(token)
+        local = self._local
+        cpu_time = local.clock.leave(usage.cpu_start)
+        tenant = usage.tenant_id or tenant_id or ANONYMOUS_TENANT
+
+        totals = local.totals.get(tenant)
+        if totals is None:
+            totals = local.totals[tenant] = [0, 0.0, 0.0, 0, 0.0, 0, 0.0]
+        totals[0] += 1
+        totals[1] += wall_time
+        totals[2] += usage.db_time
+        totals[3] += usage.db_calls
+        totals[4] += usage.external_time
+        totals[5] += usage.external_calls
+        totals[6] += cpu_time
+
+    def flush(self) -> List[dict]:
+        """Emit one rollup per tenant for the window since the last flush."""
+        with self._lock:
+            current: Dict[str, List[float]] = {}
+            for thread_totals in self._thread_totals:
+                # dict.copy and list() are atomic, so the owning thread can keep writing
+                for tenant, values in thread_totals.copy().items():
+                    summed = current.get(tenant)
+                    if summed is None:
+                        current[tenant] = list(values)
+                    else:
+                        for index, value in enumerate(list(values)):
+                            summed[index] += value
+            flushed, self._flushed = self._flushed, current
+            window_start, self._window_start = self._window_start, time.time()
+        window_end = self._window_start
+
+        rollups = []
+        for tenant, values in current.items():
+            previous = flushed.get(tenant)
+            if previous is not None:
+                values = [value - before for value, before in zip(values, previous)]
+            if not any(values):
+                continue
+            rollups.append({
+                "service": self.service_name,
+                "tenant_id": tenant,
+                "window_start": datetime.utcfromtimestamp(window_start).isoformat(),
+                "window_end": datetime.utcfromtimestamp(window_end).isoformat(),
+                "requests": int(values[0]),
+                "wall_time_ms": round(values[1] * 1000, 3),
+                "cpu_time_ms": round(values[6] * 1000, 3),
+                "db_time_ms": round(values[2] * 1000, 3),
+                "db_calls": int(values[3]),
+                "external_time_ms": round(values[4] * 1000, 3),
+                "external_calls": int(values[5])
+            })
+
+        if rollups and self.sink is not None:
+            try:
+                self.sink(rollups)
+            except Exception as e:
+                logger.error(
+                    "Usage rollup flush failed",
+                    extra={
+                        "custom_dimensions": {
+                            "service": self.service_name,
+                            "tenants": len(rollups),
+                            "error": str(e),
+                            "error_type": type(e).__name__
+                        }
+                    }
+                )
+
+        return rollups
+
+    def start(self):
+        """Start the background flush thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-meter-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush whatever is pending."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
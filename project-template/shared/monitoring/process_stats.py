@@ -0,0 +1,289 @@
+"""
+Lightweight process statistics without psutil.
+
+``ProcessStatsCollector`` reads ``/proc/self/{statm,stat,status,fd}`` on a
+background interval and serves the last snapshot from cache, so /metrics
+never touches the filesystem. Memory percent is relative to the container's
+cgroup memory limit when one is set, else to the host's MemTotal. ``GcPauseTracker`` hooks ``gc.callbacks`` to
+build per-generation pause histograms.
+"""
+
+import gc
+import os
+import sys
+import time
+import logging
+import threading
+from bisect import bisect_left
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_INTERVAL_SECONDS = 5.0
+
+DEFAULT_CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Memory limit files under the cgroup root: v2 unified hierarchy, then v1
+CGROUP_MEMORY_LIMIT_FILES = ("memory.max", "memory/memory.limit_in_bytes")
+
+# cgroup v1 reports "no limit" as a huge page-aligned value instead of "max"
+_UNLIMITED_CGROUP_BYTES = 1 << 60
+
+# Upper bounds (ms) of the GC pause histogram buckets; the last bucket is unbounded
+GC_PAUSE_BUCKETS_MS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0)
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+    _CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+    _CLOCK_TICKS = 100
+
+
+class GenerationPauses:
+    """Pause histogram for one GC generation."""
+
+    __slots__ = ('collections', 'total_ns', 'max_ns', 'collected', 'uncollectable', 'buckets')
+
+    def __init__(self):
+        self.collections = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.collected = 0
+        self.uncollectable = 0
+        self.buckets = [0] * (len(GC_PAUSE_BUCKETS_MS) + 1)
+
+
+class GcPauseTracker:
+    """
+    Records the duration of every garbage collection through ``gc.callbacks``.
+
+    Collections never overlap (the collector holds the GIL), so the callback
+    keeps a single start timestamp and needs no lock.
+    """
+
+    def __init__(self):
+        self._bounds_ns = [int(bound * 1_000_000) for bound in GC_PAUSE_BUCKETS_MS]
+        self._generations = [GenerationPauses() for _ in range(3)]
+        self._started_ns = 0
+        self.installed = False
+
+    def _callback(self, phase: str, info: dict):
+        if phase == "start":
+            self._started_ns = time.perf_counter_ns()
+            return
+        pause_ns = time.perf_counter_ns() - self._started_ns
+        pauses = self._generations[info.get("generation", 0)]
+        pauses.collections += 1
+        pauses.total_ns += pause_ns
+        if pause_ns > pauses.max_ns:
+            pauses.max_ns = pause_ns
+        pauses.collected += info.get("collected", 0)
+        pauses.uncollectable += info.get("uncollectable", 0)
+        pauses.buckets[bisect_left(self._bounds_ns, pause_ns)] += 1
+
+    def install(self):
+        if not self.installed:
+            gc.callbacks.append(self._callback)
+            self.installed = True
+
+    def uninstall(self):
+        if self.installed:
+            gc.callbacks.remove(self._callback)
+            self.installed = False
+
+    def get_summary(self) -> Dict[str, dict]:
+        summary = {}
+        for generation, pauses in enumerate(self._generations):
+            buckets = list(pauses.buckets)
+            summary[f"gen{generation}"] = {
+                "collections": pauses.collections,
+                "pause_total_ms": round(pauses.total_ns / 1e6, 3),
+                "pause_max_ms": round(pauses.max_ns / 1e6, 3),
+                "pause_avg_ms": round(pauses.total_ns / pauses.collections / 1e6, 4) if pauses.collections else 0.0,
+                "collected": pauses.collected,
+                "uncollectable": pauses.uncollectable,
+                "pause_histogram_ms": {
+                    **{f"le_{bound}": count for bound, count in zip(GC_PAUSE_BUCKETS_MS, buckets)},
+                    "le_inf": buckets[-1]
+                }
+            }
+        return summary
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _read_cgroup_memory_limit(cgroup_root: str) -> Optional[int]:
+    for name in CGROUP_MEMORY_LIMIT_FILES:
+        value = _read(os.path.join(cgroup_root, name))
+        if value is None:
+            continue
+        value = value.strip()
+        if value == "max" or not value.isdigit() or int(value) >= _UNLIMITED_CGROUP_BYTES:
+            return None
+        return int(value)
+    return None
+
+
+def _read_total_memory(proc_root: str, cgroup_root: str = DEFAULT_CGROUP_ROOT) -> Optional[int]:
+    """Memory available to the process: the cgroup limit if below MemTotal, else MemTotal."""
+    total = None
+    meminfo = _read(os.path.join(os.path.dirname(proc_root), "meminfo"))
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith("MemTotal:"):
+                total = int(line.split()[1]) * 1024
+                break
+    limit = _read_cgroup_memory_limit(cgroup_root)
+    if limit is not None and (total is None or limit < total):
+        return limit
+    return total
+
+
+def read_process_stats(proc_root: str = "/proc/self") -> Optional[dict]:
+    """One reading of ``/proc/<pid>``; None where procfs is unavailable."""
+    statm = _read(os.path.join(proc_root, "statm"))
+    stat = _read(os.path.join(proc_root, "stat"))
+    if statm is None or stat is None:
+        return None
+
+    size_pages, resident_pages, shared_pages = (int(value) for value in statm.split()[:3])
+    # The command name may contain spaces and parentheses; fields follow the last ')'
+    fields = stat[stat.rfind(")") + 2:].split()
+    user_ticks, system_ticks = int(fields[11]), int(fields[12])
+
+    stats: Dict[str, Optional[float]] = {
+        "rss_bytes": resident_pages * _PAGE_SIZE,
+        "vms_bytes": size_pages * _PAGE_SIZE,
+        "shared_bytes": shared_pages * _PAGE_SIZE,
+        "cpu_user_seconds": user_ticks / _CLOCK_TICKS,
+        "cpu_system_seconds": system_ticks / _CLOCK_TICKS,
+        "threads": int(fields[17]),
+    }
+
+    status = _read(os.path.join(proc_root, "status")) or ""
+    for line in status.splitlines():
+        name, _, value = line.partition(":")
+        if name == "VmHWM":
+            stats["rss_peak_bytes"] = int(value.split()[0]) * 1024
+        elif name == "voluntary_ctxt_switches":
+            stats["voluntary_context_switches"] = int(value)
+        elif name == "nonvoluntary_ctxt_switches":
+            stats["involuntary_context_switches"] = int(value)
+
+    try:
+        stats["open_fds"] = len(os.listdir(os.path.join(proc_root, "fd")))
+    except OSError:
+        stats["open_fds"] = None
+    return stats
+
+
+def _read_rusage_stats() -> dict:
+    """Fallback for platforms without procfs (macOS development machines)."""
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return {
+        "rss_peak_bytes": peak,
+        "cpu_user_seconds": usage.ru_utime,
+        "cpu_system_seconds": usage.ru_stime,
+        "threads": threading.active_count(),
+    }
+
+
+class ProcessStatsCollector:
+    """
+    Process statistics refreshed on a background thread and served from cache.
+
+    ``percent`` is RSS over the cgroup memory limit under ``cgroup_root``
+    (what the container is killed at), or over MemTotal without one.
+
+    Usage:
+        process_stats = ProcessStatsCollector(refresh_interval=5.0)
+        process_stats.start()
+        process_stats.get_stats()  # no I/O
+        process_stats.stop()
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL_SECONDS,
+        proc_root: str = "/proc/self",
+        cgroup_root: str = DEFAULT_CGROUP_ROOT
+    ):
+        self.refresh_interval = refresh_interval
+        self.proc_root = proc_root
+        self.gc_pauses = GcPauseTracker()
+        self._total_memory = _read_total_memory(proc_root, cgroup_root)
+        self._snapshot: Optional[dict] = None
+        self._previous_cpu: Optional[tuple] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> dict:
+        """Take a new reading and replace the cached snapshot."""
+        now = time.monotonic()
+        stats = read_process_stats(self.proc_root)
+        source = "procfs"
+        if stats is None:
+            stats = _read_rusage_stats()
+            source = "rusage"
+
+        cpu_seconds = stats["cpu_user_seconds"] + stats["cpu_system_seconds"]
+        if self._previous_cpu is not None:
+            previous_cpu_seconds, previous_at = self._previous_cpu
+            elapsed = now - previous_at
+            stats["cpu_percent"] = round((cpu_seconds - previous_cpu_seconds) / elapsed * 100, 2) if elapsed > 0 else 0.0
+        self._previous_cpu = (cpu_seconds, now)
+
+        if self._total_memory and "rss_bytes" in stats:
+            stats["percent"] = round(stats["rss_bytes"] / self._total_memory * 100, 3)
+
+        stats["gc_counts"] = list(gc.get_count())
+        stats["gc_thresholds"] = list(gc.get_threshold())
+        stats["source"] = source
+        stats["refreshed_at"] = time.time()
+        # Replaced in one assignment, so readers never see a partial snapshot
+        self._snapshot = stats
+        return stats
+
+    def get_stats(self) -> dict:
+        """The cached snapshot (taken now if nothing has been read yet), with GC pause histograms."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return {**snapshot, "gc": self.gc_pauses.get_summary()}
+
+    def start(self):
+        """Install the GC callback and start the refresh thread."""
+        self.gc_pauses.install()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.refresh()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="process-stats-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.refresh_interval)
+            self._thread = None
+        self.gc_pauses.uninstall()
+
+    def _run(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(
+                    "Process stats refresh failed",
+                    extra={"custom_dimensions": {"error": str(e), "error_type": type(e).__name__}}
+                )
@@ -0,0 +1,293 @@
+"""
+On-demand statistical stack sampler.
+
+A background thread snapshots the stacks of every thread (and, optionally,
+every suspended asyncio task running a ``trace_function`` operation) at a
+fixed interval. Samples are annotated with the ``trace_function`` operations
+active on the sampled thread or task and exported as collapsed stacks
+(flamegraph.pl / speedscope import) or as a speedscope JSON document.
+
+The sampler never calls into asyncio from its own thread: the tasks it knows
+about are the keys of ``_active_operations``, which the loop maintains itself,
+and the task running on the loop is the one whose coroutine frame is on the
+loop thread's stack.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_SECONDS = 0.01
+MAX_STACK_DEPTH = 128
+
+# Active trace_function operations keyed by asyncio task (code running on an
+# event loop) or thread id (everything else). Read by the sampler thread.
+_active_operations: Dict[Any, List[str]] = {}
+
+# Only one sampler may run at a time
+_sampler_lock = threading.Lock()
+
+
+def _execution_key():
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task if task is not None else threading.get_ident()
+
+
+def push_operation(operation_name: str):
+    """Mark an operation as active for the current task or thread; returns the key for pop_operation."""
+    key = _execution_key()
+    stack = _active_operations.get(key)
+    if stack is None:
+        stack = _active_operations[key] = []
+    stack.append(operation_name)
+    return key
+
+
+def pop_operation(key):
+    """Unmark the innermost operation pushed under ``key``."""
+    stack = _active_operations.get(key)
+    if stack:
+        stack.pop()
+        if not stack:
+            del _active_operations[key]
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _thread_stack(frame) -> List[str]:
+    """Frame labels from the outermost call to ``frame``."""
+    labels: List[str] = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def coroutine_stack(coro) -> List[str]:
+    """Frame labels along a suspended coroutine's await chain, outermost first."""
+    labels: List[str] = []
+    while coro is not None and len(labels) < MAX_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return labels
+
+
+def _running_task(frame, tasks: List[Any]) -> Any:
+    """The task among ``tasks`` whose coroutine frame is on the stack ending at ``frame``."""
+    if not tasks:
+        return None
+    frames = set()
+    while frame is not None:
+        frames.add(frame)
+        frame = frame.f_back
+    for task in tasks:
+        if getattr(task.get_coro(), "cr_frame", None) in frames:
+            return task
+    return None
+
+
+class StackProfile:
+    """Aggregated samples: collapsed stack tuple -> sample count."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at = time.time()
+        self.duration = 0.0
+
+    def to_collapsed(self) -> str:
+        """Brendan Gregg collapsed-stack text, one ``frame;frame;frame count`` line per stack."""
+        return "\n".join(
+            f"{';'.join(stack)} {count}"
+            for stack, count in self.samples.most_common()
+        ) + "\n"
+
+    def to_speedscope(self, name: str = "profile") -> dict:
+        """A speedscope sampled profile per thread or task group."""
+        frames: List[dict] = []
+        frame_index: Dict[str, int] = {}
+        profiles: Dict[str, dict] = {}
+
+        for stack, count in self.samples.items():
+            root, rest = stack[0], stack[1:]
+            indices = []
+            for label in rest:
+                index = frame_index.get(label)
+                if index is None:
+                    index = frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indices.append(index)
+
+            profile = profiles.get(root)
+            if profile is None:
+                profile = profiles[root] = {
+                    "type": "sampled",
+                    "name": root,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": 0,
+                    "samples": [],
+                    "weights": []
+                }
+            profile["samples"].append(indices)
+            profile["weights"].append(count * self.interval)
+            profile["endValue"] += count * self.interval
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "shared.monitoring.profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": sorted(profiles.values(), key=lambda p: p["endValue"], reverse=True)
+        }
+
+
+class StackSampler:
+    """
+    Samples all thread stacks (and optionally asyncio task stacks) from a daemon thread.
+
+    With ``loop``, ``start`` must be called on the loop's thread (as
+    ``sample_for`` does), so samples of that thread are attributed to the
+    running task.
+
+    Usage:
+        sampler = StackSampler(interval=0.01, loop=asyncio.get_running_loop(), include_tasks=True)
+        sampler.start()
+        await asyncio.sleep(10)
+        profile = sampler.stop()
+        text = profile.to_collapsed()
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_INTERVAL_SECONDS,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        include_tasks: bool = False
+    ):
+        self.interval = interval
+        self.loop = loop
+        self.include_tasks = include_tasks
+        self.profile = StackProfile(interval)
+        self._loop_thread_id: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start sampling; raises RuntimeError if another sampler is running."""
+        if not _sampler_lock.acquire(blocking=False):
+            raise RuntimeError("A profiling session is already running")
+        # Recorded from inside the loop; uvloop has no _thread_id to read
+        self._loop_thread_id = threading.get_ident() if self.loop is not None else None
+        self.profile = StackProfile(self.interval)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> StackProfile:
+        """Stop sampling and return the aggregated profile."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            _sampler_lock.release()
+        self.profile.duration = time.time() - self.profile.started_at
+        return self.profile
+
+    def _run(self):
+        own_id = threading.get_ident()
+        next_sample = time.perf_counter()
+        while not self._stop_event.is_set():
+            try:
+                self.sample(own_id)
+            except Exception as e:
+                logger.debug(f"Stack sample failed: {e}")
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay < 0:
+                # Fell behind (GIL contention); skip missed ticks instead of bursting
+                next_sample = time.perf_counter()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def sample(self, own_id: Optional[int] = None):
+        """Take one sample of every thread and task."""
+        profile = self.profile
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        # Tasks with active operations, as published by the loop (list() copies atomically)
+        tasks: List[Any] = []
+        if self.loop is not None:
+            tasks = [key for key in list(_active_operations) if not isinstance(key, int)]
+        running_task: Any = None
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            key: Any = thread_id
+            if thread_id == self._loop_thread_id:
+                running_task = _running_task(frame, tasks)
+                if running_task is not None:
+                    key = running_task
+            stack = [f"thread:{thread_names.get(thread_id, thread_id)}"]
+            stack.extend(f"[{operation}]" for operation in tuple(_active_operations.get(key, ())))
+            stack.extend(_thread_stack(frame))
+            profile.samples[tuple(stack)] += 1
+
+        if self.include_tasks:
+            for task in tasks:
+                if task is running_task or task.done():
+                    continue
+                stack = [f"task:{task.get_name()}"]
+                stack.extend(f"[{operation}]" for operation in tuple(_active_operations.get(task, ())))
+                stack.extend(coroutine_stack(task.get_coro()))
+                profile.samples[tuple(stack)] += 1
+
+        profile.sample_count += 1
+
+
+async def sample_for(
+    seconds: float,
+    interval: float = DEFAULT_INTERVAL_SECONDS,
+    include_tasks: bool = True
+) -> StackProfile:
+    """Sample the current process for ``seconds`` from within a running event loop."""
+    sampler = StackSampler(interval=interval, loop=asyncio.get_running_loop(), include_tasks=include_tasks)
+    sampler.start()
+    logger.info(
+        "Profiling session started",
+        extra={"custom_dimensions": {"seconds": seconds, "interval_ms": interval * 1000}}
+    )
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = sampler.stop()
+    logger.info(
+        "Profiling session finished",
+        extra={
+            "custom_dimensions": {
+                "samples": profile.sample_count,
+                "unique_stacks": len(profile.samples),
+                "duration_seconds": profile.duration
+            }
+        }
+    )
+    return profile
@@ -0,0 +1,231 @@
+"""
+Per-request query instrumentation.
+
+SQL statements are normalised into fingerprints (literals and bind
+parameters replaced by ``?``), counted per request, and flagged as N+1
+patterns when the same fingerprint runs more than a threshold number of
+times in one request. Process-wide totals surface the most expensive
+fingerprints.
+"""
+
+import re
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+DEFAULT_MAX_FINGERPRINTS = 500
+MAX_FINGERPRINT_LENGTH = 1000
+
+# Fingerprint used once the fingerprint cap has been reached
+OVERFLOW_FINGERPRINT = "<other>"
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+# $1 (asyncpg), %(name)s / %s (psycopg), :name (SQLAlchemy text) but not ::casts
+_PARAM_RE = re.compile(r"\$\d+|%\(\w+\)s|%s|(?<!:):\w+")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_VALUES_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint_sql(sql: str) -> str:
+    """
+    Normalise a SQL statement so that executions differing only in values share a fingerprint.
+
+    Usage:
+        fingerprint_sql("SELECT * FROM users WHERE id = 42 AND tenant_id = 'abc'")
+        # -> "select * from users where id = ? and tenant_id = ?"
+    """
+    normalised = _COMMENT_RE.sub(" ", sql)
+    normalised = _STRING_RE.sub("?", normalised)
+    normalised = _PARAM_RE.sub("?", normalised)
+    normalised = _NUMBER_RE.sub("?", normalised)
+    normalised = _IN_LIST_RE.sub("in (?+)", normalised)
+    normalised = _VALUES_RE.sub("(?+)", normalised)
+    normalised = _WHITESPACE_RE.sub(" ", normalised).strip().lower()
+    return normalised[:MAX_FINGERPRINT_LENGTH]
+
+
+class QueryProfile:
+    """Queries executed by one request: fingerprint -> [count, total_ns]."""
+
+    __slots__ = ('queries', 'total_queries')
+
+    def __init__(self):
+        self.queries: Dict[str, List[int]] = {}
+        self.total_queries = 0
+
+
+_current_profile: ContextVar[Optional[QueryProfile]] = ContextVar("current_query_profile", default=None)
+
+
+def record_query(fingerprint: str, duration_ns: int):
+    """Record one executed query against the current request, if any."""
+    profile = _current_profile.get()
+    if profile is None:
+        return
+    entry = profile.queries.get(fingerprint)
+    if entry is None:
+        profile.queries[fingerprint] = [1, duration_ns]
+    else:
+        entry[0] += 1
+        entry[1] += duration_ns
+    profile.total_queries += 1
+
+
+class QueryTracker:
+    """
+    Aggregates per-request query profiles and detects N+1 patterns.
+
+    Usage:
+        tracker = QueryTracker(n_plus_one_threshold=10)
+
+        token, profile = tracker.begin()
+        try:
+            ...  # handle the request; database_operation() records queries
+        finally:
+            tracker.end(token, profile, route="GET /api/v1/users/")
+    """
+
+    def __init__(
+        self,
+        n_plus_one_threshold: int = DEFAULT_N_PLUS_ONE_THRESHOLD,
+        max_fingerprints: int = DEFAULT_MAX_FINGERPRINTS
+    ):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all accumulated statistics."""
+        with self._lock:
+            # fingerprint -> [executions, total_ns, max executions in one request]
+            self._fingerprints: Dict[str, List[int]] = {}
+            # (route, fingerprint) -> [requests flagged, max executions in one request]
+            self._n_plus_one: Dict[tuple, List[int]] = {}
+            self._requests = 0
+            self._queries = 0
+            self._max_queries_per_request = 0
+
+    def begin(self):
+        """Open a query profile for a request; returns (token, profile)."""
+        profile = QueryProfile()
+        return _current_profile.set(profile), profile
+
+    def end(self, token, profile: QueryProfile, route: str = "unknown") -> List[str]:
+        """Close a request profile, merge it and return the fingerprints flagged as N+1."""
+        _current_profile.reset(token)
+
+        flagged = [
+            fingerprint
+            for fingerprint, (count, _) in profile.queries.items()
+            if count > self.n_plus_one_threshold
+        ]
+
+        with self._lock:
+            self._requests += 1
+            self._queries += profile.total_queries
+            if profile.total_queries > self._max_queries_per_request:
+                self._max_queries_per_request = profile.total_queries
+
+            for fingerprint, (count, total_ns) in profile.queries.items():
+                stats = self._fingerprints.get(fingerprint)
+                if stats is None:
+                    if len(self._fingerprints) >= self.max_fingerprints:
+                        fingerprint = OVERFLOW_FINGERPRINT
+                        stats = self._fingerprints.get(fingerprint)
+                    if stats is None:
+                        stats = self._fingerprints[fingerprint] = [0, 0, 0]
+                stats[0] += count
+                stats[1] += total_ns
+                if count > stats[2]:
+                    stats[2] = count
+
+            for fingerprint in flagged:
+                key = (route, fingerprint)
+                finding = self._n_plus_one.get(key)
+                if finding is None:
+                    if len(self._n_plus_one) >= self.max_fingerprints:
+                        continue
+                    finding = self._n_plus_one[key] = [0, 0]
+                finding[0] += 1
+                finding[1] = max(finding[1], profile.queries[fingerprint][0])
+
+        for fingerprint in flagged:
+            logger.warning(
+                f"Possible N+1 query pattern in {route}",
+                extra={
+                    "custom_dimensions": {
+                        "route": route,
+                        "fingerprint": fingerprint,
+                        "executions": profile.queries[fingerprint][0],
+                        "threshold": self.n_plus_one_threshold
+                    }
+                }
+            )
+
+        return flagged
+
+    def get_summary(self, limit: int = 10) -> dict:
+        """Top fingerprints by total time, N+1 findings and queries per request."""
+        with self._lock:
+            fingerprints = sorted(self._fingerprints.items(), key=lambda x: x[1][1], reverse=True)[:limit]
+            n_plus_one = sorted(self._n_plus_one.items(), key=lambda x: x[1][0], reverse=True)[:limit]
+            requests = self._requests
+            queries = self._queries
+            max_queries = self._max_queries_per_request
+
+        return {
+            "requests_profiled": requests,
+            "queries_per_request_avg": round(queries / requests, 2) if requests else 0,
+            "queries_per_request_max": max_queries,
+            "top_fingerprints": [
+                {
+                    "fingerprint": fingerprint,
+                    "executions": executions,
+                    "total_time_ms": round(total_ns / 1e6, 3),
+                    "avg_time_ms": round(total_ns / executions / 1e6, 3),
+                    "max_executions_per_request": max_per_request
+                }
+                for fingerprint, (executions, total_ns, max_per_request) in fingerprints
+            ],
+            "n_plus_one": [
+                {
+                    "route": route,
+                    "fingerprint": fingerprint,
+                    "requests_flagged": flagged,
+                    "max_executions_per_request": max_executions
+                }
+                for (route, fingerprint), (flagged, max_executions) in n_plus_one
+            ]
+        }
+
+
+def instrument_sqlalchemy(engine):
+    """
+    Record every statement executed through a SQLAlchemy engine.
+
+    Works with async engines via ``engine.sync_engine``. Statements are
+    fingerprinted and attributed to the current request's query profile.
+    """
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_ns", []).append(time.perf_counter_ns())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_ns = conn.info["query_start_ns"].pop()
+        record_query(fingerprint_sql(statement), time.perf_counter_ns() - start_ns)
@@ -0,0 +1,342 @@
+"""
+Resilience primitives for outbound service calls.
+
+Each (service, endpoint) pair gets a ``ResiliencePolicy`` combining:
+- rolling latency percentiles that drive an adaptive timeout
+- a circuit breaker with a half-open probing state
+- a concurrency bulkhead
+- optional hedged requests fired once an attempt outlives the p95
+
+Only timeouts, connection errors and 5xx responses count against the circuit
+breaker; a 4xx or an error raised by the caller's own code means the service
+answered.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Policies kept at once; endpoints are caller-supplied, least recently used go first
+MAX_POLICIES = 1024
+
+# Base classes of HTTP client transport failures (httpx, aiohttp), matched by
+# name so neither client has to be installed
+TRANSPORT_ERROR_NAMES = frozenset({"TransportError", "ClientConnectionError"})
+
+
+class ServiceUnavailableError(Exception):
+    """Raised when a call is rejected before reaching the remote service."""
+
+    def __init__(self, service_name: str, endpoint: str, reason: str):
+        self.service_name = service_name
+        self.endpoint = endpoint
+        self.reason = reason
+        super().__init__(f"{service_name}{endpoint} unavailable: {reason}")
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """The circuit breaker for the endpoint is open."""
+
+    def __init__(self, service_name: str, endpoint: str):
+        super().__init__(service_name, endpoint, "circuit open")
+
+
+class BulkheadFullError(ServiceUnavailableError):
+    """No concurrency slot became free within the bulkhead wait time."""
+
+    def __init__(self, service_name: str, endpoint: str):
+        super().__init__(service_name, endpoint, "bulkhead full")
+
+
+def is_service_failure(error: BaseException) -> bool:
+    """Whether an error raised during a call says the remote service is unhealthy."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # httpx.HTTPStatusError and similar carry the response
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(error, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code >= 500
+    return any(cls.__name__ in TRANSPORT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class ResilienceConfig:
+    """Tuning for a ResiliencePolicy; every value can be overridden per endpoint."""
+
+    def __init__(
+        self,
+        min_timeout: float = 0.05,
+        max_timeout: float = 10.0,
+        timeout_multiplier: float = 3.0,
+        min_samples: int = 20,
+        window_size: int = 256,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+        max_concurrent: int = 50,
+        max_wait: float = 0.1,
+        hedge: bool = False,
+        max_hedge_ratio: float = 0.1
+    ):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+        self.window_size = window_size
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.hedge = hedge
+        self.max_hedge_ratio = max_hedge_ratio
+
+
+class LatencyTracker:
+    """Percentiles over the most recent ``window_size`` successful call latencies."""
+
+    def __init__(self, window_size: int = 256):
+        self.samples: deque = deque(maxlen=window_size)
+        self._sorted: Optional[list] = None
+
+    def observe(self, duration: float):
+        self.samples.append(duration)
+        self._sorted = None
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        index = min(len(self._sorted) - 1, int(q * len(self._sorted)))
+        return self._sorted[index]
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Opens after ``failure_threshold`` consecutive failures, rejects calls for
+    ``recovery_timeout`` seconds, then lets ``half_open_max_calls`` probes
+    through; a successful probe closes the circuit, a failed one reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+
+    def allow(self) -> bool:
+        """Whether a call may proceed; reserves a probe slot when half-open."""
+        if self.state == CIRCUIT_OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self.state = CIRCUIT_HALF_OPEN
+            self.half_open_calls = 0
+        if self.state == CIRCUIT_HALF_OPEN:
+            if self.half_open_calls >= self.half_open_max_calls:
+                return False
+            self.half_open_calls += 1
+        return True
+
+    def release_probe(self):
+        """Return an unused half-open probe slot (the call never reached the service)."""
+        if self.state == CIRCUIT_HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def record_success(self):
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.monotonic()
+
+
+class ResiliencePolicy:
+    """Adaptive timeout, circuit breaker, bulkhead and hedging for one (service, endpoint)."""
+
+    def __init__(self, service_name: str, endpoint: str, config: Optional[ResilienceConfig] = None):
+        self.service_name = service_name
+        self.endpoint = endpoint
+        self.config = config or ResilienceConfig()
+        self.latency = LatencyTracker(self.config.window_size)
+        self.breaker = CircuitBreaker(
+            self.config.failure_threshold,
+            self.config.recovery_timeout,
+            self.config.half_open_max_calls
+        )
+        self.in_flight = 0
+        self.calls = 0
+        self.hedged_calls = 0
+        self.timeouts = 0
+        self.rejections = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def timeout(self) -> float:
+        """Current timeout: a multiple of p99 once enough samples exist, clamped to [min, max]."""
+        if len(self.latency) < self.config.min_samples:
+            return self.config.max_timeout
+        adaptive = self.latency.percentile(0.99) * self.config.timeout_multiplier
+        return max(self.config.min_timeout, min(self.config.max_timeout, adaptive))
+
+    @property
+    def hedge_delay(self) -> Optional[float]:
+        """Delay before a hedged attempt (the p95), or None while hedging is unavailable."""
+        if not self.config.hedge or len(self.latency) < self.config.min_samples:
+            return None
+        if self.hedged_calls >= self.config.max_hedge_ratio * self.calls:
+            return None
+        return self.latency.percentile(0.95)
+
+    async def acquire(self):
+        """Reserve a breaker pass and a bulkhead slot, or raise ServiceUnavailableError."""
+        if not self.breaker.allow():
+            self.rejections += 1
+            raise CircuitOpenError(self.service_name, self.endpoint)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.config.max_concurrent)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.config.max_wait)
+        except asyncio.TimeoutError:
+            self.breaker.release_probe()
+            self.rejections += 1
+            raise BulkheadFullError(self.service_name, self.endpoint) from None
+        self.in_flight += 1
+        self.calls += 1
+
+    def release(self, duration: float, error: Optional[BaseException]):
+        """Free the bulkhead slot and feed the outcome into the breaker and percentiles."""
+        self.in_flight -= 1
+        self._slots.release()
+        if error is None:
+            self.breaker.record_success()
+            self.latency.observe(duration)
+        elif isinstance(error, Exception):
+            if not is_service_failure(error):
+                # The service answered; the error is the caller's or a 4xx
+                self.breaker.record_success()
+                return
+            if isinstance(error, TimeoutError):
+                self.timeouts += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_probe()
+
+    def get_stats(self) -> dict:
+        p50 = self.latency.percentile(0.5)
+        p95 = self.latency.percentile(0.95)
+        p99 = self.latency.percentile(0.99)
+        return {
+            "service": self.service_name,
+            "endpoint": self.endpoint,
+            "circuit_state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "hedged_calls": self.hedged_calls,
+            "timeouts": self.timeouts,
+            "rejections": self.rejections,
+            "timeout_ms": round(self.timeout * 1000, 3),
+            "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 3) if p95 is not None else None,
+            "p99_ms": round(p99 * 1000, 3) if p99 is not None else None
+        }
+
+
+class CallGuard:
+    """Handle yielded by ``external_service_call`` for the call in progress."""
+
+    def __init__(self, policy: ResiliencePolicy):
+        self.policy = policy
+        self.timeout = policy.timeout
+        self.hedged = False
+
+    async def hedge(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run ``attempt`` and, if it has not finished by the p95, race a second copy.
+
+        The first successful result wins and the loser is cancelled. Only use
+        this for idempotent requests.
+        """
+        delay = self.policy.hedge_delay
+        pending = {asyncio.ensure_future(attempt())}
+        error: Optional[BaseException] = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self.hedged = True
+                    self.policy.hedged_calls += 1
+                    pending.add(asyncio.ensure_future(attempt()))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+_policies: "OrderedDict[Tuple[str, str], ResiliencePolicy]" = OrderedDict()
+_policy_configs: Dict[Tuple[str, str], ResilienceConfig] = {}
+_policies_lock = threading.Lock()
+
+
+def configure_endpoint(service_name: str, endpoint: str, config: ResilienceConfig):
+    """Set the resilience configuration for a (service, endpoint) before or after first use."""
+    key = (service_name, endpoint)
+    with _policies_lock:
+        _policy_configs[key] = config
+        _policies.pop(key, None)
+
+
+def get_policy(service_name: str, endpoint: str) -> ResiliencePolicy:
+    """Return the shared policy for a (service, endpoint), creating it on first use."""
+    key = (service_name, endpoint)
+    with _policies_lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = _policies[key] = ResiliencePolicy(service_name, endpoint, _policy_configs.get(key))
+            if len(_policies) > MAX_POLICIES:
+                _policies.popitem(last=False)
+        else:
+            _policies.move_to_end(key)
+    return policy
+
+
+def get_resilience_stats() -> list:
+    """Snapshot of every known (service, endpoint) policy."""
+    return [policy.get_stats() for policy in list(_policies.values())]
+
+
+def reset_policies():
+    """Forget all policies and endpoint configuration."""
+    with _policies_lock:
+        _policies.clear()
+        _policy_configs.clear()
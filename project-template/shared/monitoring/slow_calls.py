@@ -0,0 +1,227 @@
+"""
+Slow-call recorder for traced operations.
+
+``trace_function`` opens a span per call; database and external calls open
+child spans. When a call outlives its operation's threshold the coroutine
+stack of its task is snapshotted on the spot, and on completion the call is
+kept together with the shapes (never the values) of its arguments and its span
+tree. Only the ``capacity`` slowest calls since the last ``clear`` are kept.
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import itertools
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from shared.monitoring.profiler import coroutine_stack
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_CALL_THRESHOLD_SECONDS = 1.0
+DEFAULT_SLOW_CALL_CAPACITY = 100
+MAX_SPAN_CHILDREN = 100
+MAX_SHAPE_DEPTH = 2
+
+
+class Span:
+    """One timed operation and the operations it started."""
+
+    __slots__ = ('name', 'start_ns', 'duration_ns', 'error', 'children', 'dropped_children')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_ns = time.perf_counter_ns()
+        self.duration_ns: Optional[int] = None
+        self.error: Optional[str] = None
+        self.children: List['Span'] = []
+        self.dropped_children = 0
+
+    def to_dict(self, origin_ns: Optional[int] = None) -> dict:
+        origin_ns = self.start_ns if origin_ns is None else origin_ns
+        span = {
+            "name": self.name,
+            "offset_ms": round((self.start_ns - origin_ns) / 1e6, 3),
+            "duration_ms": round(self.duration_ns / 1e6, 3) if self.duration_ns is not None else None,
+            "children": [child.to_dict(origin_ns) for child in self.children]
+        }
+        if self.error:
+            span["error"] = self.error
+        if self.dropped_children:
+            span["dropped_children"] = self.dropped_children
+        return span
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def start_span(name: str):
+    """Open a span as a child of the current one; returns (span, token)."""
+    span = Span(name)
+    parent = _current_span.get()
+    if parent is not None:
+        if len(parent.children) < MAX_SPAN_CHILDREN:
+            parent.children.append(span)
+        else:
+            parent.dropped_children += 1
+    return span, _current_span.set(span)
+
+
+def end_span(span: Span, token, error: Optional[BaseException] = None):
+    """Close a span opened with start_span."""
+    span.duration_ns = time.perf_counter_ns() - span.start_ns
+    if error is not None:
+        span.error = type(error).__name__
+    _current_span.reset(token)
+
+
+def argument_shape(value: Any, depth: int = 0) -> str:
+    """
+    Describe a value by type and size without exposing its contents.
+
+    Usage:
+        argument_shape({"ids": [1, 2, 3]})  # -> "dict[1]"
+        argument_shape([{"a": 1}, {"b": 2}])  # -> "list[2]<dict[1]>"
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return type(value).__name__
+    if isinstance(value, (str, bytes, bytearray)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, dict):
+        return f"dict[{len(value)}]"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        shape = f"{type(value).__name__}[{len(value)}]"
+        if value and depth < MAX_SHAPE_DEPTH:
+            shape += f"<{argument_shape(next(iter(value)), depth + 1)}>"
+        return shape
+    return type(value).__qualname__
+
+
+class SlowCallWatch:
+    """State for one call being watched by a SlowCallRecorder."""
+
+    __slots__ = ('operation', 'threshold', 'args', 'kwargs', 'span', 'token', 'task', 'timer_handle', 'task_stack')
+
+    def __init__(self, operation: str, threshold: float, args: tuple, kwargs: dict):
+        self.operation = operation
+        self.threshold = threshold
+        self.args = args
+        self.kwargs = kwargs
+        self.span, self.token = start_span(operation)
+        self.task = None
+        self.timer_handle = None
+        self.task_stack: Optional[List[str]] = None
+
+
+class SlowCallRecorder:
+    """
+    Keeps the slowest calls that crossed their operation's threshold.
+
+    Calls live in a min-heap of ``capacity`` entries keyed on duration, so a
+    burst of barely-slow calls cannot push out the outliers.
+
+    Usage:
+        recorder = SlowCallRecorder(default_threshold=1.0)
+        recorder.set_threshold("user_service.list_users", 0.25)
+
+        watch = recorder.begin("user_service.list_users", args, kwargs)
+        try:
+            ...
+        finally:
+            recorder.end(watch, duration)
+    """
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_SLOW_CALL_CAPACITY,
+        default_threshold: float = DEFAULT_SLOW_CALL_THRESHOLD_SECONDS
+    ):
+        self.default_threshold = default_threshold
+        self.thresholds: Dict[str, float] = {}
+        self.capacity = capacity
+        # (duration, sequence, record); the fastest kept call is at index 0
+        self._calls: List[tuple] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def set_threshold(self, operation: str, seconds: float):
+        """Override the slow threshold for one operation."""
+        self.thresholds[operation] = seconds
+
+    def begin(self, operation: str, args: tuple, kwargs: dict, threshold: Optional[float] = None) -> SlowCallWatch:
+        """Open the call's span and arm the task stack snapshot."""
+        if threshold is None:
+            threshold = self.thresholds.get(operation, self.default_threshold)
+        watch = SlowCallWatch(operation, threshold, args, kwargs)
+        try:
+            watch.task = asyncio.current_task()
+        except RuntimeError:
+            watch.task = None
+        if watch.task is not None:
+            watch.timer_handle = watch.task.get_loop().call_later(threshold, self._snapshot, watch)
+        return watch
+
+    def _snapshot(self, watch: SlowCallWatch):
+        # Runs on the event loop while the watched task is suspended
+        watch.task_stack = coroutine_stack(watch.task.get_coro())
+
+    def end(self, watch: SlowCallWatch, duration: float, error: Optional[BaseException] = None):
+        """Close the call's span and keep the call if it was slow."""
+        end_span(watch.span, watch.token, error)
+        if watch.timer_handle is not None:
+            watch.timer_handle.cancel()
+        if duration < watch.threshold:
+            return
+        # Cheap pre-check before building the record; the push below re-checks
+        calls = self._calls
+        if len(calls) >= self.capacity and calls and duration <= calls[0][0]:
+            return
+
+        record = {
+            "operation": watch.operation,
+            "timestamp": datetime.utcnow().isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "threshold_ms": round(watch.threshold * 1000, 3),
+            "error": type(error).__name__ if error is not None else None,
+            "args": [argument_shape(arg) for arg in watch.args],
+            "kwargs": {name: argument_shape(value) for name, value in watch.kwargs.items()},
+            "span_tree": watch.span.to_dict(),
+            "task_stack": watch.task_stack
+        }
+        entry = (duration, next(self._sequence), record)
+        with self._lock:
+            if len(self._calls) < self.capacity:
+                heapq.heappush(self._calls, entry)
+            else:
+                heapq.heappushpop(self._calls, entry)
+
+        logger.warning(
+            f"Slow call recorded: {watch.operation}",
+            extra={
+                "custom_dimensions": {
+                    "operation": watch.operation,
+                    "duration_ms": record["duration_ms"],
+                    "threshold_ms": record["threshold_ms"]
+                }
+            }
+        )
+
+    def get_slow_calls(self, limit: int = 20, operation: Optional[str] = None) -> List[dict]:
+        """Recorded calls, slowest first."""
+        with self._lock:
+            entries = list(self._calls)
+        if operation is not None:
+            entries = [entry for entry in entries if entry[2]["operation"] == operation]
+        return [entry[2] for entry in heapq.nlargest(limit, entries)]
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+
+
+# Process-wide recorder used by trace_function
+slow_call_recorder = SlowCallRecorder()
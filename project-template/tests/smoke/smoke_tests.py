@@ -65,9 +65,10 @@ class SmokeTestRunner:
                 test_name = test.__name__
                 logger.info(f"Running {test_name}...")
                 
-                start_time = time.time()
+                # Monotonic clock so NTP adjustments cannot skew durations
+                start_ns = time.perf_counter_ns()
                 result = test()
-                duration = time.time() - start_time
+                duration = (time.perf_counter_ns() - start_ns) / 1e9
                 
                 if result:
                     logger.info(f"✅ {test_name} passed ({duration:.2f}s)")